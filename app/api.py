@@ -1,46 +1,437 @@
-from fastapi import FastAPI, HTTPException
-from app.similarity import run_similarity_analysis, get_available_jurisdictions
+import asyncio
+import logging
+import os
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Literal, Optional
+import psycopg2
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from app.similarity import (
+    run_cached_similarity_analysis, get_available_jurisdictions, get_available_concepts, get_similarity_matrix,
+    RESULT_CACHE, CONCEPT_MATCHES,
+)
+from app.neighbours import find_neighbours, NEIGHBOURS_MAX_K
+from app.utils.alerts import get_alerts, alert_volume, ALERT_DEFAULT_THRESHOLD, DEFAULT_VOLUME_THRESHOLDS
+from app.utils.buckets import DEFAULT_GRANULARITY, parse_granularity
+from app.utils.concurrency import EndpointLimiter, RequestCoalescer, TooBusy
+from app.utils.db_utils import get_pool, pool_stats, get_dataset_generation, DB_POOL_MAX, PoolTimeout
+from app.utils.embedding_store import get_store
+from app.utils.metrics import PROFILER, REGISTRY, add_gauges
+
+# ------------ Concurrency settings ------------ #
+# blocking psycopg2 calls run on IO_EXECUTOR, NumPy similarity work on COMPUTE_EXECUTOR, so a few
+# heavy comparisons can't starve the cheap endpoints of threads
+API_COMPUTE_WORKERS = int(os.getenv("API_COMPUTE_WORKERS", str(os.cpu_count() or 2)))
+API_IO_WORKERS = int(os.getenv("API_IO_WORKERS", str(DB_POOL_MAX)))
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))  # seconds a request may wait for a slot before 429
+API_WARM_UP = os.getenv("API_WARM_UP", "1") == "1"  # pay startup costs before serving rather than on the first request
+
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=API_IO_WORKERS, thread_name_prefix="api-io")
+COMPUTE_EXECUTOR = ThreadPoolExecutor(max_workers=API_COMPUTE_WORKERS, thread_name_prefix="api-compute")
+
+LIMITERS = {
+    "similarity": EndpointLimiter(
+        "similarity",
+        max_concurrent=int(os.getenv("SIMILARITY_MAX_CONCURRENT", str(API_COMPUTE_WORKERS))),
+        max_queue=int(os.getenv("SIMILARITY_MAX_QUEUE", "32")),
+        queue_timeout=API_QUEUE_TIMEOUT,
+    ),
+    "similarity_matrix": EndpointLimiter("similarity_matrix", max_concurrent=API_IO_WORKERS, max_queue=64, queue_timeout=API_QUEUE_TIMEOUT),
+    "neighbours": EndpointLimiter("neighbours", max_concurrent=API_IO_WORKERS, max_queue=64, queue_timeout=API_QUEUE_TIMEOUT),
+    "alerts": EndpointLimiter("alerts", max_concurrent=API_IO_WORKERS, max_queue=64, queue_timeout=API_QUEUE_TIMEOUT),
+    "jurisdictions": EndpointLimiter("jurisdictions", max_concurrent=API_IO_WORKERS, max_queue=256, queue_timeout=API_QUEUE_TIMEOUT),
+    "concepts": EndpointLimiter("concepts", max_concurrent=API_IO_WORKERS, max_queue=256, queue_timeout=API_QUEUE_TIMEOUT),
+}
+COALESCER = RequestCoalescer()
+# ---------------------------------------------- #
 
 app = FastAPI()
 
+def _profiled(endpoint: str, fn, *args):
+    # runs on the executor thread, which is the one doing the work worth sampling
+    with PROFILER.profile(endpoint):
+        return fn(*args)
+
+async def run_limited(endpoint: str, executor: ThreadPoolExecutor, fn, *args):
+    """
+    Run a blocking call on an executor under the endpoint's concurrency limit (429 when saturated).
+    With PROFILE_SLOW_MS set, calls slower than that leave a sampled profile in PROFILE_DIR.
+    """
+    try:
+        async with LIMITERS[endpoint]:
+            return await asyncio.get_running_loop().run_in_executor(executor, partial(_profiled, endpoint, fn, *args))
+    except TooBusy as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+def server_error(endpoint: str, e: Exception) -> HTTPException:
+    """
+    503 when the database is unreachable or the pool exhausted, 500 for anything else. The details
+    (which can name the database host) go to the log, not to the client.
+    """
+    if isinstance(e, (psycopg2.Error, PoolTimeout)):
+        logging.error(f"{endpoint}: database unavailable: {e}")
+        return HTTPException(status_code=503, detail="Database unavailable", headers={"Retry-After": "5"})
+    logging.exception(f"{endpoint}: unexpected error")
+    return HTTPException(status_code=500, detail="Internal server error")
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Request latency by route template (not raw path, to keep the label set small), method and status."""
+    start = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        route = request.scope.get("route")
+        REGISTRY.observe("http_request_seconds", time.perf_counter() - start,
+                         route=getattr(route, "path", "unmatched"), method=request.method, status=status)
+
+def warm_up() -> dict:
+    """
+    Load everything the first similarity request would otherwise wait for: the lazily imported
+    pandas, the database pool (plus the dataset generation query) or the embedding store when
+    EMBEDDING_STORE_DIR is set, and NumPy's BLAS threads.
+
+    Returns:
+        seconds spent per step
+    """
+    timings = {}
+
+    start = time.perf_counter()
+    import pandas  # noqa: F401  similarity imports it on first use
+    timings["imports"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if get_store() is not None:
+        timings["embedding_store"] = time.perf_counter() - start
+    else:
+        get_pool().prefill()
+        get_dataset_generation()
+        timings["database"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    import numpy as np
+    block = np.ones((256, 384), dtype=np.float32)
+    block @ block.T
+    timings["numpy"] = time.perf_counter() - start
+    return timings
+
+@app.on_event("startup")
+async def warm_up_on_startup():
+    if not API_WARM_UP:
+        return
+    try:
+        timings = await asyncio.get_running_loop().run_in_executor(IO_EXECUTOR, warm_up)
+        logging.info("API warm-up done: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+    except Exception as e:
+        # a database that isn't up yet shouldn't stop the API from starting
+        logging.warning(f"API warm-up failed, continuing cold: {e}")
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    IO_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+    COMPUTE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Welcome to the Similarity API"}
 
 #produced with GPT's help
 @app.get("/similarity/")
-def get_similarity(country_a: str, country_b: str):
+async def get_similarity(country_a: str, country_b: str, statistic: Literal["median", "mean"] = "median", granularity: str = DEFAULT_GRANULARITY,
+                         concepts: List[str] = Query(default=[]), concept_match: str = "any",
+                         start_date: Optional[date] = None, end_date: Optional[date] = None,
+                         last_n_buckets: Optional[int] = Query(default=None, ge=1)):
     """
     Endpoint to compute similarity between two countries over time.
-    
+
+    Identical concurrent requests (in either country order) share one computation.
+
     Args:
         country_a: First country/jurisdiction to compare (query parameter).
         country_b: Second country/jurisdiction to compare (query parameter).
-    
+        statistic: Per-bucket summary, 'median' (default) or 'mean' (query parameter).
+        granularity: Time buckets, 'day', 'week', '10d' (default), 'month' or 'rolling:N' for a
+            trailing N-day window ending on each day (query parameter).
+        concepts: Only compare documents tagged with these concept names, repeat the parameter
+            for several, e.g. concepts=AI&concepts=Enforcement (query parameter).
+        concept_match: 'any' (default) to match documents with at least one of the concepts,
+            'all' for documents with every one (query parameter).
+        start_date: Only documents published on or after this date, YYYY-MM-DD (query parameter).
+        end_date: Only documents published on or before this date, YYYY-MM-DD (query parameter).
+        last_n_buckets: Only the most recent N time buckets, up to end_date if given (query parameter).
+
     Returns:
         JSON response with similarity sequence.
     """
     try:
-        result = run_similarity_analysis(country_a, country_b)
-        if "error" in result:
-            raise HTTPException(status_code=404, detail=result["error"])
-        return result
+        parse_granularity(granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if concept_match not in CONCEPT_MATCHES:
+        raise HTTPException(status_code=400, detail=f"concept_match must be one of {CONCEPT_MATCHES}")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    key = ("similarity", tuple(sorted((country_a, country_b))), statistic, granularity, tuple(sorted(set(concepts))), concept_match,
+           start_date, end_date, last_n_buckets)
+    try:
+        result = await COALESCER.run(
+            key,
+            lambda: run_limited("similarity", COMPUTE_EXECUTOR, run_cached_similarity_analysis,
+                                country_a, country_b, None, statistic, granularity, concepts, concept_match,
+                                start_date, end_date, last_n_buckets),
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise server_error("similarity", e)
+
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    # a coalesced result may come from the request with the countries the other way round
+    return dict(result, country_a=country_a, country_b=country_b)
+
+@app.get("/similarity/matrix/")
+async def get_similarity_matrix_slice(jurisdiction: str = None, time_bucket: str = None, statistic: Literal["median", "mean"] = "median", run_id: int = None,
+                                      granularity: str = DEFAULT_GRANULARITY, ontology_id: Optional[str] = None):
+    """
+    Endpoint serving slices of the precomputed all-jurisdictions similarity matrix.
+
+    Args:
+        jurisdiction: Only comparisons against this jurisdiction, e.g. EU vs everyone (query parameter).
+        time_bucket: Only this time bucket (query parameter).
+        statistic: Statistic of the run to read, 'median' (default) or 'mean' (query parameter).
+        run_id: A specific stored run instead of the latest one (query parameter).
+        granularity: Granularity of the run to read, '10d' by default (query parameter).
+        ontology_id: Topic of the run to read, by default the runs over all documents (query parameter).
+
+    Returns:
+        JSON response with the run metadata and matrix entries.
+    """
+    try:
+        parse_granularity(granularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        result = await run_limited("similarity_matrix", IO_EXECUTOR, get_similarity_matrix, jurisdiction, time_bucket, statistic, run_id,
+                                   granularity, ontology_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise server_error("similarity_matrix", e)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/neighbours/")
+async def get_neighbours(doc_id: Optional[str] = None, text: Optional[str] = None, k: int = Query(default=10, ge=1, le=NEIGHBOURS_MAX_K),
+                         jurisdictions: List[str] = Query(default=[]), concepts: List[str] = Query(default=[]),
+                         concept_match: str = "any", start_date: Optional[date] = None, end_date: Optional[date] = None,
+                         compare_exact: bool = False):
+    """
+    Endpoint finding the documents most similar to a stored document or a piece of text, i.e. the
+    documents behind a similarity score.
+
+    Args:
+        doc_id: Find neighbours of this document, which is left out of the results (query parameter).
+        text: Or of this text, embedded with the ingest model; give exactly one of the two (query parameter).
+        k: Number of neighbours, 10 by default, at most 100 (query parameter).
+        jurisdictions: Only documents from these jurisdictions, repeat the parameter for several (query parameter).
+        concepts: Only documents tagged with these concept names, repeat the parameter for several (query parameter).
+        concept_match: 'any' (default) or 'all' of the concepts (query parameter).
+        start_date: Only documents published on or after this date, YYYY-MM-DD (query parameter).
+        end_date: Only documents published on or before this date, YYYY-MM-DD (query parameter).
+        compare_exact: Also run the exact search and report its latency and the recall of the
+            approximate one (query parameter).
+
+    Returns:
+        JSON response with the neighbours (doc_id, jurisdiction, published_date, title, score),
+        the search method and its latency.
+    """
+    if concept_match not in CONCEPT_MATCHES:
+        raise HTTPException(status_code=400, detail=f"concept_match must be one of {CONCEPT_MATCHES}")
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    # embedding a text query is model work, a doc_id query only waits on the database
+    executor = COMPUTE_EXECUTOR if text is not None else IO_EXECUTOR
+    key = ("neighbours", doc_id, text, k, tuple(sorted(set(jurisdictions))), tuple(sorted(set(concepts))), concept_match,
+           start_date, end_date, compare_exact)
+    try:
+        result = await COALESCER.run(
+            key,
+            lambda: run_limited("neighbours", executor, find_neighbours, doc_id, text, k, jurisdictions, concepts,
+                                concept_match, start_date, end_date, compare_exact),
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    
+        raise server_error("neighbours", e)
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+@app.get("/alerts/")
+async def get_alert_list(threshold: float = Query(default=ALERT_DEFAULT_THRESHOLD, gt=0), method: str = "cusum",
+                         jurisdiction: Optional[str] = None, other: Optional[str] = None, direction: Optional[str] = None,
+                         since: Optional[date] = None, limit: int = Query(default=100, ge=1, le=1000)):
+    """
+    Endpoint listing convergence and divergence alerts between jurisdiction pairs, most recent first.
+    The pair series behind them are updated by ingest after every run.
+
+    Args:
+        threshold: CUSUM decision interval in standard deviations, 4 by default; lower alerts sooner and
+            more often, see /alerts/volume/ (query parameter).
+        method: 'cusum' (default) alerts when a pair's cumulative drift passes the threshold, 'ewma'
+            on every bucket that far from the pair's recent average (query parameter).
+        jurisdiction: Only pairs involving this jurisdiction (query parameter).
+        other: With jurisdiction, only that pair, e.g. jurisdiction=UK&other=EU (query parameter).
+        direction: Only 'converging' or 'diverging' alerts (query parameter).
+        since: Only alerts for buckets starting on or after this date, YYYY-MM-DD (query parameter).
+        limit: At most this many alerts, 100 by default (query parameter).
+
+    Returns:
+        JSON response with the alerts and the number of changed days not yet in the series.
+    """
+    key = ("alerts", threshold, method, jurisdiction, other, direction, since, limit)
+    try:
+        return await COALESCER.run(
+            key,
+            lambda: run_limited("alerts", IO_EXECUTOR, get_alerts, threshold, method, jurisdiction, other, direction, since, limit),
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise server_error("alerts", e)
+
+@app.get("/alerts/volume/")
+async def get_alert_volume(thresholds: List[float] = Query(default=list(DEFAULT_VOLUME_THRESHOLDS)), method: str = "cusum",
+                           jurisdiction: Optional[str] = None, lookback_weeks: int = Query(default=26, ge=1)):
+    """
+    Endpoint estimating how many alerts per week a threshold would raise, from the alerts it
+    would have raised over the recent history of the series.
+
+    Args:
+        thresholds: Thresholds to evaluate, repeat the parameter for several (query parameter).
+        method: 'cusum' (default) or 'ewma', as for /alerts/ (query parameter).
+        jurisdiction: Only pairs involving this jurisdiction (query parameter).
+        lookback_weeks: Weeks of history to count over, 26 by default (query parameter).
+
+    Returns:
+        JSON response with the expected weekly alerts per threshold.
+    """
+    key = ("alerts_volume", tuple(sorted(set(thresholds))), method, jurisdiction, lookback_weeks)
+    try:
+        return await COALESCER.run(
+            key,
+            lambda: run_limited("alerts", IO_EXECUTOR, alert_volume, thresholds, method, jurisdiction, lookback_weeks),
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise server_error("alerts_volume", e)
+
 #produced with GPT's help
 @app.get("/jurisdictions/")
-def get_jurisdictions():
+async def get_jurisdictions():
     """
     Endpoint to fetch all available jurisdictions from the database.
-    
+
     Returns:
         JSON response with a list of jurisdictions.
     """
     try:
-        jurisdictions = get_available_jurisdictions()
-        if not jurisdictions:
-            raise HTTPException(status_code=404, detail="No jurisdictions found in the database.")
-        return {"jurisdictions": jurisdictions}
+        jurisdictions = await COALESCER.run(
+            ("jurisdictions",),
+            lambda: run_limited("jurisdictions", IO_EXECUTOR, get_available_jurisdictions),
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise server_error("jurisdictions", e)
+    if not jurisdictions:
+        raise HTTPException(status_code=404, detail="No jurisdictions found in the database.")
+    return {"jurisdictions": jurisdictions}
+
+@app.get("/concepts/")
+async def get_concepts():
+    """
+    Endpoint to fetch all concept names that documents are tagged with, for the concept filters
+    of /similarity/.
+
+    Returns:
+        JSON response with a list of concepts and their document counts.
+    """
+    try:
+        concepts = await COALESCER.run(
+            ("concepts",),
+            lambda: run_limited("concepts", IO_EXECUTOR, get_available_concepts),
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise server_error("concepts", e)
+    return {"concepts": concepts}
+
+@app.get("/pool/")
+async def get_pool_stats():
+    """
+    Endpoint reporting database connection pool statistics for this worker process.
+
+    Returns:
+        JSON response with in-use/idle counts, connections created and checkout wait times.
+    """
+    return pool_stats()
+
+@app.get("/cache/")
+async def get_cache_stats():
+    """
+    Endpoint reporting similarity result cache statistics for this worker process.
+
+    Returns:
+        JSON response with hit/miss/eviction counters and the cache size limits.
+    """
+    return RESULT_CACHE.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Endpoint exporting this worker process's metrics in the Prometheus text format: per-stage
+    timings and counters of the similarity code, request latencies, and the pool, cache and
+    concurrency limit stats as gauges.
+
+    Returns:
+        Plain text Prometheus exposition.
+    """
+    gauges = {}
+    add_gauges(gauges, "db_pool_", pool_stats())
+    add_gauges(gauges, "result_cache_", RESULT_CACHE.stats())
+    for name, limiter in LIMITERS.items():
+        add_gauges(gauges, "endpoint_", limiter.stats(), endpoint=name)
+    add_gauges(gauges, "", {"coalesced_requests": COALESCER.coalesced, "profiles_written": PROFILER.dumped})
+    return PlainTextResponse(REGISTRY.render(gauges), media_type="text/plain; version=0.0.4")
+
+@app.get("/limits/")
+async def get_limit_stats():
+    """
+    Endpoint reporting per-endpoint concurrency limits and request coalescing for this worker process.
+
+    Returns:
+        JSON response with running/queued/rejected counts per endpoint.
+    """
+    return {
+        "endpoints": {name: limiter.stats() for name, limiter in LIMITERS.items()},
+        "coalesced_requests": COALESCER.coalesced,
+    }
@@ -0,0 +1,157 @@
+"""
+Resumable ingest: a checkpoint file recording how far into the CSV ingest has committed, and a
+dead-letter CSV collecting the rows that failed validation or cleaning.
+
+Rows are numbered from 0 in file order (data rows, not lines, so quoted multi-line fields count
+once). Batches are written in file order, so once a batch has committed every row up to its last
+row number has been written, skipped or dead-lettered, and a resumed run can start right after it.
+"""
+
+from __future__ import annotations
+import csv
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+
+def _atomic_write(path: Path, text: str) -> None:
+    #write to a temp file, fsync, then rename over the old file, so a crash never leaves half a checkpoint
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class IngestCheckpoint:
+    """
+    Progress of an ingest run over one CSV, saved after every committed batch.
+
+    Attributes:
+        last_row: row number of the last row of the last committed batch, -1 before the first
+        batch_id: number of batches committed so far, counted across resumed runs
+        rows_written: rows written so far, counted across resumed runs
+        complete: the whole file has been processed
+    """
+
+    def __init__(self, path: Path, csv_path: Path):
+        self.path = Path(path)
+        self.csv_path = Path(csv_path)
+        self.last_row = -1
+        self.batch_id = 0
+        self.rows_written = 0
+        self.complete = False
+
+    def _source(self) -> dict:
+        stat = self.csv_path.stat()
+        return {"csv": str(self.csv_path.resolve()), "csv_size": stat.st_size, "csv_mtime": stat.st_mtime}
+
+    @classmethod
+    def start(cls, path: Path, csv_path: Path, resume: bool = False) -> "IngestCheckpoint":
+        """
+        The checkpoint for a run: a fresh one, or with resume the saved one if there is any.
+
+        Raises:
+            ValueError: the saved checkpoint belongs to another file, or the file has changed since
+        """
+        checkpoint = cls(path, csv_path)
+        if not resume or not checkpoint.path.exists():
+            if resume:
+                logging.info(f"No checkpoint at {checkpoint.path}, starting from the first row")
+            return checkpoint
+
+        with open(checkpoint.path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        source = checkpoint._source()
+        if any(saved.get(k) != v for k, v in source.items()):
+            raise ValueError(
+                f"Checkpoint {checkpoint.path} was written for {saved.get('csv')} "
+                f"(size {saved.get('csv_size')}), not the current {source['csv']} (size {source['csv_size']}); "
+                "delete it or run without --resume"
+            )
+        checkpoint.last_row = saved["last_row"]
+        checkpoint.batch_id = saved["batch_id"]
+        checkpoint.rows_written = saved["rows_written"]
+        checkpoint.complete = saved["complete"]
+        logging.info(
+            f"Resuming after row {checkpoint.last_row} (batch {checkpoint.batch_id}, "
+            f"{checkpoint.rows_written} rows written so far)"
+        )
+        return checkpoint
+
+    @property
+    def start_row(self) -> int:
+        """First row the run still has to process."""
+        return self.last_row + 1
+
+    def save(self) -> None:
+        state = {
+            **self._source(),
+            "last_row": self.last_row,
+            "batch_id": self.batch_id,
+            "rows_written": self.rows_written,
+            "complete": self.complete,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        _atomic_write(self.path, json.dumps(state, indent=2))
+
+    def commit(self, batch: List[dict]) -> None:
+        """Record a batch that has just been committed to the database."""
+        if not batch:
+            return
+        self.last_row = max(self.last_row, max(r["row_number"] for r in batch))
+        self.batch_id += 1
+        self.rows_written += len(batch)
+        self.save()
+
+    def finish(self) -> None:
+        self.complete = True
+        self.save()
+
+
+class DeadLetterFile:
+    """
+    CSV of the rows ingest rejected: their row number, the error, then the raw columns.
+
+    A fresh run starts a new file. A resumed run keeps the entries up to the checkpoint and drops
+    the later ones, since those rows are read again.
+    """
+
+    def __init__(self, path: Path, keep_through_row: int | None = None):
+        self.path = Path(path)
+        self.count = 0
+        self.fieldnames = None
+        kept = []
+        if keep_through_row is not None and self.path.exists():
+            with open(self.path, "r", encoding="utf-8", newline="") as f:
+                reader = csv.DictReader(f)
+                self.fieldnames = reader.fieldnames
+                kept = [r for r in reader if int(r["row_number"]) <= keep_through_row]
+        if self.fieldnames:
+            with open(self.path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+                writer.writeheader()
+                writer.writerows(kept)
+        elif self.path.exists():
+            self.path.unlink()
+
+    def write(self, rejected: List[dict]) -> None:
+        """Append rejected rows, i.e. raw rows with 'row_number' and 'error' added."""
+        if not rejected:
+            return
+        new_file = self.fieldnames is None
+        if new_file:
+            columns = [c for c in rejected[0] if c not in ("row_number", "error") and c is not None]
+            self.fieldnames = ["row_number", "error"] + columns
+        with open(self.path, "a", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rejected)
+        self.count += len(rejected)
+        for row in rejected:
+            logging.debug(f"Rejected row {row['row_number']}: {row['error']}")
@@ -0,0 +1,12 @@
+-- content hash of the raw source row + embedding model, so re-ingest can skip unchanged documents
+ALTER TABLE reginsights_clean ADD COLUMN IF NOT EXISTS content_hash    TEXT;
+ALTER TABLE reginsights_clean ADD COLUMN IF NOT EXISTS embedding_model TEXT;
+
+-- persistent text hash -> vector cache, so identical text is only ever embedded once per model
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    text_hash    TEXT NOT NULL,
+    model_name   TEXT NOT NULL,
+    embedding    REAL[] NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (text_hash, model_name)
+);
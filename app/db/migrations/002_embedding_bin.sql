@@ -0,0 +1,8 @@
+-- float32 copy of the embedding for bulk reads; see app/utils/vectors.py for the layout
+ALTER TABLE reginsights_clean ADD COLUMN IF NOT EXISTS embedding_bin BYTEA;
+
+-- backfill existing rows: vector_send() is an int16 dim, an int16 unused field, then the
+-- float4 values in network byte order, which is exactly what embedding_bin holds
+UPDATE reginsights_clean
+SET embedding_bin = substring(vector_send(embedding) FROM 5)
+WHERE embedding_bin IS NULL AND embedding IS NOT NULL;
@@ -0,0 +1,15 @@
+-- provisional: 006_daily_aggregates.sql replaces this table with daily_aggregates and drops it.
+-- Left as it was so databases that applied it keep the same migration history as new ones.
+-- per (jurisdiction, time_bucket) document count, sum of normalised embeddings and a small
+-- reservoir sample, maintained by ingest; see app/utils/aggregates.py.
+-- existing rows are aggregated with: python ingest.py --rebuild-aggregates
+CREATE TABLE IF NOT EXISTS bucket_aggregates (
+    jurisdiction     TEXT NOT NULL,
+    time_bucket      TEXT NOT NULL,
+    doc_count        INTEGER NOT NULL,
+    embedding_sum    BYTEA NOT NULL,              -- float64, network byte order
+    reservoir        BYTEA NOT NULL DEFAULT '',   -- up to k float32 vectors, network byte order
+    reservoir_seen   INTEGER NOT NULL DEFAULT 0,
+    updated_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (jurisdiction, time_bucket)
+);
@@ -0,0 +1,23 @@
+-- all-jurisdictions x all-jurisdictions x time bucket similarity, written by
+-- python -m app.similarity --matrix and served by /similarity/matrix/
+CREATE TABLE IF NOT EXISTS similarity_matrix_runs (
+    run_id          SERIAL PRIMARY KEY,
+    computed_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+    statistic       TEXT NOT NULL,
+    ontology_id     TEXT,
+    jurisdictions   TEXT[] NOT NULL,
+    time_buckets    TEXT[] NOT NULL
+);
+
+-- both (a, b) and (b, a) are stored so any jurisdiction's row is a single index range
+CREATE TABLE IF NOT EXISTS similarity_matrix (
+    run_id          INTEGER NOT NULL REFERENCES similarity_matrix_runs (run_id) ON DELETE CASCADE,
+    jurisdiction_a  TEXT NOT NULL,
+    jurisdiction_b  TEXT NOT NULL,
+    time_bucket     TEXT NOT NULL,
+    similarity      DOUBLE PRECISION NOT NULL,
+    pair_count      BIGINT NOT NULL,
+    PRIMARY KEY (run_id, jurisdiction_a, jurisdiction_b, time_bucket)
+);
+
+CREATE INDEX IF NOT EXISTS similarity_matrix_bucket_idx ON similarity_matrix (run_id, time_bucket);
@@ -0,0 +1,8 @@
+-- single-row counter bumped by every ingest commit; cached analysis results are keyed on it
+CREATE TABLE IF NOT EXISTS dataset_generation (
+    id          BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    generation  BIGINT NOT NULL DEFAULT 0,
+    updated_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+INSERT INTO dataset_generation (id, generation) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
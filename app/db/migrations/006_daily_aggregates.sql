@@ -0,0 +1,21 @@
+-- per (jurisdiction, published_date) document count, sum of normalised embeddings and a small
+-- reservoir sample; any query-time bucket (week, 10 days, month, rolling N days) is a range sum
+-- over these rows, see app/utils/aggregates.py and app/utils/buckets.py.
+-- existing rows are aggregated with: python ingest.py --rebuild-aggregates
+CREATE TABLE IF NOT EXISTS daily_aggregates (
+    jurisdiction     TEXT NOT NULL,
+    published_date   DATE NOT NULL,
+    doc_count        INTEGER NOT NULL,
+    embedding_sum    BYTEA NOT NULL,              -- float64, network byte order
+    reservoir        BYTEA NOT NULL DEFAULT '',   -- up to k float32 vectors, network byte order
+    reservoir_seen   INTEGER NOT NULL DEFAULT 0,
+    updated_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (jurisdiction, published_date)
+);
+
+-- the provisional per-10-day table from 003, superseded by daily_aggregates, which can be rolled
+-- up to any granularity. Nothing reads it any more, and daily_aggregates is filled from the
+-- documents themselves (--rebuild-aggregates), not from it
+DROP TABLE IF EXISTS bucket_aggregates;
+
+ALTER TABLE similarity_matrix_runs ADD COLUMN IF NOT EXISTS granularity TEXT NOT NULL DEFAULT '10d';
@@ -0,0 +1,21 @@
+-- ontology ids and concept names as arrays, so a document tagged with several concepts matches
+-- a filter on any one of them and the filter can use an index (&& for any-of, @> for all-of).
+-- the pipe-joined ontology_id / concept_names columns are kept for display.
+ALTER TABLE reginsights_clean ADD COLUMN IF NOT EXISTS ontology_ids TEXT[];
+ALTER TABLE reginsights_clean ADD COLUMN IF NOT EXISTS concepts TEXT[];
+
+-- same rules as extract_ontology_ids / extract_concepts in ingest.py
+UPDATE reginsights_clean SET
+    ontology_ids = ARRAY(
+        SELECT DISTINCT btrim(o) FROM unnest(string_to_array(ontology_id, '|')) AS o
+        WHERE btrim(o) <> ''
+    ),
+    concepts = ARRAY(
+        SELECT DISTINCT btrim(substr(o, position('_' IN o) + 1))
+        FROM unnest(string_to_array(ontology_id, '|')) AS o
+        WHERE position('_' IN o) > 0 AND btrim(substr(o, position('_' IN o) + 1)) <> ''
+    )
+WHERE ontology_ids IS NULL;
+
+CREATE INDEX IF NOT EXISTS reginsights_clean_ontology_ids_idx ON reginsights_clean USING GIN (ontology_ids);
+CREATE INDEX IF NOT EXISTS reginsights_clean_concepts_idx ON reginsights_clean USING GIN (concepts);
@@ -0,0 +1,10 @@
+-- similarity queries read one jurisdiction's embeddings in published_date order, optionally
+-- limited to a date range. This index serves the jurisdiction + date range filter, returns rows
+-- already in ORDER BY jurisdiction, published_date order and carries embedding_bin, so an
+-- unfiltered comparison is an index-only scan. Checked by benchmarks/check_query_plans.py.
+CREATE INDEX IF NOT EXISTS reginsights_clean_jurisdiction_date_idx
+    ON reginsights_clean (jurisdiction, published_date)
+    INCLUDE (embedding_bin)
+    WHERE embedding_bin IS NOT NULL;
+
+ANALYZE reginsights_clean;
@@ -0,0 +1,16 @@
+-- approximate nearest-neighbour index for /neighbours/ (see app/neighbours.py): HNSW where the
+-- installed pgvector has it (0.5.0+), IVFFlat otherwise. IVFFlat picks its list centroids from
+-- the rows present when the index is built, so rebuild it (REINDEX) after a large first ingest.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_am WHERE amname = 'hnsw') THEN
+        EXECUTE 'CREATE INDEX IF NOT EXISTS reginsights_clean_embedding_ann_idx
+                 ON reginsights_clean USING hnsw (embedding vector_cosine_ops)
+                 WITH (m = 16, ef_construction = 64)';
+    ELSE
+        EXECUTE 'CREATE INDEX IF NOT EXISTS reginsights_clean_embedding_ann_idx
+                 ON reginsights_clean USING ivfflat (embedding vector_cosine_ops)
+                 WITH (lists = 100)';
+    END IF;
+END
+$$;
@@ -0,0 +1,41 @@
+-- (jurisdiction, day) pairs whose daily_aggregates changed since the alert series last caught up.
+-- Marked by update_daily_aggregates in the ingest write transaction and consumed by
+-- update_alert_series (app/utils/alerts.py), so an update only touches the buckets and pairs the
+-- new documents fall into.
+CREATE TABLE IF NOT EXISTS alert_dirty_days (
+    jurisdiction     TEXT NOT NULL,
+    published_date   DATE NOT NULL,
+    marked_at        TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (jurisdiction, published_date)
+);
+
+-- per unordered jurisdiction pair (jurisdiction_a < jurisdiction_b) and time bucket: the mean
+-- similarity of the two buckets' documents and the EWMA / two-sided CUSUM state after it.
+-- Alerts are CUSUM threshold crossings (or EWMA z-scores) read at query time, see /alerts/.
+CREATE TABLE IF NOT EXISTS pair_similarity_series (
+    jurisdiction_a   TEXT NOT NULL,
+    jurisdiction_b   TEXT NOT NULL,
+    granularity      TEXT NOT NULL,
+    bucket_start     DATE NOT NULL,
+    bucket_end       DATE NOT NULL,
+    similarity       DOUBLE PRECISION NOT NULL,
+    pair_count       BIGINT NOT NULL,
+    observations     INTEGER NOT NULL,             -- buckets in the pair's series up to this one
+    ewma             DOUBLE PRECISION NOT NULL,
+    ewm_var          DOUBLE PRECISION NOT NULL,
+    z_score          DOUBLE PRECISION,             -- NULL during warm-up
+    cusum_up         DOUBLE PRECISION NOT NULL,
+    cusum_down       DOUBLE PRECISION NOT NULL,
+    updated_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (jurisdiction_a, jurisdiction_b, granularity, bucket_start)
+);
+
+CREATE INDEX IF NOT EXISTS pair_similarity_series_bucket_idx ON pair_similarity_series (granularity, bucket_start);
+
+-- the engine reads every jurisdiction's aggregates for the dirty days
+CREATE INDEX IF NOT EXISTS daily_aggregates_date_idx ON daily_aggregates (published_date);
+
+-- documents stored before this migration: the first update builds the series from all of them
+INSERT INTO alert_dirty_days (jurisdiction, published_date)
+SELECT jurisdiction, published_date FROM daily_aggregates
+ON CONFLICT DO NOTHING;
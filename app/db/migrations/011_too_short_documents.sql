@@ -0,0 +1,8 @@
+-- documents ingest dropped because too little text was left after stripping html, with the content
+-- hash of the row that was dropped, so incremental runs skip them like stored documents until
+-- their content changes
+CREATE TABLE IF NOT EXISTS too_short_documents (
+    doc_id        UUID PRIMARY KEY,
+    content_hash  TEXT NOT NULL,
+    dropped_at    TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -4,23 +4,50 @@ Chatgpt model used - GPT 4o
 """
 
 from __future__ import annotations
+import argparse
+import codecs
 import csv
+import hashlib
+import io
+import json
 import logging
+import os
+import time
 from pathlib import Path
-from typing import List, Generator
+from uuid import UUID
+from typing import Callable, List, Generator, Tuple
 from datetime import datetime, timedelta
 import psycopg2.extras
-from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
 from models import RegInsight
-from utils.db_utils import db_conn  
+from checkpoint import IngestCheckpoint, DeadLetterFile
+from utils.db_utils import db_conn, pooled_conn, apply_migrations, bump_dataset_generation
+from utils.vectors import encode_embedding, decode_embeddings
+from utils.aggregates import update_daily_aggregates, rebuild_daily_aggregates
+from utils.alerts import update_alert_series, rebuild_alert_series
+from utils import embedding_store
+from utils.encoders import get_encoder, EMBEDDING_MODEL_ID
+from utils.html_text import html_to_text
+from utils.pgcopy import encode_binary, encode_text
+from utils.metrics import REGISTRY, timed
 
 
 # ------------ Global variables ------------ #
 RAW_CSV = Path("/workspaces/archie_goodman_regbrain_challenge/data/RegInsight_Dataset(RegInsight Data).csv")
 BATCH_SIZE: int = 200
+EMBED_BATCH_SIZE: int = 64  # mini-batch size handed to the model in one encode() call
 MIN_CHARS: int = 500
-EMBEDDING_MODEL = SentenceTransformer('all-MiniLM-L6-v2') 
+PARSE_WORKERS: int = max(1, (os.cpu_count() or 2) - 1)  # pipelined mode: processes doing validation + html cleaning
+QUEUE_SIZE: int = 8  # pipelined mode: max batches waiting between two stages
+CHECKPOINT_FILE = RAW_CSV.parent / "ingest_checkpoint.json"  # progress of the last run, for --resume
+DEAD_LETTER_FILE = RAW_CSV.parent / "ingest_dead_letter.csv"  # rows that failed validation or cleaning
+SUMMARY_FILE = RAW_CSV.parent / "ingest_summary.json"  # per-stage timings and row counts of the last run
+# raw csv columns that end up in reginsights_clean - a change to any of them means the row must be re-ingested
+HASHED_COLUMNS = (
+    "RegInsightDocumentId", "CUBEJurisdiction", "CUBEPublishedDate",
+    "RegOntologyId", "RegInsightTitleNative", "RegInsightTextNative",
+)
+# csv columns RegInsight requires (its fields without a default), checked up front by the columnar loader
+REQUIRED_COLUMNS = tuple(f.alias for f in RegInsight.model_fields.values() if f.is_required() and f.alias)
 # ---------------------------------------- #
 #this function was produced with help from chatgpt
 def ten_day_bucket(date: datetime) -> str:
@@ -33,9 +60,8 @@ def ten_day_bucket(date: datetime) -> str:
 def strip_html(text: str) -> str:
     """Clean HTML content."""
     try:
-        return " ".join(
-            BeautifulSoup(text or "", "lxml").get_text(" ", strip=True).split()
-        )
+        with timed("ingest.strip_html"):
+            return html_to_text(text)
     except Exception as e:
         logging.warning(f"Error stripping HTML: {e}. Returning empty string.")
         return ""
@@ -43,125 +69,922 @@ def strip_html(text: str) -> str:
 #this function produced with help from chatgpt
 def extract_concept_names(ontology_id: str) -> str:
     """Extract concept names from ontology ID strings."""
-    if not ontology_id:
-        return ""
-    
-    # Split by pipe to get individual concepts
-    concepts = ontology_id.split('|')
-    
-    # For each concept, extract the part after the underscore
-    concept_names = []
-    for concept in concepts:
-        if '_' in concept:
-            concept_names.append(concept.split('_', 1)[1])
-    
     # Join with pipe separator for storage
-    return '|'.join(concept_names)
+    return '|'.join(extract_concepts(ontology_id))
+
+def extract_ontology_ids(ontology_id: str) -> List[str]:
+    """Split a pipe-joined ontology ID string into its distinct ids, e.g. '1_AI|2_Enforcement' -> ['1_AI', '2_Enforcement']."""
+    ids = (part.strip() for part in (ontology_id or "").split('|'))
+    return list(dict.fromkeys(i for i in ids if i))
+
+def extract_concepts(ontology_id: str) -> List[str]:
+    """Distinct concept names of an ontology ID string: the part of each id after the first underscore."""
+    names = (i.split('_', 1)[1].strip() for i in extract_ontology_ids(ontology_id) if '_' in i)
+    return list(dict.fromkeys(n for n in names if n))
 
 def get_embedding(text: str) -> list:
-    embedding = EMBEDDING_MODEL.encode(text)
+    with timed("ingest.embed") as t:
+        embedding = get_encoder().encode([text])[0]
+        t.items = 1
     return embedding.tolist()
 
+def token_lengths(texts: List[str]) -> List[int]:
+    """Number of tokens the model will actually see for each text (i.e. after truncation)."""
+    return get_encoder().token_lengths(texts)
+
+def get_embeddings(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> List[list]:
+    """
+    Embed many texts at once.
+
+    Texts are sorted by token length so that each mini-batch pads to a similar length,
+    encoded batch_size at a time, and the results put back into the original order.
+
+    Args:
+        texts: texts to embed
+        batch_size: number of texts per encode() call
+
+    Returns:
+        list of embeddings, aligned with texts
+    """
+    if not texts:
+        return []
+
+    lengths = token_lengths(texts)
+    order = sorted(range(len(texts)), key=lambda i: lengths[i])
+
+    encoder = get_encoder()
+    embeddings: List[list] = [None] * len(texts)
+    with timed("ingest.embed") as t:
+        for start in range(0, len(order), batch_size):
+            chunk = order[start:start + batch_size]
+            vectors = encoder.encode([texts[i] for i in chunk], batch_size=len(chunk))
+            for i, vector in zip(chunk, vectors):
+                embeddings[i] = vector.tolist()
+        t.items = len(texts)
+
+    return embeddings
+
+def embed_batch(rows: List[dict], batch_size: int = EMBED_BATCH_SIZE, use_cache: bool = False) -> List[dict]:
+    """
+    Fill in the 'embedding' field of a batch of cleaned rows.
+
+    Args:
+        rows: cleaned rows
+        batch_size: number of texts per encode() call
+        use_cache: take embeddings from the embedding_cache table where possible and add the new ones to it
+    """
+    if not use_cache:
+        embeddings = get_embeddings([r["clean_text"] for r in rows], batch_size)
+        for row, embedding in zip(rows, embeddings):
+            row["embedding"] = embedding
+        return rows
+
+    hashes = [text_hash(r["clean_text"]) for r in rows]
+    cached = read_embedding_cache(list(set(hashes)))
+
+    misses = {}  # text hash -> text, so duplicate texts within the batch are embedded once
+    for row, h in zip(rows, hashes):
+        if h not in cached:
+            misses.setdefault(h, row["clean_text"])
+
+    miss_hashes = list(misses)
+    new_embeddings = get_embeddings([misses[h] for h in miss_hashes], batch_size)
+    write_embedding_cache(list(zip(miss_hashes, new_embeddings)))
+    cached.update(zip(miss_hashes, new_embeddings))
+
+    for row, h in zip(rows, hashes):
+        row["embedding"] = list(cached[h])
+    logging.debug(f"Embedding cache: {len(rows) - len(miss_hashes)} hits, {len(miss_hashes)} misses")
+    return rows
+
 def parse_date(date_str: str) -> datetime:
     """Parse date string in 'MM/DD/YYYY' format."""
     return datetime.strptime(date_str, "%m/%d/%Y")
 
+def content_hash(row: dict) -> str:
+    """Hash of the raw csv fields we store plus the embedding model, used to skip unchanged documents."""
+    h = hashlib.sha256(EMBEDDING_MODEL_ID.encode("utf-8"))
+    for column in HASHED_COLUMNS:
+        h.update(b"\x1f")
+        h.update((row.get(column) or "").encode("utf-8"))
+    return h.hexdigest()
+
+def text_hash(text: str) -> str:
+    """Key for the embedding cache."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def stored_content_hashes(doc_ids: List[str]) -> dict:
+    """
+    Content hashes already processed for each of the given doc_ids: the stored document's, and the
+    one it was last dropped as too short with, if any.
+    """
+    stored = {}
+    if not doc_ids:
+        return stored
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """SELECT doc_id::text, content_hash FROM reginsights_clean WHERE doc_id = ANY(%s::uuid[])
+               UNION ALL
+               SELECT doc_id::text, content_hash FROM too_short_documents WHERE doc_id = ANY(%s::uuid[])""",
+            (doc_ids, doc_ids),
+        )
+        for doc_id, row_hash in cur.fetchall():
+            stored.setdefault(doc_id, set()).add(row_hash)
+    return stored
+
+def record_too_short(documents: List[Tuple[str, str]]) -> None:
+    """Remember the (doc_id, content_hash) of rows dropped as too short, so incremental runs skip them."""
+    if not documents:
+        return
+    documents = list(dict(documents).items())  # last hash per doc_id, ON CONFLICT can't see one twice
+    with pooled_conn() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(
+            cur,
+            """INSERT INTO too_short_documents (doc_id, content_hash) VALUES %s
+               ON CONFLICT (doc_id) DO UPDATE SET content_hash = EXCLUDED.content_hash, dropped_at = now()""",
+            documents,
+        )
+
+def lookup_doc_ids(doc_ids: List[str]) -> List[str]:
+    """
+    The raw doc_ids of a chunk that can be looked up in the uuid doc_id column. A blank or malformed
+    id would fail the whole query, so those rows are left out here and count as changed, for
+    validation to reject them.
+    """
+    return [d for d in set(doc_ids) if _is_uuid(d)]
+
+def filter_changed_rows(rows: List[dict]) -> List[dict]:
+    """Drop raw rows whose content hash matches what is already stored for their doc_id."""
+    if not rows:
+        return rows
+
+    doc_ids = [(r.get("RegInsightDocumentId") or "").strip().lower() for r in rows]
+    stored = stored_content_hashes(lookup_doc_ids(doc_ids))
+
+    changed = [
+        row for row, doc_id in zip(rows, doc_ids)
+        if content_hash(row) not in stored.get(doc_id, ())
+    ]
+    logging.debug(f"Incremental: {len(rows) - len(changed)} of {len(rows)} rows unchanged, skipping them")
+    return changed
+
+def read_embedding_cache(hashes: List[str]) -> dict:
+    """Look up cached embeddings for the current model by text hash."""
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT text_hash, embedding FROM embedding_cache WHERE model_name = %s AND text_hash = ANY(%s)",
+            (EMBEDDING_MODEL_ID, hashes),
+        )
+        return dict(cur.fetchall())
+
+def write_embedding_cache(entries: List[tuple]):
+    """Store (text_hash, embedding) pairs for the current model."""
+    if not entries:
+        return
+    with pooled_conn() as conn, conn.cursor() as cur:
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO embedding_cache (text_hash, model_name, embedding) VALUES %s ON CONFLICT DO NOTHING",
+            [(h, EMBEDDING_MODEL_ID, embedding) for h, embedding in entries],
+        )
+
+# (column, COPY type) of everything ingest writes to reginsights_clean, in the order it is sent
+WRITE_COLUMNS = (
+    ("doc_id", "uuid"), ("jurisdiction", "text"), ("ontology_id", "text"), ("concept_names", "text"),
+    ("ontology_ids", "text[]"), ("concepts", "text[]"), ("time_bucket", "text"), ("published_date", "date"),
+    ("title", "text"), ("clean_text", "text"), ("embedding", "vector"), ("embedding_bin", "bytea"),
+    ("content_hash", "text"), ("embedding_model", "text"),
+)
+#upsert used by both writers; {source} is VALUES %s for insert_batch and a SELECT from staging for CopyWriter
+UPSERT_SQL = (
+    f"INSERT INTO reginsights_clean ({', '.join(c for c, _ in WRITE_COLUMNS)}) {{source}} "
+    "ON CONFLICT (doc_id) DO UPDATE SET "
+    + ", ".join(f"{c} = EXCLUDED.{c}" for c, _ in WRITE_COLUMNS if c != "doc_id")
+)
+INSERT_PAGE_SIZE = 100  # rows per INSERT statement, execute_values' default
+STAGING_TABLE = "reginsights_staging"
+
+def row_values(r: dict) -> tuple:
+    """Values of a row in WRITE_COLUMNS order."""
+    return (
+        r["doc_id"],
+        r["jurisdiction"],
+        r["ontology_id"],
+        r["concept_names"],
+        r["ontology_ids"],
+        r["concepts"],
+        r["time_bucket"],
+        r["published_date"],
+        r["title"],
+        r["clean_text"],
+        r["embedding"],
+        encode_embedding(r["embedding"]),
+        r["content_hash"],
+        EMBEDDING_MODEL_ID,
+    )
+
+def log_write(writer: str, rows: int, seconds: float, sent: int) -> None:
+    logging.info(
+        f"{writer}: wrote {rows} rows in {seconds:.2f}s "
+        f"({rows / max(seconds, 1e-9):.0f} rows/sec, {sent / 1e6:.2f} MB sent)"
+    )
+
+def record_write(writer: str, rows: int, seconds: float, sent: int) -> None:
+    REGISTRY.observe("stage_seconds", seconds, stage=f"ingest.write.{writer}")
+    REGISTRY.inc("stage_items_total", rows, stage=f"ingest.write.{writer}")
+    REGISTRY.inc("ingest_bytes_sent_total", sent, writer=writer)
+
 def insert_batch(rows: List[dict]):
     #inserts a batch or rows into pg table. if there's a conflict, it just overwrites for now. suitable for the MVP
-    sql = """INSERT INTO reginsights_clean
-    (doc_id, jurisdiction, ontology_id, concept_names, time_bucket,
-     published_date, title, clean_text, embedding)
-    VALUES %s
-    ON CONFLICT (doc_id) DO UPDATE SET 
-        jurisdiction = EXCLUDED.jurisdiction, 
-        ontology_id = EXCLUDED.ontology_id,
-        concept_names = EXCLUDED.concept_names,
-        time_bucket = EXCLUDED.time_bucket,
-        published_date = EXCLUDED.published_date, 
-        title = EXCLUDED.title, 
-        clean_text = EXCLUDED.clean_text,
-        embedding = EXCLUDED.embedding;
-    """
-    values = [
-        (
-            r["doc_id"],
-            r["jurisdiction"],
-            r["ontology_id"],
-            r["concept_names"], 
-            r["time_bucket"],
-            r["published_date"],
-            r["title"],
-            r["clean_text"],
-            r["embedding"],
+    #a doc_id that appears more than once keeps its last row, as in CopyWriter.write, so the daily
+    #aggregates (and the alert days they mark) count each document once
+    rows = list({r["doc_id"]: r for r in rows}.values())
+    if not rows:
+        return
+    sql = UPSERT_SQL.format(source="VALUES %s")
+    values = []
+    for r in rows:
+        v = row_values(r)
+        values.append(v[:11] + (psycopg2.Binary(v[11]),) + v[12:])
+
+    start = time.perf_counter()
+    sent = 0
+    with pooled_conn() as conn, conn.cursor() as cur:
+        previous = fetch_previous_versions(cur, [r["doc_id"] for r in rows])
+        for page in range(0, len(values), INSERT_PAGE_SIZE):
+            psycopg2.extras.execute_values(cur, sql, values[page:page + INSERT_PAGE_SIZE], page_size=INSERT_PAGE_SIZE)
+            sent += len(cur.query)
+        update_daily_aggregates(
+            cur,
+            added=[(r["jurisdiction"], r["published_date"], r["embedding"]) for r in rows],
+            removed=previous,
         )
-        for r in rows
-    ]
+        bump_dataset_generation(cur)
+    seconds = time.perf_counter() - start
+    record_write("insert", len(rows), seconds, sent)
+    log_write("insert", len(rows), seconds, sent)
 
-    with db_conn() as conn, conn.cursor() as cur:
-        psycopg2.extras.execute_values(cur, sql, values)
+class CopyWriter:
+    """
+    Bulk writer for a whole ingest run, the faster alternative to insert_batch.
 
-def read_csv_in_batches(file_path: Path, batch_size: int) -> Generator[List[dict], None, None]:
-    #generator to read csv and yeild batches of rows
-    with open(file_path, "r", encoding="latin1") as csvfile:  #latin1 is a very tolerant csv encoding - change in prod? 
-        reader = csv.DictReader(csvfile)
-        batch = []
-        for row in reader:
+    Each batch is streamed with COPY FROM STDIN (binary format) into a temporary staging table
+    and merged into reginsights_clean with one upsert, in the same transaction that updates the
+    daily aggregates and the dataset generation. Temporary tables aren't WAL-logged and belong to
+    this connection, which is kept open for the whole run. If the server rejects the binary
+    payload the writer switches to text-format COPY for the rest of the run.
+
+    Usage:
+        with CopyWriter() as writer:
+            writer.write(batch)
+    """
+
+    def __init__(self, binary: bool = True):
+        self.binary = binary
+        self.rows = 0
+        self.bytes_sent = 0
+        self.seconds = 0.0
+        self.conn = db_conn()
+        self.conn.set_client_encoding("UTF8")
+        with self.conn, self.conn.cursor() as cur:
+            cur.execute(
+                f"""CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+                    (LIKE reginsights_clean INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"""
+            )
+        columns = ", ".join(c for c, _ in WRITE_COLUMNS)
+        self.merge_sql = UPSERT_SQL.format(source=f"SELECT {columns} FROM {STAGING_TABLE}")
+
+    def write(self, rows: List[dict]) -> None:
+        """Write one batch; a doc_id that appears more than once keeps its last row."""
+        rows = list({r["doc_id"]: r for r in rows}.values())
+        if not rows:
+            return
+
+        start = time.perf_counter()
+        try:
+            sent = self._write(rows)
+        except (psycopg2.DataError, psycopg2.ProgrammingError) as e:
+            if not self.binary:
+                raise
+            logging.warning(f"Binary COPY rejected ({e.__class__.__name__}: {str(e).strip()}), switching to text format")
+            self.binary = False
+            sent = self._write(rows)
+
+        seconds = time.perf_counter() - start
+        self.rows += len(rows)
+        self.bytes_sent += sent
+        self.seconds += seconds
+        record_write("copy", len(rows), seconds, sent)
+        log_write(f"copy ({'binary' if self.binary else 'text'})", len(rows), seconds, sent)
+
+    def _write(self, rows: List[dict]) -> int:
+        types = [t for _, t in WRITE_COLUMNS]
+        values = [row_values(r) for r in rows]
+        payload = encode_binary(values, types) if self.binary else encode_text(values, types)
+        columns = ", ".join(c for c, _ in WRITE_COLUMNS)
+        options = "FORMAT binary" if self.binary else "FORMAT text"
+
+        #the transaction rolls back as a whole on error, staging rows included
+        with self.conn, self.conn.cursor() as cur:
+            cur.copy_expert(f"COPY {STAGING_TABLE} ({columns}) FROM STDIN WITH ({options})", io.BytesIO(payload))
+            previous = fetch_previous_versions(cur, [r["doc_id"] for r in rows])
+            cur.execute(self.merge_sql)
+            update_daily_aggregates(
+                cur,
+                added=[(r["jurisdiction"], r["published_date"], r["embedding"]) for r in rows],
+                removed=previous,
+            )
+            bump_dataset_generation(cur)
+        return len(payload)
+
+    def close(self) -> None:
+        if self.rows:
+            log_write(f"copy ({'binary' if self.binary else 'text'}) total", self.rows, self.seconds, self.bytes_sent)
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def fetch_previous_versions(cur, doc_ids: List[str]) -> list:
+    """
+    Lock and return the stored (jurisdiction, published_date, embedding) of documents about to be
+    overwritten, so their contribution can be taken out of the daily aggregates.
+    """
+    cur.execute(
+        """SELECT jurisdiction, published_date, embedding_bin FROM reginsights_clean
+           WHERE doc_id = ANY(%s::uuid[]) AND embedding_bin IS NOT NULL
+           FOR UPDATE""",
+        (doc_ids,),
+    )
+    stored = cur.fetchall()
+    embeddings = decode_embeddings(r[2] for r in stored)
+    return [(r[0], r[1], e) for r, e in zip(stored, embeddings)]
+
+def clean_row(row: dict) -> dict | None:
+    """
+    Validate and clean one raw CSV row.
+
+    Returns:
+        the cleaned row ready for embedding, or None if too little text is left after stripping html
+
+    Raises:
+        Exception: on any invalid value, which clean_rows logs and rejects the row for
+    """
+    row_hash = content_hash(row)
+
+    #blank required fields are rejected, the same check clean_frame does per column
+    missing = [c for c in REQUIRED_COLUMNS if not (row.get(c) or "").strip()]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+
+    #first sort out dates
+    published_date = parse_date(row["CUBEPublishedDate"])  
+
+    # call datamodel (on a copy, so a rejected row is kept as it was read)
+    validated_row = RegInsight(**{**row, "CUBEPublishedDate": published_date.isoformat()})
+    clean_text = strip_html(validated_row.text_native)
+    
+    #some rows have too little text after stripping html 
+    if len(clean_text) < MIN_CHARS:
+        return None
+
+    return {
+        "doc_id": validated_row.doc_id,
+        "jurisdiction": validated_row.jurisdiction,
+        "ontology_id": validated_row.ontology_id,
+        "concept_names": extract_concept_names(validated_row.ontology_id),
+        "ontology_ids": extract_ontology_ids(validated_row.ontology_id),
+        "concepts": extract_concepts(validated_row.ontology_id),
+        "time_bucket": ten_day_bucket(published_date),
+        "published_date": published_date.date(),  # Use the parsed datetime object
+        "title": validated_row.title,
+        "clean_text": clean_text,
+        "content_hash": row_hash,
+        "row_number": row.get("row_number"),
+    }
+
+def error_reason(e: Exception) -> str:
+    """One-line reason for the dead-letter file."""
+    return " ".join(f"{type(e).__name__}: {e}".split())
+
+def log_rejected(rejected: List[dict]) -> None:
+    #one line per rejected row, without the row itself (the dead-letter file has it)
+    for row in rejected:
+        logging.warning(f"Skipping row {row['row_number']} (doc_id {row.get('RegInsightDocumentId') or '?'}): {row['error']}")
+
+def clean_rows(rows: List[dict]) -> Tuple[List[dict], List[dict], List[Tuple[str, str]]]:
+    """
+    Clean a chunk of raw rows, dropping the ones that are too short. Runs in the parse worker processes.
+
+    Returns:
+        (cleaned rows, rejected rows, too short), the rejected being the raw rows that failed with an
+        'error' added and too short the (doc_id, content_hash) of the dropped rows
+    """
+    cleaned, rejected, too_short = [], [], []
+    with timed("ingest.clean") as t:
+        for row in rows:
             try:
-                #first sort out dates
-                published_date = parse_date(row["CUBEPublishedDate"])  
-                row["CUBEPublishedDate"] = published_date.isoformat()  
-
-                # call datamodel
-                validated_row = RegInsight(**row)
-                clean_text = strip_html(validated_row.text_native)
-                
-                #some rows have too little text after stripping html 
-                if len(clean_text) >= MIN_CHARS:
-
-                    embedding = get_embedding(clean_text)
-                    
-                    batch.append(
-                        {
-                            "doc_id": validated_row.doc_id,
-                            "jurisdiction": validated_row.jurisdiction,
-                            "ontology_id": validated_row.ontology_id,
-                            "concept_names": extract_concept_names(validated_row.ontology_id),
-                            "time_bucket": ten_day_bucket(published_date),
-                            "published_date": published_date.date(),  # Use the parsed datetime object
-                            "title": validated_row.title,
-                            "clean_text": clean_text,
-                            "embedding": embedding,
-                        }
-                    )
-                    
-                if len(batch) >= batch_size:
-                    yield batch
-                    batch = []
+                result = clean_row(row)
             except Exception as e:
-                logging.warning(f"Error processing row: {row}. Skipping. Error: {e}")
-                raise e
+                rejected.append({**row, "error": error_reason(e)})
+                continue
+            if result is not None:
+                cleaned.append(result)
+            else:
+                too_short.append((row["RegInsightDocumentId"], content_hash(row)))
+        t.items = len(rows)
+    log_rejected(rejected)
+    return cleaned, rejected, too_short
+
+def read_raw_rows_in_chunks(file_path: Path, chunk_size: int, incremental: bool = False, start_row: int = 0,
+                            encoding: str | None = None) -> Generator[List[dict], None, None]:
+    #generator to read csv and yield chunks of raw, unvalidated rows. incremental drops rows whose stored hash is unchanged
+    #rows get their row_number (0-based, in file order); rows before start_row are skipped
+    #encoding is detected as for read_raw_frames_in_chunks, and undecodable bytes are replaced the same way
+    encoding = encoding or detect_encoding(file_path)
+    logging.info(f"Reading {file_path} as {encoding}")
+    with open(file_path, "r", encoding=encoding, errors="replace") as csvfile:
+        reader = csv.DictReader(csvfile)
+        chunk = []
+        for row_number, row in enumerate(reader):
+            if row_number < start_row:
+                continue
+            row["row_number"] = row_number
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield filter_changed_rows(chunk) if incremental else chunk
+                chunk = []
+
+        if chunk:
+            yield filter_changed_rows(chunk) if incremental else chunk
+
+def read_csv_in_batches(
+    file_path: Path,
+    batch_size: int,
+    incremental: bool = False,
+    start_row: int = 0,
+    reject_fn: Callable[[List[dict]], None] | None = None,
+    too_short_fn: Callable[[List[Tuple[str, str]]], None] | None = None,
+) -> Generator[List[dict], None, None]:
+    #generator to read csv and yeild batches of cleaned rows. embeddings are added afterwards by embed_batch
+    #rows that fail validation or cleaning are logged and go to reject_fn instead of stopping the run, and the
+    #(doc_id, content_hash) of rows dropped as too short to too_short_fn
+    batch = []
+    for chunk in read_raw_rows_in_chunks(file_path, batch_size, incremental, start_row):
+        cleaned, rejected, too_short = clean_rows(chunk)
+        if rejected and reject_fn is not None:
+            reject_fn(rejected)
+        if too_short and too_short_fn is not None:
+            too_short_fn(too_short)
+        for row in cleaned:
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if batch:
+        yield batch
+
+def detect_encoding(file_path: Path, sample_size: int = 1 << 20) -> str:
+    """
+    Guess the encoding of a csv from its first sample_size bytes: the byte order mark if there is
+    one, else utf-8 if the sample decodes as utf-8, else cp1252 (Excel's export on Windows), else
+    latin1, which accepts any byte.
+    """
+    with open(file_path, "rb") as f:
+        sample = f.read(sample_size)
+    for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")):
+        if sample.startswith(bom):
+            return encoding
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            #final=False so a character cut off at the end of the sample isn't an error
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin1"
+
+def check_columns(columns) -> None:
+    """Raise ValueError if the csv lacks any column RegInsight requires."""
+    missing = [c for c in REQUIRED_COLUMNS if c not in set(columns)]
+    if missing:
+        raise ValueError(f"CSV is missing required columns: {', '.join(missing)}")
+
+def _is_uuid(value: str) -> bool:
+    #same check as RegInsight.doc_id_is_uuid
+    try:
+        UUID(value)
+        return True
+    except ValueError:
+        return False
+
+def _rejected_rows(frame, reasons) -> List[dict]:
+    #raw rows of a chunk as dicts with their row number and error, for the dead-letter file
+    records = frame.drop(columns="_content_hash", errors="ignore").fillna("").to_dict("index")
+    return [{**row, "row_number": i, "error": reason} for (i, row), reason in zip(records.items(), reasons)]
+
+def content_hashes(frame) -> List[str]:
+    """content_hash of every row of a raw csv chunk."""
+    #plain lists: iterating a pandas column element by element is much slower
+    columns = [frame[c].fillna("").tolist() if c in frame.columns else [""] * len(frame) for c in HASHED_COLUMNS]
+    return [content_hash(dict(zip(HASHED_COLUMNS, values))) for values in zip(*columns)]
+
+def filter_changed_frame(frame):
+    """
+    Columnar counterpart of filter_changed_rows. The hashes are kept in a _content_hash column so
+    clean_frame doesn't compute them again.
+    """
+    if frame.empty:
+        return frame
+
+    frame = frame.assign(_content_hash=content_hashes(frame))
+    doc_ids = frame["RegInsightDocumentId"].fillna("").str.strip().str.lower()
+    stored = stored_content_hashes(lookup_doc_ids(doc_ids.tolist()))
+
+    changed = frame[[h not in stored.get(d, ()) for d, h in zip(doc_ids, frame["_content_hash"])]]
+    logging.debug(f"Incremental: {len(frame) - len(changed)} of {len(frame)} rows unchanged, skipping them")
+    return changed
+
+def clean_frame(frame) -> Tuple[List[dict], List[dict], List[Tuple[str, str]]]:
+    """
+    Columnar counterpart of clean_rows: validate and clean a chunk read by read_raw_frames_in_chunks,
+    dropping the rows that are too short.
+
+    The checks RegInsight does per row are done per column, and dates are parsed and bucketed for
+    the whole chunk at once, so only the html cleaning is left per row. Rows with missing or blank
+    required values or unparseable dates are rejected, as clean_rows rejects what clean_row raises on.
+
+    Returns:
+        (cleaned rows, the same dicts clean_row produces, rejected raw rows with an 'error' added,
+        (doc_id, content_hash) of the rows dropped as too short)
+    """
+    import pandas as pd
+
+    with timed("ingest.clean") as t:
+        t.items = len(frame)
+        if frame.empty:
+            return [], [], []
+        check_columns(frame.columns)
+
+        #read with keep_default_na=False, so an empty field is "" rather than NaN
+        missing_values = frame[list(REQUIRED_COLUMNS)].fillna("").apply(lambda column: column.str.strip().eq(""))
+        missing = missing_values.any(axis=1)
+        bad_id = ~missing & ~frame["RegInsightDocumentId"].map(_is_uuid, na_action="ignore").fillna(False).astype(bool)
+        dates = pd.to_datetime(frame["CUBEPublishedDate"], format="%m/%d/%Y", errors="coerce")
+        bad_date = dates.isna() & ~missing & ~bad_id
+        rejected = _rejected_rows(
+            frame[missing],
+            [f"missing {', '.join(columns[columns].index)}" for _, columns in missing_values[missing].iterrows()],
+        ) + _rejected_rows(
+            frame[bad_id],
+            [f"RegInsightDocumentId is not a UUID: {value!r}" for value in frame.loc[bad_id, "RegInsightDocumentId"]],
+        ) + _rejected_rows(
+            frame[bad_date],
+            [f"unparseable CUBEPublishedDate {value!r}" for value in frame.loc[bad_date, "CUBEPublishedDate"]],
+        )
+        log_rejected(rejected)
+        valid = ~(missing | bad_id | bad_date)
+        frame, dates = frame[valid], dates[valid]
+        if frame.empty:
+            return [], rejected, []
+
+        #same buckets as ten_day_bucket: back to day 1, 11, 21 (or 31) of the month, ten days long
+        starts = dates - pd.to_timedelta((dates.dt.day - 1) % 10, unit="D")
+        labels = {s: f"{s:%Y-%m-%d} to {s + pd.Timedelta(days=9):%Y-%m-%d}" for s in starts.unique()}
+        #ontology strings repeat a lot, so split each distinct one once
+        topics = {
+            o: (extract_concept_names(o), extract_ontology_ids(o), extract_concepts(o))
+            for o in frame["RegOntologyId"].unique()
+        }
+        hashes = frame["_content_hash"].tolist() if "_content_hash" in frame.columns else content_hashes(frame)
+        buckets = starts.map(labels).tolist()
 
-        if batch:
-            yield batch
+        rows, too_short = [], []
+        for row_number, doc_id, jurisdiction, ontology_id, title, text, published_date, bucket, row_hash in zip(
+            frame.index.tolist(),
+            *(frame[c].tolist() for c in ("RegInsightDocumentId", "CUBEJurisdiction", "RegOntologyId", "RegInsightTitleNative", "RegInsightTextNative")),
+            dates.dt.date.tolist(), buckets, hashes,
+        ):
+            clean_text = strip_html(text)
+            #some rows have too little text after stripping html
+            if len(clean_text) < MIN_CHARS:
+                too_short.append((doc_id, row_hash))
+                continue
+
+            concept_names, ontology_ids, concepts = topics[ontology_id]
+            rows.append({
+                "doc_id": doc_id,
+                "jurisdiction": jurisdiction,
+                "ontology_id": ontology_id,
+                "concept_names": concept_names,
+                "ontology_ids": list(ontology_ids),
+                "concepts": list(concepts),
+                "time_bucket": bucket,
+                "published_date": published_date,
+                "title": title,
+                "clean_text": clean_text,
+                "content_hash": row_hash,
+                "row_number": row_number,
+            })
+        return rows, rejected, too_short
+
+def read_raw_frames_in_chunks(
+    file_path: Path,
+    chunk_size: int,
+    incremental: bool = False,
+    start_row: int = 0,
+    encoding: str | None = None,
+):
+    """
+    Columnar counterpart of read_raw_rows_in_chunks: yields the csv as DataFrame chunks of raw strings.
+
+    Args:
+        file_path: csv to read
+        chunk_size: rows per chunk
+        incremental: drop rows whose stored content hash is unchanged
+        start_row: skip the rows before this one. The frames are indexed by row number either way.
+        encoding: csv encoding, detected from the start of the file if not given. Bytes that
+            don't decode further into the file are replaced rather than failing the run.
+    """
+    import pandas as pd
+
+    encoding = encoding or detect_encoding(file_path)
+    logging.info(f"Reading {file_path} as {encoding}")
+    #everything as str and empty fields as "", like csv.DictReader. Fields missing from a short row
+    #read as "" here and None there, and both modes reject them as missing
+    with pd.read_csv(
+        file_path, chunksize=chunk_size, dtype=str, keep_default_na=False,
+        encoding=encoding, encoding_errors="replace",
+        skiprows=range(1, start_row + 1) if start_row else None,  #counts records, like DictReader
+    ) as reader:
+        for i, frame in enumerate(reader):
+            if i == 0:
+                check_columns(frame.columns)
+            frame.index = frame.index + start_row
+            yield filter_changed_frame(frame) if incremental else frame
+
+def read_csv_in_batches_columnar(
+    file_path: Path,
+    batch_size: int,
+    incremental: bool = False,
+    start_row: int = 0,
+    reject_fn: Callable[[List[dict]], None] | None = None,
+    too_short_fn: Callable[[List[Tuple[str, str]]], None] | None = None,
+) -> Generator[List[dict], None, None]:
+    """Columnar counterpart of read_csv_in_batches, yielding the same batches of cleaned rows."""
+    batch = []
+    for frame in read_raw_frames_in_chunks(file_path, batch_size, incremental, start_row):
+        cleaned, rejected, too_short = clean_frame(frame)
+        if rejected and reject_fn is not None:
+            reject_fn(rejected)
+        if too_short and too_short_fn is not None:
+            too_short_fn(too_short)
+        batch.extend(cleaned)
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+
+    if batch:
+        yield batch
+
+def write_run_summary(path: Path, summary: dict) -> None:
+    """Add the per-stage timings recorded during the run to summary, log them and save it all as JSON."""
+    stages = REGISTRY.stage_summary()
+    for stage, s in stages.items():
+        items = f", {s['items']:.0f} items" if "items" in s else ""
+        logging.info(
+            f"{stage}: {s.get('calls', 0)} calls, {s.get('seconds', 0.0):.2f}s total, "
+            f"mean {s.get('mean_ms', 0.0):.2f}ms, max {s.get('max_ms', 0.0):.1f}ms{items}"
+        )
+    summary["stages"] = stages
+    summary["bytes_sent"] = {dict(labels)["writer"]: sent for labels, sent in REGISTRY.counters("ingest_bytes_sent_total").items()}
+    summary["html_fallbacks"] = sum(REGISTRY.counters("html_fallbacks_total").values())
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, default=str)
+    logging.info(f"Run summary written to {path}")
+
+def update_alerts(summary: dict) -> None:
+    #folds the days this run changed into the alert series. a failure here leaves the days marked
+    #for the next run (or --rebuild-alerts) rather than failing an ingest whose data is committed
+    try:
+        summary["alerts"] = update_alert_series()
+    except Exception as e:
+        logging.exception(f"Updating the alert series failed, the changed days stay queued: {e}")
+        summary["alerts"] = {"error": error_reason(e)}
+
+def refresh_embedding_store(summary: dict) -> None:
+    #with EMBEDDING_STORE_DIR set, similarity reads a snapshot, so re-export it once the run is committed.
+    #like the alert update, a failure keeps the previous snapshot rather than failing the run
+    if not embedding_store.EMBEDDING_STORE_DIR:
+        return
+    conn = db_conn()
+    try:
+        summary["embedding_store"] = str(embedding_store.export_embedding_store(conn, Path(embedding_store.EMBEDDING_STORE_DIR)))
+    except Exception as e:
+        logging.exception(f"Exporting the embedding store failed, similarity keeps reading the previous snapshot: {e}")
+        summary["embedding_store"] = {"error": error_reason(e)}
+    finally:
+        conn.close()
+
+def log_dead_letters(dead_letter: DeadLetterFile) -> None:
+    if dead_letter.count:
+        logging.warning(f"{dead_letter.count} rows failed validation or cleaning, see {dead_letter.path}")
 
 #this function produced with help from chatgpt
-def run_ingest() -> None:
-    """Load and clean batches of data into the PostgreSQL table."""
+def run_ingest(
+    pipelined: bool = False,
+    parse_workers: int = PARSE_WORKERS,
+    queue_size: int = QUEUE_SIZE,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    incremental: bool = False,
+    loader: str = "columnar",
+    writer: str = "copy",
+    resume: bool = False,
+    checkpoint_path: Path = CHECKPOINT_FILE,
+    dead_letter_path: Path = DEAD_LETTER_FILE,
+    summary_path: Path | None = SUMMARY_FILE,
+) -> None:
+    """
+    Load and clean batches of data into the PostgreSQL table.
+
+    Args:
+        pipelined: run parse/clean, embed and write as concurrent stages instead of one after another
+        parse_workers: number of processes validating and cleaning rows (pipelined mode only)
+        queue_size: max batches waiting between two stages (pipelined mode only)
+        embed_batch_size: number of texts per encode() call
+        incremental: only process rows that are new or changed since the last run, and reuse cached embeddings
+        loader: 'columnar' reads and validates the csv a chunk at a time with pandas, 'rows' row by row
+        writer: 'copy' streams batches through a staging table over one connection (CopyWriter),
+            'insert' sends multi-row INSERTs (insert_batch)
+        resume: continue after the last batch recorded in the checkpoint instead of from the first row
+        checkpoint_path: where progress is recorded after every committed batch
+        dead_letter_path: csv receiving the rows that fail validation or cleaning, with the reason
+        summary_path: where to save the run's per-stage timings and row counts, None to skip
+    """
     logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
     logging.info("Starting data ingestion.")
 
+    if loader not in ("columnar", "rows"):
+        raise ValueError(f"Unknown loader {loader!r}, expected 'columnar' or 'rows'")
+    columnar = loader == "columnar"
+    if writer not in ("copy", "insert"):
+        raise ValueError(f"Unknown writer {writer!r}, expected 'copy' or 'insert'")
+
+    copy_writer = None
+    dead_letter = None
+    summary = {
+        "started_at": datetime.now().astimezone().isoformat(),
+        "csv": str(RAW_CSV),
+        "options": {"pipelined": pipelined, "loader": loader, "writer": writer, "incremental": incremental, "resume": resume},
+        "status": "failed",
+        "rows_written": 0,
+    }
+    started = time.perf_counter()
     try:
+        apply_migrations()
+        if writer == "copy":
+            copy_writer = CopyWriter()
+        write_fn = copy_writer.write if copy_writer else insert_batch
+
+        checkpoint = IngestCheckpoint.start(checkpoint_path, RAW_CSV, resume)
+        if checkpoint.complete:
+            logging.info(f"{RAW_CSV} was already ingested completely according to {checkpoint_path}, nothing to resume")
+            summary["status"] = "already complete"
+            return
+        dead_letter = DeadLetterFile(dead_letter_path, keep_through_row=checkpoint.last_row if resume else None)
+
+        def write_and_checkpoint(batch: List[dict]) -> None:
+            write_fn(batch)
+            checkpoint.commit(batch)
+            summary["rows_written"] += len(batch)
+
+        if pipelined:
+            from pipeline import run_pipeline
+
+            total_kept = run_pipeline(
+                (read_raw_frames_in_chunks if columnar else read_raw_rows_in_chunks)(
+                    RAW_CSV, BATCH_SIZE, incremental, checkpoint.start_row,
+                ),
+                clean_fn=clean_frame if columnar else clean_rows,
+                embed_fn=lambda batch: embed_batch(batch, embed_batch_size, use_cache=incremental),
+                write_fn=write_and_checkpoint,
+                reject_fn=dead_letter.write,
+                too_short_fn=record_too_short,
+                batch_size=BATCH_SIZE,
+                parse_workers=parse_workers,
+                queue_size=queue_size,
+            )
+            checkpoint.finish()
+            summary["status"] = "completed"
+            logging.info(f"Ingestion completed. Total rows kept: {total_kept}")
+            update_alerts(summary)
+            refresh_embedding_store(summary)
+            log_dead_letters(dead_letter)
+            return
+
         total_kept = 0
-        for batch in read_csv_in_batches(RAW_CSV, BATCH_SIZE):
-            insert_batch(batch)
+        embed_seconds = 0.0
+        run_start = time.perf_counter()
+        read_batches = read_csv_in_batches_columnar if columnar else read_csv_in_batches
+        for batch in read_batches(RAW_CSV, BATCH_SIZE, incremental, checkpoint.start_row, dead_letter.write, record_too_short):
+            embed_start = time.perf_counter()
+            embed_batch(batch, embed_batch_size, use_cache=incremental)
+            batch_embed_seconds = time.perf_counter() - embed_start
+            embed_seconds += batch_embed_seconds
+
+            write_and_checkpoint(batch)
             total_kept += len(batch)
-            logging.info(f"Inserted batch of {len(batch)} rows (total kept: {total_kept})")
+            elapsed = time.perf_counter() - run_start
+            logging.info(
+                f"Inserted batch of {len(batch)} rows (total kept: {total_kept}, "
+                f"embed: {len(batch) / max(batch_embed_seconds, 1e-9):.1f} docs/sec, "
+                f"overall: {total_kept / max(elapsed, 1e-9):.1f} docs/sec)"
+            )
 
-        logging.info(f"Ingestion completed. Total rows kept: {total_kept}")
+        elapsed = time.perf_counter() - run_start
+        logging.info(
+            f"Ingestion completed. Total rows kept: {total_kept} in {elapsed:.1f}s "
+            f"({total_kept / max(elapsed, 1e-9):.1f} docs/sec overall, "
+            f"{total_kept / max(embed_seconds, 1e-9):.1f} docs/sec embedding)"
+        )
+        checkpoint.finish()
+        summary["status"] = "completed"
+        update_alerts(summary)
+        refresh_embedding_store(summary)
+        log_dead_letters(dead_letter)
 
     except Exception as e:
         logging.exception(f"An unexpected error occurred during ingestion: {e}")
+        summary["error"] = error_reason(e)
         raise e
+    finally:
+        if copy_writer is not None:
+            copy_writer.close()
+        if summary_path is not None:
+            summary.update(
+                finished_at=datetime.now().astimezone().isoformat(),
+                seconds=time.perf_counter() - started,
+                rows_rejected=dead_letter.count if dead_letter is not None else 0,
+            )
+            write_run_summary(summary_path, summary)
+
+def rebuild_aggregates() -> None:
+    """Recompute the daily aggregates from the documents already in the table."""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    apply_migrations()
+    conn = db_conn()
+    try:
+        logging.info(f"Rebuilt daily aggregates from {rebuild_daily_aggregates(conn)} documents")
+    finally:
+        conn.close()
+
+def rebuild_alerts() -> None:
+    """Recompute the alert series of every jurisdiction pair from the daily aggregates."""
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    apply_migrations()
+    conn = db_conn()
+    try:
+        rebuild_alert_series(conn)
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
-    run_ingest()
+    parser = argparse.ArgumentParser(description="Ingest the RegInsight CSV into PostgreSQL.")
+    parser.add_argument("--pipeline", action="store_true", help="run parse/clean, embed and write stages concurrently")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="processes used to validate and clean rows")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="max batches buffered between pipeline stages")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE, help="texts per encode() call")
+    parser.add_argument("--incremental", action="store_true", help="skip rows unchanged since the last run and reuse cached embeddings")
+    parser.add_argument("--loader", choices=("columnar", "rows"), default="columnar", help="read the csv a chunk at a time (columnar) or row by row")
+    parser.add_argument("--writer", choices=("copy", "insert"), default="copy", help="bulk COPY through a staging table, or multi-row INSERTs")
+    parser.add_argument("--resume", action="store_true", help="continue after the last committed batch of the previous run")
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_FILE, help="progress file written after every committed batch")
+    parser.add_argument("--dead-letter", type=Path, default=DEAD_LETTER_FILE, help="csv receiving rows that fail validation or cleaning")
+    parser.add_argument("--summary", type=Path, default=SUMMARY_FILE, help="json file receiving per-stage timings and row counts of the run")
+    parser.add_argument("--rebuild-aggregates", action="store_true", help="recompute daily_aggregates from the stored documents and exit")
+    parser.add_argument("--rebuild-alerts", action="store_true", help="recompute the alert series of every jurisdiction pair and exit")
+    args = parser.parse_args()
+
+    if args.rebuild_aggregates:
+        rebuild_aggregates()
+    elif args.rebuild_alerts:
+        rebuild_alerts()
+    else:
+        run_ingest(
+            pipelined=args.pipeline,
+            parse_workers=args.parse_workers,
+            queue_size=args.queue_size,
+            embed_batch_size=args.embed_batch_size,
+            incremental=args.incremental,
+            loader=args.loader,
+            writer=args.writer,
+            resume=args.resume,
+            checkpoint_path=args.checkpoint,
+            dead_letter_path=args.dead_letter,
+            summary_path=args.summary,
+        )
@@ -1,7 +1,7 @@
 from datetime import datetime
 from uuid import UUID
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, field_validator
 
 class RegInsight(BaseModel):
     doc_id: str = Field(alias="RegInsightDocumentId")
@@ -16,4 +16,11 @@ class RegInsight(BaseModel):
     issuing_body: str | None = Field(default=None, alias="CUBEIssuingBody")
     issuance_type: str | None = Field(default=None, alias="IssuanceType")
     status: str | None = Field(default=None, alias="Status")
-    source_url: str | None = Field(default=None, alias="RegInsightSourceLink")
\ No newline at end of file
+    source_url: str | None = Field(default=None, alias="RegInsightSourceLink")
+
+    @field_validator("doc_id")
+    @classmethod
+    def doc_id_is_uuid(cls, value: str) -> str:
+        # reginsights_clean.doc_id is a UUID, so reject bad ids here rather than fail the whole write
+        UUID(value)
+        return value
@@ -0,0 +1,195 @@
+"""
+Top-k nearest-neighbour search over the stored document embeddings, to show which documents are
+behind a similarity score, e.g. the USA documents closest to a given EU document.
+
+The ORDER BY embedding <=> query LIMIT k queries are served by the approximate index on
+reginsights_clean.embedding (HNSW, or IVFFlat on pgvector versions without HNSW; see
+db/migrations/009_embedding_ann_index.sql). The same query can also run exactly, without the
+index, which is what the recall figures are measured against.
+
+pgvector applies the WHERE filters to the candidates the index returns, so a selective filter
+can leave fewer than k results. The search then falls back to the exact query, which the
+jurisdiction, date and concept indexes keep cheap for exactly those selective filters.
+"""
+
+from __future__ import annotations
+import datetime
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+import numpy as np
+
+from app.similarity import topic_filter_sql
+from app.utils.db_utils import pooled_conn
+from app.utils.vectors import decode_embeddings, vector_literal
+
+ANN_INDEX = "reginsights_clean_embedding_ann_idx"
+NEIGHBOURS_EF_SEARCH = int(os.getenv("NEIGHBOURS_EF_SEARCH", "100"))  # HNSW candidate list size, at least k
+NEIGHBOURS_PROBES = int(os.getenv("NEIGHBOURS_PROBES", "10"))  # IVFFlat lists visited per query
+NEIGHBOURS_MAX_K = 100
+
+
+def neighbours_query(vector: np.ndarray, k: int, jurisdictions: Optional[List[str]] = None,
+                     concepts: Optional[List[str]] = None, concept_match: str = "any",
+                     start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None,
+                     exclude_doc_id: Optional[str] = None) -> Tuple[str, list]:
+    """
+    The k documents closest to vector by cosine distance, with the filters pushed down.
+
+    Returns:
+        (query, params)
+    """
+    params: list = [vector_literal(vector)]
+    query = """
+        SELECT doc_id::text, jurisdiction, published_date, title, embedding <=> %s::vector AS distance
+        FROM reginsights_clean
+        WHERE embedding IS NOT NULL
+    """
+    if jurisdictions:
+        query += " AND jurisdiction = ANY(%s)"
+        params.append(list(jurisdictions))
+    if start_date:
+        query += " AND published_date >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND published_date <= %s"
+        params.append(end_date)
+    if exclude_doc_id:
+        query += " AND doc_id <> %s::uuid"
+        params.append(exclude_doc_id)
+
+    topic_sql, topic_params = topic_filter_sql(concepts=concepts, concept_match=concept_match)
+    query += topic_sql
+    params.extend(topic_params)
+
+    # ordering by the select-list distance lets the planner use the index for it
+    return query + " ORDER BY distance LIMIT %s", params + [k]
+
+
+def ann_index_method(cur) -> Optional[str]:
+    """Access method of the approximate index ('hnsw' or 'ivfflat'), None if it doesn't exist."""
+    cur.execute(
+        "SELECT am.amname FROM pg_class c JOIN pg_am am ON am.oid = c.relam WHERE c.relname = %s",
+        (ANN_INDEX,),
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def search_neighbours(cur, vector: np.ndarray, k: int, exact: bool = False, **filters) -> List[Dict]:
+    """
+    Run one neighbour query inside the caller's transaction.
+
+    Args:
+        cur: cursor; the planner settings are SET LOCAL, so they end with the transaction
+        vector: query embedding
+        k: number of neighbours
+        exact: compare against every matching document instead of using the approximate index
+        **filters: see neighbours_query
+
+    Returns:
+        [{'doc_id', 'jurisdiction', 'published_date', 'title', 'score'}], best first; score is the cosine similarity
+    """
+    # the ANN index can only be used by a plain index scan, so turning those off makes the query exact
+    # while bitmap scans of the filter indexes stay available
+    cur.execute(f"SET LOCAL enable_indexscan = {'off' if exact else 'on'}")
+    cur.execute("SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                (str(max(NEIGHBOURS_EF_SEARCH, k)), str(NEIGHBOURS_PROBES)))
+    query, params = neighbours_query(vector, k, **filters)
+    cur.execute(query, params)
+    return [
+        {
+            "doc_id": doc_id,
+            "jurisdiction": jurisdiction,
+            "published_date": published_date.isoformat(),
+            "title": title,
+            "score": 1.0 - float(distance),
+        }
+        for doc_id, jurisdiction, published_date, title, distance in cur.fetchall()
+    ]
+
+
+def recall_at_k(approximate: List[Dict], exact: List[Dict]) -> float:
+    """Share of the exact top-k that the approximate search found."""
+    if not exact:
+        return 1.0
+    found = {r["doc_id"] for r in approximate}
+    return sum(r["doc_id"] in found for r in exact) / len(exact)
+
+
+def find_neighbours(doc_id: Optional[str] = None, text: Optional[str] = None, k: int = 10,
+                    jurisdictions: Optional[List[str]] = None, concepts: Optional[List[str]] = None,
+                    concept_match: str = "any", start_date: Optional[datetime.date] = None,
+                    end_date: Optional[datetime.date] = None, compare_exact: bool = False) -> Dict:
+    """
+    Documents most similar to a stored document or to a piece of text.
+
+    Args:
+        doc_id: find neighbours of this document (itself excluded)
+        text: or of this text, embedded with the ingest model
+        k: number of neighbours, 1 to NEIGHBOURS_MAX_K
+        jurisdictions: only documents from these jurisdictions
+        concepts: only documents tagged with these concepts
+        concept_match: 'any' or 'all' of the concepts
+        start_date: only documents published on or after this date
+        end_date: only documents published on or before this date
+        compare_exact: also run the exact search and report its latency and the recall@k
+
+    Returns:
+        dict with the neighbours, the method used and its latency, or an error message
+
+    Raises:
+        ValueError: invalid arguments
+    """
+    if (doc_id is None) == (text is None):
+        raise ValueError("Give exactly one of doc_id or text")
+    if not 1 <= k <= NEIGHBOURS_MAX_K:
+        raise ValueError(f"k must be between 1 and {NEIGHBOURS_MAX_K}")
+    if doc_id is not None:
+        doc_id = str(UUID(doc_id))  # ValueError for malformed ids
+
+    with pooled_conn() as conn, conn.cursor() as cur:
+        if doc_id is not None:
+            cur.execute(
+                "SELECT embedding_bin FROM reginsights_clean WHERE doc_id = %s::uuid AND embedding_bin IS NOT NULL",
+                (doc_id,),
+            )
+            row = cur.fetchone()
+            if row is None:
+                return {"error": f"No embedded document with doc_id {doc_id}"}
+            vector = decode_embeddings([row[0]])[0]
+        else:
+            from app.utils.encoders import get_encoder  # deferred: loads the embedding model
+            vector = get_encoder().encode([text])[0]
+
+        filters = dict(jurisdictions=jurisdictions, concepts=concepts, concept_match=concept_match,
+                       start_date=start_date, end_date=end_date, exclude_doc_id=doc_id)
+        method = ann_index_method(cur) or "exact"
+
+        start = time.perf_counter()
+        neighbours = search_neighbours(cur, vector, k, exact=method == "exact", **filters)
+        latency = time.perf_counter() - start
+        fell_back = len(neighbours) < k and method != "exact"
+        if fell_back:
+            # the filters removed too many index candidates, the exact query returns everything that matches
+            start = time.perf_counter()
+            neighbours = search_neighbours(cur, vector, k, exact=True, **filters)
+            latency += time.perf_counter() - start
+
+        result = {
+            "doc_id": doc_id,
+            "k": k,
+            "method": method,
+            "exact_fallback": fell_back,
+            "latency_ms": latency * 1000,
+            "neighbours": neighbours,
+        }
+        if compare_exact:
+            start = time.perf_counter()
+            exact = search_neighbours(cur, vector, k, exact=True, **filters)
+            result["exact"] = {
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "recall": recall_at_k(neighbours, exact),
+            }
+        return result
@@ -0,0 +1,224 @@
+"""
+Pipelined ingest: parse/clean -> embed -> write as concurrent stages.
+
+A process pool validates and cleans raw CSV chunks, a single embedding thread owns the model,
+and a writer thread drains embedded batches into the database. Bounded queues between the
+stages give backpressure, so a slow stage throttles the ones in front of it instead of
+letting batches pile up in memory.
+"""
+
+from __future__ import annotations
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Tuple
+from utils.metrics import REGISTRY
+
+_DONE = object()  # sentinel passed down the queues once the input is exhausted
+
+
+@dataclass
+class StageStats:
+    """Throughput and queue depth counters for one pipeline stage."""
+    name: str
+    items: int = 0
+    batches: int = 0
+    busy_seconds: float = 0.0
+    queue_depth_total: int = 0
+    queue_depth_max: int = 0
+
+    def record(self, items: int, seconds: float, queue_depth: int) -> None:
+        self.items += items
+        self.batches += 1
+        self.busy_seconds += seconds
+        self.queue_depth_total += queue_depth
+        self.queue_depth_max = max(self.queue_depth_max, queue_depth)
+
+    def summary(self, wall_seconds: float) -> str:
+        busy_rate = self.items / self.busy_seconds if self.busy_seconds else 0.0
+        wall_rate = self.items / wall_seconds if wall_seconds else 0.0
+        avg_depth = self.queue_depth_total / self.batches if self.batches else 0.0
+        utilisation = self.busy_seconds / wall_seconds if wall_seconds else 0.0
+        return (
+            f"{self.name}: {self.items} docs in {self.batches} batches, "
+            f"{busy_rate:.1f} docs/sec busy, {wall_rate:.1f} docs/sec wall, "
+            f"busy {utilisation:.0%} of wall time, "
+            f"input queue depth avg {avg_depth:.1f} / max {self.queue_depth_max}"
+        )
+
+
+def _timed_call(fn: Callable[[List[dict]], tuple], rows: List[dict]) -> Tuple[tuple, float, dict]:
+    #runs in the worker process so the parse stage reports its own busy time, and hands back the
+    #metrics fn recorded there for the parent to merge
+    start = time.perf_counter()
+    result = fn(rows)
+    return result, time.perf_counter() - start, REGISTRY.take()
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    #blocking put that gives up if another stage has failed, so we never deadlock on a full queue
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(
+    raw_chunks: Iterable[List[dict]],
+    clean_fn: Callable[[List[dict]], Tuple[List[dict], List[dict], List[Tuple[str, str]]]],
+    embed_fn: Callable[[List[dict]], List[dict]],
+    write_fn: Callable[[List[dict]], None],
+    batch_size: int,
+    parse_workers: int,
+    queue_size: int,
+    reject_fn: Callable[[List[dict]], None] | None = None,
+    too_short_fn: Callable[[List[Tuple[str, str]]], None] | None = None,
+) -> int:
+    """
+    Run the ingest stages concurrently.
+
+    Args:
+        raw_chunks: chunks of raw csv rows, in file order
+        clean_fn: validates/cleans a chunk, returning (cleaned rows, rejected rows, (doc_id, content_hash)
+            of the rows dropped as too short). Must be picklable (module level)
+        embed_fn: adds embeddings to a batch of cleaned rows
+        write_fn: persists a batch of embedded rows
+        batch_size: number of cleaned rows per embed/write batch
+        parse_workers: number of processes running clean_fn
+        queue_size: max batches buffered between two stages
+        reject_fn: receives the rejected rows of each chunk, in file order, on the calling thread
+        too_short_fn: receives the too short (doc_id, content_hash) of each chunk, on the calling thread
+
+    Returns:
+        number of rows written
+    """
+    parse_stats = StageStats("parse/clean")
+    embed_stats = StageStats("embed")
+    write_stats = StageStats("write")
+
+    embed_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    write_q: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    written = [0]
+
+    def embed_worker() -> None:
+        try:
+            while True:
+                depth = embed_q.qsize()
+                batch = _get(embed_q, stop)
+                if batch is _DONE:
+                    break
+                start = time.perf_counter()
+                embed_fn(batch)
+                embed_stats.record(len(batch), time.perf_counter() - start, depth)
+                if not _put(write_q, batch, stop):
+                    return
+            _put(write_q, _DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def write_worker() -> None:
+        try:
+            while True:
+                depth = write_q.qsize()
+                batch = _get(write_q, stop)
+                if batch is _DONE:
+                    break
+                start = time.perf_counter()
+                write_fn(batch)
+                write_stats.record(len(batch), time.perf_counter() - start, depth)
+                written[0] += len(batch)
+                logging.info(
+                    f"Inserted batch of {len(batch)} rows (total kept: {written[0]}) | "
+                    f"queues: embed {embed_q.qsize()}/{queue_size}, write {write_q.qsize()}/{queue_size}"
+                )
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    run_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=parse_workers) as pool:
+        #submit one chunk before starting the threads so the workers fork before the model is used
+        chunks = iter(raw_chunks)
+        pending: deque[Future] = deque()
+        first = next(chunks, None)
+        if first is not None:
+            pending.append(pool.submit(_timed_call, clean_fn, first))
+
+        threads = [
+            threading.Thread(target=embed_worker, name="ingest-embed", daemon=True),
+            threading.Thread(target=write_worker, name="ingest-write", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        buffer: List[dict] = []
+        max_in_flight = parse_workers * 2
+
+        def drain_one() -> bool:
+            depth = len(pending)
+            (rows, rejected, too_short), seconds, metrics = pending.popleft().result()
+            REGISTRY.merge(metrics)
+            if rejected and reject_fn is not None:
+                reject_fn(rejected)
+            if too_short and too_short_fn is not None:
+                too_short_fn(too_short)
+            parse_stats.record(len(rows), seconds, depth)
+            buffer.extend(rows)
+            while len(buffer) >= batch_size:
+                if not _put(embed_q, buffer[:batch_size], stop):
+                    return False
+                del buffer[:batch_size]
+            return True
+
+        try:
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                pending.append(pool.submit(_timed_call, clean_fn, chunk))
+                #bounded number of chunks in flight keeps the reader from running ahead of the workers
+                while len(pending) >= max_in_flight:
+                    if not drain_one():
+                        break
+            while pending and not stop.is_set():
+                if not drain_one():
+                    break
+            if buffer and not stop.is_set():
+                _put(embed_q, buffer, stop)
+            _put(embed_q, _DONE, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+            for future in pending:
+                future.cancel()
+
+        for thread in threads:
+            thread.join()
+
+    wall_seconds = time.perf_counter() - run_start
+    for stats in (parse_stats, embed_stats, write_stats):
+        logging.info(stats.summary(wall_seconds))
+
+    if errors:
+        raise errors[0]
+
+    logging.info(f"Pipeline wrote {written[0]} rows in {wall_seconds:.1f}s ({written[0] / max(wall_seconds, 1e-9):.1f} docs/sec)")
+    return written[0]
@@ -0,0 +1,108 @@
+"""
+Plotting for the Streamlit UI, kept apart from similarity.py so the API process never imports
+matplotlib.
+"""
+
+from __future__ import annotations
+import logging
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+
+
+#produced with help from chatgpt
+def plot_similarity_over_time(similarity_df: pd.DataFrame, country_a: str, country_b: str, 
+                             ontology_id: Optional[str] = None, output_path: Optional[Path] = None):
+    """
+    Create an enhanced visualization of similarity over time.
+    
+    Args:
+        similarity_df: DataFrame with time_bucket and similarity columns
+        country_a: First country/jurisdiction compared
+        country_b: Second country/jurisdiction compared
+        ontology_id: Optional ontology topic that was compared
+        output_path: Optional path to save the figure
+    
+    Returns:
+        The matplotlib figure
+    """
+    import matplotlib.pyplot as plt  # deferred so importing this module stays cheap
+
+    plt.figure(figsize=(14, 8))
+    
+    # Extract the start date from the time_bucket range
+    similarity_df['date'] = similarity_df['time_bucket'].str.split(' to ').str[0]
+    
+    # Convert the extracted start date to datetime
+    similarity_df['date'] = pd.to_datetime(similarity_df['date'], format='%Y-%m-%d', errors='coerce')
+    
+    # Drop rows with invalid dates
+    similarity_df = similarity_df.dropna(subset=['date'])
+    
+    # Sort by date to ensure proper line plotting
+    similarity_df = similarity_df.sort_values('date')
+    
+    # Plot the main similarity line
+    plt.plot(similarity_df['date'], similarity_df['similarity'], 
+             'o-', linewidth=2, markersize=8, label='Similarity Score')
+    
+    # Add a trend line (rolling average)
+    window = min(3, len(similarity_df))  # Use smaller window if few data points
+    if len(similarity_df) >= 3:  # Only add trend if we have enough points
+        rolling_avg = similarity_df['similarity'].rolling(window=window, center=True).mean()
+        plt.plot(similarity_df['date'], rolling_avg, 'r--', 
+                 linewidth=2, label=f'{window}-period Moving Average')
+    
+    # Add horizontal line at 0.5 for reference (neutral similarity)
+    plt.axhline(y=0.5, color='gray', linestyle=':', alpha=0.7)
+    
+    # Enhance the appearance
+    title = f"Regulatory Convergence: {country_a} vs {country_b}"
+    if ontology_id:
+        title += f" (Topic: {ontology_id})"
+    
+    plt.title(title, fontsize=16)
+    plt.xlabel("Date", fontsize=12)
+    plt.ylabel("Similarity Score", fontsize=12)
+    plt.grid(True, alpha=0.3)
+    
+    # Format x-axis as dates
+    plt.gcf().autofmt_xdate()
+    
+    # Set y-axis limits for cosine similarity
+    plt.ylim(0, 1)
+    
+    # Add legend
+    plt.legend(loc='best')
+    
+    # Add annotations for highest and lowest points
+    if len(similarity_df) > 0:
+        max_idx = similarity_df['similarity'].idxmax()
+        min_idx = similarity_df['similarity'].idxmin()
+        
+        max_date = similarity_df.loc[max_idx, 'date']
+        max_sim = similarity_df.loc[max_idx, 'similarity']
+        
+        min_date = similarity_df.loc[min_idx, 'date']
+        min_sim = similarity_df.loc[min_idx, 'similarity']
+        
+        plt.annotate(f'Max: {max_sim:.3f}', 
+                    xy=(max_date, max_sim),
+                    xytext=(10, 10),
+                    textcoords='offset points',
+                    arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=.2'))
+                    
+        plt.annotate(f'Min: {min_sim:.3f}', 
+                    xy=(min_date, min_sim),
+                    xytext=(10, -20),
+                    textcoords='offset points',
+                    arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=.2'))
+    
+    plt.tight_layout()
+    
+    # Save figure if output_path is provided
+    if output_path:
+        plt.savefig(output_path)
+        logging.info(f"Figure saved to {output_path}")
+    
+    return plt
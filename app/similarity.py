@@ -1,95 +1,348 @@
 from __future__ import annotations
+import datetime
 import logging
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.metrics.pairwise import cosine_similarity
-from typing import Dict, List, Tuple, Optional
-from pathlib import Path
-from app.utils.db_utils import db_conn  # Import the helper function
-import psycopg2.extras 
-import ast
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple, Optional
+from app.utils.db_utils import pooled_conn, get_dataset_generation, PoolTimeout  # Import the helper function
+from app.utils.result_cache import ResultCache
+from app.utils.vectors import decode_embeddings
+from app.utils.aggregates import fetch_daily_prefix_sums, window_aggregate, normalize_rows
+from app.utils.embedding_store import get_store
+from app.utils.buckets import (
+    DEFAULT_GRANULARITY, day_to_date, parse_granularity, recent_windows, time_windows, to_day_numbers, window_slice,
+)
+from app.utils.streaming_stats import pairwise_similarity_stats
+from app.utils.metrics import timed
+import psycopg2.extras
+
+if TYPE_CHECKING:
+    import pandas as pd  # imported on first use, it dominates the import time of this module
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
+SIMILARITY_STATISTICS = ("median", "mean")
+CONCEPT_MATCHES = ("any", "all")
+RESULT_CACHE = ResultCache()
+
+
+def topic_filter_sql(ontology_id: Optional[str] = None, concepts: Optional[List[str]] = None, concept_match: str = "any",
+                     alias: str = "") -> Tuple[str, list]:
+    """
+    SQL conditions and params restricting documents to a topic, answered from the GIN indexes on
+    the ontology_ids / concepts arrays.
+
+    Args:
+        ontology_id: documents tagged with this ontology id (a pipe-joined string requires all of its ids)
+        concepts: concept names to filter on
+        concept_match: 'any' for documents with at least one of the concepts, 'all' for documents with every one
+        alias: table alias to qualify the columns with, if any
+
+    Returns:
+        (conditions to AND onto a WHERE clause, each starting with ' AND', params)
+    """
+    if concept_match not in CONCEPT_MATCHES:
+        raise ValueError(f"Unknown concept_match {concept_match!r}, expected one of {CONCEPT_MATCHES}")
+    prefix = f"{alias}." if alias else ""
+    sql, params = "", []
+    if ontology_id:
+        sql += f" AND {prefix}ontology_ids @> %s::text[]"
+        params.append([part.strip() for part in ontology_id.split('|') if part.strip()])
+    if concepts:
+        sql += f" AND {prefix}concepts {'&&' if concept_match == 'any' else '@>'} %s::text[]"
+        params.append(list(concepts))
+    return sql, params
+
+
+def embeddings_query(jurisdictions: Optional[List[str]] = None, ontology_id: Optional[str] = None,
+                     concepts: Optional[List[str]] = None, concept_match: str = "any",
+                     start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None) -> Tuple[str, list]:
+    """
+    The SELECT behind extract_jurisdiction_embeddings. Every filter is pushed down so only
+    matching rows leave the database; jurisdiction + date range are served by the
+    (jurisdiction, published_date) index, which also yields rows in the ORDER BY order.
+
+    Returns:
+        (query, params)
+    """
+    query = """
+        SELECT jurisdiction, published_date, embedding_bin 
+        FROM reginsights_clean
+        WHERE embedding_bin IS NOT NULL
+    """
+    params = []
+
+    if jurisdictions is not None:
+        query += " AND jurisdiction = ANY(%s)"
+        params.append(list(jurisdictions))
+    if start_date:
+        query += " AND published_date >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND published_date <= %s"
+        params.append(end_date)
+
+    topic_sql, topic_params = topic_filter_sql(ontology_id, concepts, concept_match)
+    query += topic_sql
+    params.extend(topic_params)
+
+    return query + " ORDER BY jurisdiction, published_date", params
+
+
+def latest_published_date_query(jurisdictions: List[str], table: str = "reginsights_clean",
+                                conditions: str = "", params: Sequence = ()) -> Tuple[str, list]:
+    """
+    Query for the most recent published_date of any of the jurisdictions, answered with one
+    backwards index probe per jurisdiction rather than a scan.
+
+    Args:
+        jurisdictions: jurisdictions to look at
+        table: reginsights_clean or daily_aggregates
+        conditions: extra conditions on the table (aliased t), each starting with ' AND'
+        params: params of the conditions
+
+    Returns:
+        (query, params)
+    """
+    query = f"""SELECT max(latest.published_date)
+                FROM unnest(%s::text[]) AS j(jurisdiction)
+                CROSS JOIN LATERAL (
+                    SELECT t.published_date FROM {table} t
+                    WHERE t.jurisdiction = j.jurisdiction {conditions}
+                    ORDER BY t.published_date DESC LIMIT 1
+                ) latest"""
+    return query, [list(jurisdictions), *params]
+
+
+def latest_published_date(cur, jurisdictions: List[str], table: str = "reginsights_clean",
+                          conditions: str = "", params: Sequence = ()) -> Optional[datetime.date]:
+    """Run latest_published_date_query on the given cursor."""
+    cur.execute(*latest_published_date_query(jurisdictions, table, conditions, params))
+    return cur.fetchone()[0]
+
+
+def last_buckets_start_date(last_date: Optional[datetime.date], granularity: str, last_n_buckets: int) -> Optional[datetime.date]:
+    """First day that can fall in any of the last_n_buckets buckets ending on last_date."""
+    if last_date is None:
+        return None
+    starts, _ = recent_windows(granularity, int(to_day_numbers([last_date])[0]), last_n_buckets)
+    return day_to_date(starts[0])
+
+
 #produced with help from chatgpt
-def extract_embeddings(country_a: str, country_b: str, ontology_id: str = None) -> Dict:
+def extract_embeddings(country_a: str, country_b: str, ontology_id: str = None,
+                       concepts: Optional[List[str]] = None, concept_match: str = "any",
+                       start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None) -> Dict:
     """
-    Extract embeddings for two countries from the database, grouped by time bucket. Has 
+    Extract embeddings for two countries from the database, sorted by published date. Has 
     the ability to filter on onotology too but this will be introduced in future 
     
     Arg.s:
         country_a: First country/jurisdiction to compare
         country_b: Second country/jurisdiction to compare
         ontology_id: Optional filter for specific reg. topic
+        concepts: Optional concept names to filter on
+        concept_match: 'any' or 'all' of the concepts
+        start_date: Optional first published_date to load
+        end_date: Optional last published_date to load
     
     Returns:
-        Dict. with data by time bucket
+        Dict. with country_data mapping each country to an 'embeddings' (n, dim) float32 matrix
+        and a 'days' array giving, per row, its published_date as a day number. Rows are sorted
+        by date, so any time bucket is a contiguous slice (see window_slice). Read from the
+        embedding store, the rows are already L2-normalised and 'normalized' is True.
     """
-    conn = db_conn()  
+    return extract_jurisdiction_embeddings([country_a, country_b], ontology_id, concepts, concept_match, start_date, end_date)
+
+
+def extract_jurisdiction_embeddings(jurisdictions: Optional[List[str]] = None, ontology_id: str = None,
+                                    concepts: Optional[List[str]] = None, concept_match: str = "any",
+                                    start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None) -> Dict:
+    """
+    Extract embeddings for any number of jurisdictions in one query, in the same layout as
+    extract_embeddings.
+    
+    Args:
+        jurisdictions: jurisdictions to load, None for all of them
+        ontology_id: Optional filter for specific reg. topic
+        concepts: Optional concept names to filter on
+        concept_match: 'any' or 'all' of the concepts
+        start_date: Optional first published_date to load
+        end_date: Optional last published_date to load
     
+    Returns:
+        Dict. with 'country_data' per jurisdiction
+    """
+    store = get_store()
+    if store is not None:
+        return extract_store_embeddings(store, jurisdictions, ontology_id, concepts, concept_match, start_date, end_date)
     try:
-        with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-
-            query = """
-                SELECT jurisdiction, time_bucket, embedding 
-                FROM reginsights_clean
-                WHERE jurisdiction IN (%s, %s)
-            """
-            params = [country_a, country_b]
-            
-            #add in future - ability to filter on ontology
-            if ontology_id:
-                query += " AND ontology_id = %s"
-                params.append(ontology_id)
-                
-            query += " ORDER BY jurisdiction, time_bucket"
-            
+        query, params = embeddings_query(jurisdictions, ontology_id, concepts, concept_match, start_date, end_date)
+        with timed("similarity.fetch") as t, pooled_conn() as conn, conn.cursor() as cur:
             cur.execute(query, params)
             rows = cur.fetchall()
-        
-        # init output structure
-        country_data = {
-            country_a: {},
-            country_b: {}
-        }
-        
-        all_time_buckets = set()
-        
+            t.items = len(rows)
+
+        rows_by_jurisdiction = {j: [] for j in (jurisdictions or [])}
         for row in rows:
-            jurisdiction = row['jurisdiction']
-            time_bucket = row['time_bucket']
-            embedding_str = row['embedding']
-            
-            # put embedding string into np array
-            try:
-                embedding = np.array(ast.literal_eval(embedding_str), dtype=np.float32)
-            except Exception as e:
-                logging.error(f"Failed to parse embedding for {jurisdiction} in time bucket {time_bucket}: {e}")
-                continue
-            
-            all_time_buckets.add(time_bucket)
-            
-            if time_bucket not in country_data[jurisdiction]:
-                country_data[jurisdiction][time_bucket] = []
-                
-            country_data[jurisdiction][time_bucket].append(embedding)
+            rows_by_jurisdiction.setdefault(row[0], []).append(row)
+
+        # init output structure
+        country_data = {}
+        with timed("similarity.decode") as t:
+            for country, country_rows in rows_by_jurisdiction.items():
+                # one join + frombuffer per jurisdiction instead of parsing every row
+                country_data[country] = {
+                    'embeddings': decode_embeddings(row[2] for row in country_rows),
+                    'days': to_day_numbers([row[1] for row in country_rows]),
+                }
+            t.items = len(rows)
         
-        return {
-            'country_data': country_data,
-            'time_buckets': sorted(list(all_time_buckets))
-        }
+        return {'country_data': country_data}
     
     except Exception as e:
         logging.error(f"Error extracting embeddings: {e}")
         raise
+
+
+def extract_store_embeddings(store, jurisdictions: Optional[List[str]] = None, ontology_id: str = None,
+                             concepts: Optional[List[str]] = None, concept_match: str = "any",
+                             start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None) -> Dict:
+    """extract_jurisdiction_embeddings from the embedding store: views of the memory map unless filtered by topic."""
+    if concept_match not in CONCEPT_MATCHES:
+        raise ValueError(f"Unknown concept_match {concept_match!r}, expected one of {CONCEPT_MATCHES}")
+    country_data = {}
+    with timed("similarity.store_select") as t:
+        for jurisdiction in (jurisdictions if jurisdictions is not None else store.jurisdictions()):
+            embeddings, days = store.select(jurisdiction, ontology_id, concepts, concept_match, start_date, end_date)
+            country_data[jurisdiction] = {'embeddings': embeddings, 'days': days, 'normalized': True}
+            t.items += len(days)
+    return {'country_data': country_data}
+
+
+def _normalized(data: Dict) -> np.ndarray:
+    # store rows are normalised at export, so they stay views of the memory map
+    return data['embeddings'] if data.get('normalized') else normalize_rows(data['embeddings'])
+
+
+def _weighted_median(values: np.ndarray, weights: np.ndarray) -> float:
+    order = np.argsort(values, axis=None)
+    cumulative = np.cumsum(weights.ravel()[order])
+    return float(values.ravel()[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def _window_reservoir(prefix: dict, days: slice) -> Tuple[np.ndarray, np.ndarray]:
+    # each day's sample stands for all of that day's documents, so weight it by count / sample size
+    reservoirs = prefix['reservoirs'][days]
+    counts = prefix['reservoir_counts'][days]
+    weights = [np.full(len(r), n / len(r)) for r, n in zip(reservoirs, counts) if len(r)]
+    if not weights:
+        return np.empty((0, prefix['sum_prefix'].shape[1]), dtype=np.float32), np.empty(0)
+    return np.vstack([r for r in reservoirs if len(r)]), np.concatenate(weights)
+
+
+def compute_mean_similarity_from_aggregates(country_a: str, country_b: str, granularity: str = DEFAULT_GRANULARITY,
+                                            start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None,
+                                            last_n_buckets: Optional[int] = None) -> pd.DataFrame:
+    """
+    Mean cosine similarity per time bucket from the precomputed daily aggregates.
+
+    mean_ij cos(a_i, b_j) = dot(sum_i a_i, sum_j b_j) / (n_a * n_b) for normalised vectors, and
+    the sums of any bucket are the difference of two cumulative daily sums, so this never
+    touches the raw embeddings whatever the granularity.
+    
+    Args:
+        country_a: first country to compare
+        country_b: second country to compare
+        granularity: 'day', 'week', '10d', 'month' or 'rolling:N'
+        start_date: Optional first published_date to include
+        end_date: Optional last published_date to include
+        last_n_buckets: Optional, only the most recent n buckets
     
-    finally:
-        #always close
-        conn.close()
+    Returns:
+        df with time buckets and corresponding mean similarity scores
+    """
+    import pandas as pd
+
+    store = get_store()
+    if store is not None:
+        return compute_mean_similarity_from_store(store, country_a, country_b, granularity, start_date, end_date, last_n_buckets)
+
+    with pooled_conn() as conn, conn.cursor() as cur:
+        if last_n_buckets:
+            conditions, params = " AND t.doc_count > 0", []
+            if end_date:
+                conditions += " AND t.published_date <= %s"
+                params.append(end_date)
+            last_date = latest_published_date(cur, [country_a, country_b], "daily_aggregates", conditions, params)
+            start_date = max(filter(None, [start_date, last_buckets_start_date(last_date, granularity, last_n_buckets)]), default=None)
+        with timed("similarity.aggregates_fetch"):
+            prefix = fetch_daily_prefix_sums(cur, [country_a, country_b], start_date, end_date)
+
+    labels, starts, ends = time_windows([prefix[country_a]['days'], prefix[country_b]['days']], granularity, last_n_buckets)
+    rows = []
+    with timed("similarity.aggregates_buckets") as t:
+        for time_bucket, start, end in zip(labels, starts, ends):
+            count_a, sum_a, days_a = window_aggregate(prefix[country_a], start, end)
+            count_b, sum_b, days_b = window_aggregate(prefix[country_b], start, end)
+            if not count_a or not count_b:
+                continue
+            mean = float(np.dot(sum_a, sum_b) / (count_a * count_b))
+            row = {'time_bucket': time_bucket, 'similarity': mean, 'mean': mean, 'count': count_a * count_b}
 
+            sample_a, weights_a = _window_reservoir(prefix[country_a], days_a)
+            sample_b, weights_b = _window_reservoir(prefix[country_b], days_b)
+            if len(sample_a) and len(sample_b):
+                row['approx_median'] = _weighted_median(sample_a @ sample_b.T, np.outer(weights_a, weights_b))
+            logging.info(
+                f"Time bucket {time_bucket}: Mean similarity = {mean:.3f} "
+                f"(from {count_a} x {count_b} docs)"
+            )
+            rows.append(row)
+        t.items = len(rows)
 
-def compute_similarity_over_time(country_a: str, country_b: str, ontology_id: str = None) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=None if rows else ['time_bucket', 'similarity'])
+
+
+def compute_mean_similarity_from_store(store, country_a: str, country_b: str, granularity: str = DEFAULT_GRANULARITY,
+                                       start_date: Optional[datetime.date] = None, end_date: Optional[datetime.date] = None,
+                                       last_n_buckets: Optional[int] = None) -> pd.DataFrame:
+    """
+    compute_mean_similarity_from_aggregates against the embedding store, which has no daily
+    aggregates: each bucket's sums are summed over its slice of the memory map, O(n x dim) in all.
+    """
+    import pandas as pd
+
+    if last_n_buckets:
+        start_date = max(filter(None, [start_date, last_buckets_start_date(
+            _store_latest_date(store, [country_a, country_b], end_date=end_date), granularity, last_n_buckets)]), default=None)
+    data = extract_store_embeddings(store, [country_a, country_b], start_date=start_date, end_date=end_date)['country_data']
+    days_a, days_b = data[country_a]['days'], data[country_b]['days']
+    labels, starts, ends = time_windows([days_a, days_b], granularity, last_n_buckets)
+    rows = []
+    with timed("similarity.store_buckets") as t:
+        for time_bucket, start, end in zip(labels, starts, ends):
+            rows_a = data[country_a]['embeddings'][window_slice(days_a, start, end)]
+            rows_b = data[country_b]['embeddings'][window_slice(days_b, start, end)]
+            if not len(rows_a) or not len(rows_b):
+                continue
+            mean = float(np.dot(rows_a.sum(axis=0, dtype=np.float64), rows_b.sum(axis=0, dtype=np.float64)) / (len(rows_a) * len(rows_b)))
+            rows.append({'time_bucket': time_bucket, 'similarity': mean, 'mean': mean, 'count': len(rows_a) * len(rows_b)})
+            logging.info(f"Time bucket {time_bucket}: Mean similarity = {mean:.3f} (from {len(rows_a)} x {len(rows_b)} docs)")
+        t.items = len(days_a) + len(days_b)
+
+    return pd.DataFrame(rows, columns=None if rows else ['time_bucket', 'similarity'])
+
+
+def _store_latest_date(store, jurisdictions: List[str], ontology_id: Optional[str] = None, concepts: Optional[List[str]] = None,
+                       concept_match: str = "any", end_date: Optional[datetime.date] = None) -> Optional[datetime.date]:
+    day = store.latest_day(jurisdictions, ontology_id, concepts, concept_match, end_date)
+    return None if day is None else day_to_date(day)
+
+
+def compute_similarity_over_time(country_a: str, country_b: str, ontology_id: str = None, statistic: str = "median",
+                                 granularity: str = DEFAULT_GRANULARITY, concepts: Optional[List[str]] = None,
+                                 concept_match: str = "any", start_date: Optional[datetime.date] = None,
+                                 end_date: Optional[datetime.date] = None, last_n_buckets: Optional[int] = None) -> pd.DataFrame:
     """
     compute similarity between two countries embeddings over time.
     
@@ -97,166 +350,119 @@ def compute_similarity_over_time(country_a: str, country_b: str, ontology_id: st
         country_a: first country to compare
         country_b: second country to compare
         ontology_id: filter on reg topic
+        statistic: per-bucket summary of the pairwise similarities, 'median' or 'mean'. Unfiltered
+            means are answered from the daily aggregates without loading raw embeddings
+        granularity: time buckets to group documents into by published_date, 'day', 'week',
+            '10d', 'month' or 'rolling:N' (trailing N-day window ending on each day)
+        concepts: only compare documents tagged with these concept names
+        concept_match: 'any' (default) or 'all' of the concepts
+        start_date: only documents published on or after this date
+        end_date: only documents published on or before this date
+        last_n_buckets: only the most recent n time buckets (up to end_date if given)
     
     Returns:
-        df with time buckets and corresponding similarity scores
+        df with time buckets and corresponding similarity scores, plus one column per
+        statistic computed for the bucket (median, mean, std, count, ...)
     """
+    import pandas as pd
+
+    if statistic not in SIMILARITY_STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic!r}, expected one of {SIMILARITY_STATISTICS}")
+    parse_granularity(granularity)
+
     logging.info(f"Computing similarity between {country_a} and {country_b}")
-    
-    data = extract_embeddings(country_a, country_b, ontology_id)
-    country_data = data['country_data']
-    time_buckets = data['time_buckets']
+
+    if statistic == "mean" and not ontology_id and not concepts:
+        return compute_mean_similarity_from_aggregates(country_a, country_b, granularity, start_date, end_date, last_n_buckets)
+
+    store = get_store()
+    if last_n_buckets and store is not None:
+        last_date = _store_latest_date(store, [country_a, country_b], ontology_id, concepts, concept_match, end_date)
+        start_date = max(filter(None, [start_date, last_buckets_start_date(last_date, granularity, last_n_buckets)]), default=None)
+    elif last_n_buckets:
+        # find where the last n buckets begin so only their rows are fetched
+        topic_sql, params = topic_filter_sql(ontology_id, concepts, concept_match, alias="t")
+        conditions = " AND t.embedding_bin IS NOT NULL" + topic_sql
+        if end_date:
+            conditions += " AND t.published_date <= %s"
+            params.append(end_date)
+        with pooled_conn() as conn, conn.cursor() as cur:
+            last_date = latest_published_date(cur, [country_a, country_b], "reginsights_clean", conditions, params)
+        start_date = max(filter(None, [start_date, last_buckets_start_date(last_date, granularity, last_n_buckets)]), default=None)
+    
+    country_data = extract_embeddings(country_a, country_b, ontology_id, concepts, concept_match, start_date, end_date)['country_data']
+    days_a = country_data[country_a]['days']
+    days_b = country_data[country_b]['days']
+    time_buckets, starts, ends = time_windows([days_a, days_b], granularity, last_n_buckets)
+    # normalise once per country; per-bucket slices below are views of these
+    with timed("similarity.normalize"):
+        normalized_a = _normalized(country_data[country_a])
+        normalized_b = _normalized(country_data[country_b])
     
     # get similarity within time bucket
     similarity_scores = {}
     similarity_stats = {}
     
-    for time_bucket in time_buckets:
-        # Skip if no data in either
-        if (time_bucket not in country_data[country_a] or 
-            time_bucket not in country_data[country_b]):
-            continue
-        
-        embeddings_a = country_data[country_a][time_bucket]
-        embeddings_b = country_data[country_b][time_bucket]
-        #then vectorise for performance
-        embeddings_a_matrix = np.vstack(embeddings_a)
-        embeddings_b_matrix = np.vstack(embeddings_b)
-
-        #get consine similarities for all embeddings in the time buckets
-        similarity_matrix = cosine_similarity(embeddings_a_matrix, embeddings_b_matrix)
-        similarity_scores[time_bucket] = np.median(similarity_matrix.flatten())
-        
-        # TO DO - in future, add other stats too 
-        similarity_stats[time_bucket] = {
-            'median': np.median(similarity_matrix.flatten()),
-            'mean': np.mean(similarity_matrix.flatten()),
-            'max': np.max(similarity_matrix.flatten()),
-            'min': np.min(similarity_matrix.flatten()),
-            'std': np.std(similarity_matrix.flatten()),
-            'count': len(similarity_matrix.flatten())
-        }
+    with timed("similarity.pairwise") as t:
+        for time_bucket, start, end in zip(time_buckets, starts, ends):
+            # slices of the contiguous per-country matrices, no copies
+            embeddings_a_matrix = normalized_a[window_slice(days_a, start, end)]
+            embeddings_b_matrix = normalized_b[window_slice(days_b, start, end)]
+
+            # Skip if no data in either
+            if len(embeddings_a_matrix) == 0 or len(embeddings_b_matrix) == 0:
+                continue
+
+            #cosine similarities for all embeddings in the time buckets, computed tile by tile with bounded memory
+            similarity_stats[time_bucket] = pairwise_similarity_stats(embeddings_a_matrix, embeddings_b_matrix)
+            similarity_scores[time_bucket] = similarity_stats[time_bucket][statistic]
         
-        logging.info(f"Time bucket {time_bucket}: Similarity = {similarity_scores[time_bucket]:.3f} (based on {similarity_stats[time_bucket]['count']} comparisons)")
+            logging.info(f"Time bucket {time_bucket}: Similarity = {similarity_scores[time_bucket]:.3f} (based on {similarity_stats[time_bucket]['count']} comparisons)")
+        t.items = sum(stats['count'] for stats in similarity_stats.values())
     
     # convert to df
-    result_df = pd.DataFrame({
-        'time_bucket': time_buckets,
-        'similarity': [similarity_scores.get(tb, None) for tb in time_buckets]
-    }).dropna()  # Remove time buckets with no similarity score
-    
-    return result_df
+    with timed("similarity.frame"):
+        result_df = pd.DataFrame({
+            'time_bucket': time_buckets,
+            'similarity': [similarity_scores.get(tb, None) for tb in time_buckets]
+        }).dropna()  # Remove time buckets with no similarity score
+
+        if not similarity_stats:
+            return result_df
+
+        stats_df = pd.DataFrame.from_dict(similarity_stats, orient='index')
+        return result_df.join(stats_df, on='time_bucket')
 
 #produced with help from chatgpt
 def get_available_jurisdictions():
     """Get a list of all jurisdictions in the database."""
-    conn = db_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT DISTINCT jurisdiction FROM reginsights_clean ORDER BY jurisdiction")
-            jurisdictions = [row[0] for row in cur.fetchall()]
-            return jurisdictions
-    finally:
-        conn.close()
+    store = get_store()
+    if store is not None:
+        return store.jurisdictions()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT jurisdiction FROM reginsights_clean ORDER BY jurisdiction")
+        jurisdictions = [row[0] for row in cur.fetchall()]
+        return jurisdictions
 
 
-#produced with help from chatgpt
-def plot_similarity_over_time(similarity_df: pd.DataFrame, country_a: str, country_b: str, 
-                             ontology_id: Optional[str] = None, output_path: Optional[Path] = None):
-    """
-    Create an enhanced visualization of similarity over time.
-    
-    Args:
-        similarity_df: DataFrame with time_bucket and similarity columns
-        country_a: First country/jurisdiction compared
-        country_b: Second country/jurisdiction compared
-        ontology_id: Optional ontology topic that was compared
-        output_path: Optional path to save the figure
-    
-    Returns:
-        The matplotlib figure
-    """
-    plt.figure(figsize=(14, 8))
-    
-    # Extract the start date from the time_bucket range
-    similarity_df['date'] = similarity_df['time_bucket'].str.split(' to ').str[0]
-    
-    # Convert the extracted start date to datetime
-    similarity_df['date'] = pd.to_datetime(similarity_df['date'], format='%Y-%m-%d', errors='coerce')
-    
-    # Drop rows with invalid dates
-    similarity_df = similarity_df.dropna(subset=['date'])
-    
-    # Sort by date to ensure proper line plotting
-    similarity_df = similarity_df.sort_values('date')
-    
-    # Plot the main similarity line
-    plt.plot(similarity_df['date'], similarity_df['similarity'], 
-             'o-', linewidth=2, markersize=8, label='Similarity Score')
-    
-    # Add a trend line (rolling average)
-    window = min(3, len(similarity_df))  # Use smaller window if few data points
-    if len(similarity_df) >= 3:  # Only add trend if we have enough points
-        rolling_avg = similarity_df['similarity'].rolling(window=window, center=True).mean()
-        plt.plot(similarity_df['date'], rolling_avg, 'r--', 
-                 linewidth=2, label=f'{window}-period Moving Average')
-    
-    # Add horizontal line at 0.5 for reference (neutral similarity)
-    plt.axhline(y=0.5, color='gray', linestyle=':', alpha=0.7)
-    
-    # Enhance the appearance
-    title = f"Regulatory Convergence: {country_a} vs {country_b}"
-    if ontology_id:
-        title += f" (Topic: {ontology_id})"
-    
-    plt.title(title, fontsize=16)
-    plt.xlabel("Date", fontsize=12)
-    plt.ylabel("Similarity Score", fontsize=12)
-    plt.grid(True, alpha=0.3)
-    
-    # Format x-axis as dates
-    plt.gcf().autofmt_xdate()
-    
-    # Set y-axis limits for cosine similarity
-    plt.ylim(0, 1)
-    
-    # Add legend
-    plt.legend(loc='best')
-    
-    # Add annotations for highest and lowest points
-    if len(similarity_df) > 0:
-        max_idx = similarity_df['similarity'].idxmax()
-        min_idx = similarity_df['similarity'].idxmin()
-        
-        max_date = similarity_df.loc[max_idx, 'date']
-        max_sim = similarity_df.loc[max_idx, 'similarity']
-        
-        min_date = similarity_df.loc[min_idx, 'date']
-        min_sim = similarity_df.loc[min_idx, 'similarity']
-        
-        plt.annotate(f'Max: {max_sim:.3f}', 
-                    xy=(max_date, max_sim),
-                    xytext=(10, 10),
-                    textcoords='offset points',
-                    arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=.2'))
-                    
-        plt.annotate(f'Min: {min_sim:.3f}', 
-                    xy=(min_date, min_sim),
-                    xytext=(10, -20),
-                    textcoords='offset points',
-                    arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=.2'))
-    
-    plt.tight_layout()
-    
-    # Save figure if output_path is provided
-    if output_path:
-        plt.savefig(output_path)
-        logging.info(f"Figure saved to {output_path}")
-    
-    return plt
+def get_available_concepts() -> List[Dict]:
+    """Get every concept name in the database with the number of documents tagged with it."""
+    store = get_store()
+    if store is not None:
+        return store.concept_counts()
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """SELECT concept, count(*) FROM reginsights_clean, unnest(concepts) AS concept
+               GROUP BY concept ORDER BY concept"""
+        )
+        return [{"concept": concept, "doc_count": n} for concept, n in cur.fetchall()]
+
 
 #produced with help from chatgpt
-def run_similarity_analysis(country_a: str, country_b: str, ontology_id: Optional[str] = None) -> Dict:
+def run_similarity_analysis(country_a: str, country_b: str, ontology_id: Optional[str] = None, statistic: str = "median",
+                            granularity: str = DEFAULT_GRANULARITY, concepts: Optional[List[str]] = None,
+                            concept_match: str = "any", start_date: Optional[datetime.date] = None,
+                            end_date: Optional[datetime.date] = None, last_n_buckets: Optional[int] = None) -> Dict:
     """
     Run the complete similarity analysis workflow and return a JSON-compatible structure.
     
@@ -264,48 +470,285 @@ def run_similarity_analysis(country_a: str, country_b: str, ontology_id: Optiona
         country_a: First country/jurisdiction to compare
         country_b: Second country/jurisdiction to compare
         ontology_id: Optional filter for specific regulatory topic
+        statistic: per-bucket summary of the pairwise similarities, 'median' or 'mean'
+        granularity: 'day', 'week', '10d', 'month' or 'rolling:N'
+        concepts: Optional concept names to filter on
+        concept_match: 'any' or 'all' of the concepts
+        start_date: Optional first published_date to include
+        end_date: Optional last published_date to include
+        last_n_buckets: Optional, only the most recent n time buckets
     
     Returns:
         A dictionary containing the similarity sequence and metadata.
     """
     try:
         # Compute similarity over time
-        similarity_df = compute_similarity_over_time(country_a, country_b, ontology_id)
+        similarity_df = compute_similarity_over_time(
+            country_a, country_b, ontology_id, statistic, granularity, concepts, concept_match,
+            start_date=start_date, end_date=end_date, last_n_buckets=last_n_buckets,
+        )
         
         if similarity_df.empty:
             return {"error": f"No similarity data found for {country_a} and {country_b}"}
         
         # Convert DataFrame to JSON-compatible format
-        similarity_sequence = similarity_df.to_dict(orient="records")
+        with timed("similarity.to_records"):
+            similarity_sequence = similarity_df[['time_bucket', 'similarity']].to_dict(orient="records")
+            stats_df = similarity_df.drop(columns=['similarity'])
+            similarity_stats = stats_df.astype(object).where(stats_df.notna(), None).to_dict(orient="records")
         
         return {
             "country_a": country_a,
             "country_b": country_b,
-            "similarity_sequence": similarity_sequence
+            "statistic": statistic,
+            "granularity": granularity,
+            "concepts": list(concepts or []),
+            "concept_match": concept_match,
+            "start_date": start_date.isoformat() if start_date else None,
+            "end_date": end_date.isoformat() if end_date else None,
+            "last_n_buckets": last_n_buckets,
+            "similarity_sequence": similarity_sequence,
+            "similarity_stats": similarity_stats
         }
     
+    except (psycopg2.Error, PoolTimeout):
+        # an unreachable database is the server's problem, not "no data": let the caller answer 503
+        raise
     except Exception as e:
         logging.error(f"Error in similarity analysis: {e}")
         return {"error": str(e)}
 
+def run_cached_similarity_analysis(country_a: str, country_b: str, ontology_id: Optional[str] = None, statistic: str = "median",
+                                   granularity: str = DEFAULT_GRANULARITY, concepts: Optional[List[str]] = None,
+                                   concept_match: str = "any", start_date: Optional[datetime.date] = None,
+                                   end_date: Optional[datetime.date] = None, last_n_buckets: Optional[int] = None) -> Dict:
+    """
+    run_similarity_analysis behind RESULT_CACHE.
+
+    The cache key is symmetric in the two countries (the similarity statistics are), and entries
+    are versioned by the dataset generation so every ingest commit invalidates them (with the
+    embedding store, by the generation it was exported at). Errors are not cached.
+    """
+    key = (tuple(sorted((country_a, country_b))), ontology_id, granularity, statistic,
+           tuple(sorted(set(concepts or []))), concept_match, start_date, end_date, last_n_buckets)
+    store = get_store()
+    generation = store.generation if store is not None else get_dataset_generation()
+
+    result = RESULT_CACHE.get(key, generation)
+    if result is None:
+        result = run_similarity_analysis(country_a, country_b, ontology_id, statistic, granularity, concepts, concept_match,
+                                         start_date, end_date, last_n_buckets)
+        if "error" in result:
+            return result
+        RESULT_CACHE.put(key, generation, result)
+
+    # the cached entry may have been computed with the countries the other way round
+    return dict(result, country_a=country_a, country_b=country_b)
+
+
+def compute_similarity_matrix(jurisdictions: Optional[List[str]] = None, ontology_id: Optional[str] = None, statistic: str = "median",
+                              granularity: str = DEFAULT_GRANULARITY) -> Dict:
+    """
+    Similarity of every jurisdiction against every other jurisdiction, per time bucket.
+
+    Each jurisdiction's embeddings are loaded and normalised once. Per bucket, every unordered
+    pair of jurisdictions is multiplied once, in fixed-size tiles (see pairwise_similarity_stats),
+    and the result mirrored. 'mean' skips the matmul altogether and uses per-jurisdiction sums.
+    
+    Args:
+        jurisdictions: jurisdictions to include, None for all of them
+        ontology_id: Optional filter for specific regulatory topic
+        statistic: per-bucket summary of the pairwise similarities, 'median' or 'mean'
+        granularity: 'day', 'week', '10d', 'month' or 'rolling:N'
+    
+    Returns:
+        Dict. with 'jurisdictions', 'time_buckets', a symmetric (N, N, T) 'similarity' array
+        (NaN where either side has no documents) and the matching 'pair_count' array
+    """
+    if statistic not in SIMILARITY_STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic!r}, expected one of {SIMILARITY_STATISTICS}")
+
+    country_data = extract_jurisdiction_embeddings(jurisdictions, ontology_id)['country_data']
+    names = sorted(country_data)
+    time_buckets, starts, ends = time_windows([country_data[name]['days'] for name in names], granularity)
+    normalized = {name: _normalized(country_data[name]) for name in names}
+
+    similarity = np.full((len(names), len(names), len(time_buckets)), np.nan)
+    pair_count = np.zeros((len(names), len(names), len(time_buckets)), dtype=np.int64)
+
+    for t, (time_bucket, start, end) in enumerate(zip(time_buckets, starts, ends)):
+        present = []  # (jurisdiction index, normalised rows in this bucket)
+        for i, name in enumerate(names):
+            rows = normalized[name][window_slice(country_data[name]['days'], start, end)]
+            if len(rows):
+                present.append((i, rows))
+        if not present:
+            continue
+
+        index = np.array([i for i, _ in present])
+        counts = np.array([len(rows) for _, rows in present])
+        pair_count[np.ix_(index, index, [t])] = np.outer(counts, counts)[:, :, None]
+
+        if statistic == "mean":
+            sums = np.vstack([rows.sum(axis=0, dtype=np.float64) for _, rows in present])
+            similarity[np.ix_(index, index, [t])] = ((sums @ sums.T) / np.outer(counts, counts))[:, :, None]
+            continue
+
+        # each unordered pair once, tile by tile with bounded memory
+        for p, (i, rows_i) in enumerate(present):
+            for j, rows_j in present[p:]:
+                stats = pairwise_similarity_stats(rows_i, rows_j)
+                similarity[i, j, t] = similarity[j, i, t] = stats[statistic]
+
+        logging.info(f"Time bucket {time_bucket}: similarity matrix over {len(present)} jurisdictions, {int(counts.sum())} documents")
+
+    return {
+        'jurisdictions': names,
+        'granularity': granularity,
+        'time_buckets': time_buckets,
+        'similarity': similarity,
+        'pair_count': pair_count,
+    }
+
+
+def save_similarity_matrix(matrix: Dict, statistic: str, ontology_id: Optional[str] = None) -> int:
+    """
+    Persist the output of compute_similarity_matrix as a new run.
+
+    Returns:
+        the run_id of the stored run
+    """
+    names, time_buckets = matrix['jurisdictions'], matrix['time_buckets']
+    i, j, t = np.nonzero(~np.isnan(matrix['similarity']))
+    values = [
+        (names[a], names[b], time_buckets[c], float(matrix['similarity'][a, b, c]), int(matrix['pair_count'][a, b, c]))
+        for a, b, c in zip(i, j, t)
+    ]
+
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """INSERT INTO similarity_matrix_runs (statistic, ontology_id, granularity, jurisdictions, time_buckets)
+               VALUES (%s, %s, %s, %s, %s) RETURNING run_id""",
+            (statistic, ontology_id, matrix['granularity'], names, time_buckets),
+        )
+        run_id = cur.fetchone()[0]
+        psycopg2.extras.execute_values(
+            cur,
+            """INSERT INTO similarity_matrix (run_id, jurisdiction_a, jurisdiction_b, time_bucket, similarity, pair_count)
+               VALUES %s""",
+            values,
+            template=f"({int(run_id)}, %s, %s, %s, %s, %s)",
+            page_size=1000,
+        )
+
+    logging.info(f"Stored similarity matrix run {run_id}: {len(names)} jurisdictions, {len(time_buckets)} time buckets")
+    return run_id
+
+
+def run_similarity_matrix_job(jurisdictions: Optional[List[str]] = None, ontology_id: Optional[str] = None, statistic: str = "median",
+                              granularity: str = DEFAULT_GRANULARITY) -> int:
+    """Compute and persist the all-jurisdictions similarity matrix. Returns the new run_id."""
+    matrix = compute_similarity_matrix(jurisdictions, ontology_id, statistic, granularity)
+    return save_similarity_matrix(matrix, statistic, ontology_id)
+
+
+def get_similarity_matrix(jurisdiction: Optional[str] = None, time_bucket: Optional[str] = None,
+                          statistic: str = "median", run_id: Optional[int] = None,
+                          granularity: str = DEFAULT_GRANULARITY, ontology_id: Optional[str] = None) -> Dict:
+    """
+    Read a slice of a stored similarity matrix run.
+    
+    Args:
+        jurisdiction: only pairs with this jurisdiction on the left, e.g. everyone vs the EU
+        time_bucket: only this time bucket
+        statistic: which statistic's latest run to read when run_id is not given
+        run_id: a specific run
+        granularity: which granularity's latest run to read when run_id is not given
+        ontology_id: which topic's latest run to read when run_id is not given, None for the
+            runs over all documents
+    
+    Returns:
+        A dictionary with the run metadata and the matching entries, or an 'error' when no run
+        matches.
+    """
+    with pooled_conn() as conn, conn.cursor() as cur:
+        if run_id is None:
+            cur.execute(
+                """SELECT run_id, computed_at, statistic, ontology_id, granularity FROM similarity_matrix_runs
+                   WHERE statistic = %s AND granularity = %s AND ontology_id IS NOT DISTINCT FROM %s
+                   ORDER BY run_id DESC LIMIT 1""",
+                (statistic, granularity, ontology_id),
+            )
+        else:
+            cur.execute(
+                "SELECT run_id, computed_at, statistic, ontology_id, granularity FROM similarity_matrix_runs WHERE run_id = %s",
+                (run_id,),
+            )
+        run = cur.fetchone()
+        if run is None:
+            if run_id is not None:
+                return {"error": f"No similarity matrix run {run_id}"}
+            return {"error": f"No {statistic} {granularity} similarity matrix has been computed yet"
+                             + (f" for ontology_id {ontology_id}" if ontology_id else "")}
+
+        query = """SELECT jurisdiction_a, jurisdiction_b, time_bucket, similarity, pair_count
+                   FROM similarity_matrix WHERE run_id = %s"""
+        params = [run[0]]
+        if jurisdiction:
+            query += " AND jurisdiction_a = %s"
+            params.append(jurisdiction)
+        if time_bucket:
+            query += " AND time_bucket = %s"
+            params.append(time_bucket)
+        query += " ORDER BY jurisdiction_a, jurisdiction_b, time_bucket"
+        cur.execute(query, params)
+        entries = [
+            {"jurisdiction_a": a, "jurisdiction_b": b, "time_bucket": tb, "similarity": sim, "pair_count": n}
+            for a, b, tb, sim, n in cur.fetchall()
+        ]
+
+    return {
+        "run_id": run[0],
+        "computed_at": run[1].isoformat(),
+        "statistic": run[2],
+        "ontology_id": run[3],
+        "granularity": run[4],
+        "entries": entries,
+    }
+
 #produced with help from chatgpt
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the similarity analysis.")
+    parser.add_argument("--matrix", action="store_true", help="compute and store the all-jurisdictions similarity matrix")
+    parser.add_argument("--statistic", default="median", choices=SIMILARITY_STATISTICS)
+    parser.add_argument("--granularity", default=DEFAULT_GRANULARITY, help="day, week, 10d, month or rolling:N")
+    args = parser.parse_args()
+
+    if args.matrix:
+        run_similarity_matrix_job(statistic=args.statistic, granularity=args.granularity)
+        raise SystemExit(0)
     
     country_a="Pakistan"
     country_b="United States of America"
 
     try:
         logging.info(f"Running similarity analysis between {country_a} and {country_b}")
-        similarity = run_similarity_analysis(
+        result = run_similarity_analysis(
             country_a=country_a,
-            country_b=country_b
+            country_b=country_b,
+            statistic=args.statistic,
+            granularity=args.granularity,
         )
 
-        if similarity.empty:
-            logging.warning("No similarity data found for the given countries.")
+        #run_similarity_analysis returns a dict, with an 'error' instead of the sequence on failure
+        if "error" in result:
+            logging.warning(result["error"])
         else:
             print("\nSimilarity scores over time:")
-            print(similarity)
+            for entry in result["similarity_sequence"]:
+                print(f"{entry['time_bucket']}: {entry['similarity']:.4f}")
 
     except Exception as e:
         logging.error(f"Error during similarity analysis: {e}")
@@ -1,6 +1,6 @@
 import streamlit as st
 import requests
-from similarity import plot_similarity_over_time
+from plotting import plot_similarity_over_time
 import pandas as pd
 
 #NOTE - script produced with help from chatgpt
@@ -32,6 +32,21 @@ if st.button("Get Available Jurisdictions"):
 # User input for countries
 country_a = st.text_input("Enter the first country:", placeholder="e.g., Canada")
 country_b = st.text_input("Enter the second country:", placeholder="e.g., United States of America")
+granularity = st.selectbox("Time buckets:", ["10d", "day", "week", "month", "rolling:7", "rolling:30"])
+
+@st.cache_data(ttl=300)
+def fetch_concepts() -> list:
+    """Concept names for the filter, empty if the API can't be reached."""
+    try:
+        response = requests.get(f"{API_BASE_URL}/concepts/")
+        return [c["concept"] for c in response.json().get("concepts", [])]
+    except Exception:
+        return []
+
+# Optional topic filter, e.g. AI + Enforcement
+concepts = st.multiselect("Only compare documents about (optional):", fetch_concepts())
+concept_match = st.radio("Documents must be tagged with:", ["any", "all"], horizontal=True,
+                         format_func=lambda m: f"{m} of the selected concepts")
 
 # Button to fetch and plot similarity
 if st.button("Analyze Similarity"):
@@ -40,7 +55,13 @@ if st.button("Analyze Similarity"):
     else:
         # Call the FastAPI endpoint
         try:
-            response = requests.get(f"{API_BASE_URL}/similarity/", params={"country_a": country_a, "country_b": country_b})
+            response = requests.get(f"{API_BASE_URL}/similarity/", params={
+                "country_a": country_a,
+                "country_b": country_b,
+                "granularity": granularity,
+                "concepts": concepts,
+                "concept_match": concept_match,
+            })
             response_data = response.json()
 
             if response.status_code == 200:
@@ -52,7 +73,7 @@ if st.button("Analyze Similarity"):
                     similarity_df = pd.DataFrame(similarity_sequence)
 
                     # Plot the similarity graph
-                    fig = plot_similarity_over_time(similarity_df, country_a, country_b)
+                    fig = plot_similarity_over_time(similarity_df, country_a, country_b, ontology_id=", ".join(concepts) or None)
                     st.pyplot(fig)
             else:
                 st.error(response_data.get("detail", "An error occurred while fetching similarity data."))
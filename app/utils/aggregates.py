@@ -0,0 +1,227 @@
+"""
+Per-jurisdiction, per-day aggregates of the stored embeddings.
+
+For every (jurisdiction, published_date) we keep the number of documents, the sum of their
+L2-normalised embeddings and a small reservoir sample of them. Cumulative sums over the days of
+a jurisdiction turn any time bucket into two lookups, and the mean cosine similarity between two
+buckets is dot(sum_a, sum_b) / (n_a * n_b), so mean-similarity queries cost O(buckets x dim) at
+any granularity instead of O(n_a x n_b x dim). The aggregates are maintained by ingest in the
+same transaction that writes the documents, which also marks the changed days for the alert
+series (app/utils/alerts.py).
+"""
+
+from __future__ import annotations
+import datetime
+import os
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import psycopg2.extras
+
+from .buckets import to_day_numbers, window_slice
+from .vectors import EMBEDDING_DIM, EMBEDDING_DTYPE, decode_embeddings
+
+RESERVOIR_SIZE = int(os.getenv("AGGREGATE_RESERVOIR_SIZE", "16"))  # 0 disables the reservoir sample
+SUM_DTYPE = np.dtype(">f8")  # sums are kept in float64 so long-running updates don't drift
+
+# (jurisdiction, published_date, embedding)
+AggregateRow = Tuple[str, datetime.date, np.ndarray]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """L2-normalise each row; all-zero rows stay zero."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _decode_sum(blob) -> np.ndarray:
+    return np.frombuffer(blob, dtype=SUM_DTYPE).astype(np.float64)
+
+
+def _decode_reservoir(blob) -> np.ndarray:
+    if not blob:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    return decode_embeddings([blob])
+
+
+def _encode_reservoir(reservoir: List[np.ndarray]) -> bytes:
+    if not reservoir:
+        return b""
+    return np.asarray(reservoir, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def update_daily_aggregates(cur, added: Iterable[AggregateRow], removed: Iterable[AggregateRow] = ()) -> None:
+    """
+    Apply a batch of document changes to daily_aggregates.
+
+    Args:
+        cur: cursor inside the transaction that writes the documents
+        added: documents written by the batch
+        removed: previous versions of documents the batch overwrote, subtracted from their old day.
+            The reservoir can't forget them, so it is an approximate sample after updates.
+    """
+    count_delta: Dict[Tuple[str, datetime.date], int] = defaultdict(int)
+    sum_delta: Dict[Tuple[str, datetime.date], np.ndarray] = {}
+    new_vectors: Dict[Tuple[str, datetime.date], List[np.ndarray]] = defaultdict(list)
+
+    for rows, sign in ((added, 1), (removed, -1)):
+        rows = list(rows)
+        if not rows:
+            continue
+        normalized = normalize_rows(np.vstack([r[2] for r in rows]))
+        for (jurisdiction, day, _), vector in zip(rows, normalized):
+            key = (jurisdiction, day)
+            count_delta[key] += sign
+            sum_delta[key] = sum_delta.get(key, np.zeros(len(vector), dtype=np.float64)) + sign * vector
+            if sign > 0:
+                new_vectors[key].append(vector)
+
+    if not count_delta:
+        return
+
+    keys = sorted(count_delta)
+    # lock the affected aggregates so concurrent writers apply their deltas one after another
+    cur.execute(
+        """SELECT jurisdiction, published_date, doc_count, embedding_sum, reservoir, reservoir_seen
+           FROM daily_aggregates
+           WHERE (jurisdiction, published_date) IN %s
+           FOR UPDATE""",
+        (tuple(keys),),
+    )
+    current = {(r[0], r[1]): r[2:] for r in cur.fetchall()}
+
+    values = []
+    for key in keys:
+        if key in current:
+            doc_count, blob, reservoir_blob, seen = current[key]
+            total = _decode_sum(blob)
+            reservoir = list(_decode_reservoir(reservoir_blob))
+        else:
+            doc_count, total, reservoir, seen = 0, np.zeros_like(sum_delta[key]), [], 0
+
+        # algorithm R: each new document replaces a reservoir slot with probability size/seen
+        for vector in new_vectors.get(key, []):
+            seen += 1
+            if len(reservoir) < RESERVOIR_SIZE:
+                reservoir.append(vector)
+            elif RESERVOIR_SIZE:
+                slot = random.randrange(seen)
+                if slot < RESERVOIR_SIZE:
+                    reservoir[slot] = vector
+
+        values.append((
+            key[0],
+            key[1],
+            max(doc_count + count_delta[key], 0),
+            psycopg2.Binary((total + sum_delta[key]).astype(SUM_DTYPE).tobytes()),
+            psycopg2.Binary(_encode_reservoir(reservoir)),
+            seen,
+        ))
+
+    psycopg2.extras.execute_values(
+        cur,
+        """INSERT INTO daily_aggregates
+           (jurisdiction, published_date, doc_count, embedding_sum, reservoir, reservoir_seen)
+           VALUES %s
+           ON CONFLICT (jurisdiction, published_date) DO UPDATE SET
+               doc_count = EXCLUDED.doc_count,
+               embedding_sum = EXCLUDED.embedding_sum,
+               reservoir = EXCLUDED.reservoir,
+               reservoir_seen = EXCLUDED.reservoir_seen,
+               updated_at = now()""",
+        values,
+    )
+    # the alert series of these days' buckets are brought up to date by update_alert_series
+    psycopg2.extras.execute_values(
+        cur,
+        """INSERT INTO alert_dirty_days (jurisdiction, published_date) VALUES %s
+           ON CONFLICT (jurisdiction, published_date) DO UPDATE SET marked_at = now()""",
+        keys,
+    )
+
+
+def fetch_daily_prefix_sums(cur, jurisdictions: List[str], start_date: Optional[datetime.date] = None,
+                            end_date: Optional[datetime.date] = None) -> Dict[str, dict]:
+    """
+    Load the daily aggregates of the given jurisdictions, optionally only the days in
+    [start_date, end_date], as cumulative sums.
+
+    Returns:
+        {jurisdiction: {
+            'days': int64 (n_days,) sorted day numbers with documents,
+            'count_prefix': int64 (n_days + 1,) documents before each day,
+            'sum_prefix': float64 (n_days + 1, dim) embedding sums before each day,
+            'reservoirs': list of float32 (k, dim) per day,
+            'reservoir_counts': int64 (n_days,) documents each day's reservoir stands for,
+        }}
+    """
+    query = """SELECT jurisdiction, published_date, doc_count, embedding_sum, reservoir
+               FROM daily_aggregates
+               WHERE jurisdiction = ANY(%s) AND doc_count > 0"""
+    params = [list(jurisdictions)]
+    if start_date:
+        query += " AND published_date >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND published_date <= %s"
+        params.append(end_date)
+    cur.execute(query + " ORDER BY jurisdiction, published_date", params)
+    rows_by_jurisdiction: Dict[str, list] = {j: [] for j in jurisdictions}
+    for row in cur.fetchall():
+        rows_by_jurisdiction[row[0]].append(row[1:])
+
+    result = {}
+    for jurisdiction, rows in rows_by_jurisdiction.items():
+        counts = np.array([r[1] for r in rows], dtype=np.int64)
+        sums = np.vstack([_decode_sum(r[2]) for r in rows]) if rows else np.empty((0, EMBEDDING_DIM))
+        result[jurisdiction] = {
+            'days': to_day_numbers([r[0] for r in rows]),
+            'count_prefix': np.concatenate([[0], np.cumsum(counts)]),
+            'sum_prefix': np.vstack([np.zeros((1, sums.shape[1])), np.cumsum(sums, axis=0)]),
+            'reservoirs': [_decode_reservoir(r[3]) for r in rows],
+            'reservoir_counts': counts,
+        }
+    return result
+
+
+def window_aggregate(prefix: dict, start: int, end: int) -> Tuple[int, np.ndarray, slice]:
+    """
+    Document count and embedding sum of the days in [start, end] from fetch_daily_prefix_sums output.
+
+    Returns:
+        (count, float64 (dim,) sum, slice of the days inside the window)
+    """
+    days = window_slice(prefix['days'], start, end)
+    count = int(prefix['count_prefix'][days.stop] - prefix['count_prefix'][days.start])
+    total = prefix['sum_prefix'][days.stop] - prefix['sum_prefix'][days.start]
+    return count, total, days
+
+
+def rebuild_daily_aggregates(conn, batch_size: int = 5000) -> int:
+    """
+    Recompute daily_aggregates from reginsights_clean, e.g. after the migration that creates the
+    table. Runs in one transaction on the given connection.
+
+    Returns:
+        number of documents aggregated
+    """
+    total = 0
+    with conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE daily_aggregates")
+        with conn.cursor(name="rebuild_daily_aggregates") as reader:
+            reader.itersize = batch_size
+            reader.execute(
+                """SELECT jurisdiction, published_date, embedding_bin
+                   FROM reginsights_clean
+                   WHERE embedding_bin IS NOT NULL"""
+            )
+            while True:
+                rows = reader.fetchmany(batch_size)
+                if not rows:
+                    break
+                embeddings = decode_embeddings(r[2] for r in rows)
+                update_daily_aggregates(cur, [(r[0], r[1], e) for r, e in zip(rows, embeddings)])
+                total += len(rows)
+    return total
@@ -0,0 +1,483 @@
+"""
+Incremental convergence / divergence alerts over every jurisdiction pair.
+
+For each unordered jurisdiction pair we keep a time series of the mean similarity of the two
+jurisdictions' documents per bucket (ALERT_GRANULARITY, weekly by default), read from the daily
+aggregates as dot(sum_a, sum_b) / (n_a * n_b), and after every bucket the state of two trend
+detectors:
+
+- an EWMA of the similarity and of its squared deviation, which gives each new bucket a z-score
+  against the pair's recent level and volatility
+- a two-sided tabular CUSUM over those z-scores with drift allowance ALERT_CUSUM_K: cusum_up
+  builds up while the pair keeps converging, cusum_down while it keeps diverging
+
+An alert is a bucket where a CUSUM rises past the user's threshold h (or, with method 'ewma',
+where |z| reaches it). The CUSUMs are never reset, so the stored state doesn't depend on h and
+any threshold can be evaluated at query time, including how many alerts a week it would give.
+
+Ingest marks the (jurisdiction, day) keys it changes in alert_dirty_days. update_alert_series
+recomputes only the buckets containing those days, only for pairs involving a changed
+jurisdiction, and replays those pairs' detectors from their earliest changed bucket, starting
+from the state stored on the bucket before it. The cost of an update follows the new data rather
+than pairs x history.
+"""
+
+from __future__ import annotations
+import datetime
+import logging
+import math
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence, Set, Tuple
+import numpy as np
+import psycopg2.extras
+
+from .aggregates import _decode_sum
+from .buckets import bucket_label, bucket_windows, day_to_date, parse_granularity, to_day_numbers
+from .db_utils import pooled_conn
+
+ALERT_GRANULARITY = os.getenv("ALERT_GRANULARITY", "week")
+ALERT_EWMA_ALPHA = float(os.getenv("ALERT_EWMA_ALPHA", "0.3"))  # weight of the newest bucket in the EWMA
+ALERT_CUSUM_K = float(os.getenv("ALERT_CUSUM_K", "0.5"))  # z-score drift per bucket that doesn't add to the CUSUM
+ALERT_MIN_STD = float(os.getenv("ALERT_MIN_STD", "0.01"))  # floor on the EWM std, so a flat series doesn't blow up the z-scores
+ALERT_WARMUP = int(os.getenv("ALERT_WARMUP", "4"))  # buckets of a pair's series before it is scored
+ALERT_MIN_DOCS = int(os.getenv("ALERT_MIN_DOCS", "3"))  # documents each jurisdiction needs in a bucket for the pair to have a value
+ALERT_DEFAULT_THRESHOLD = float(os.getenv("ALERT_DEFAULT_THRESHOLD", "4"))
+ALERT_METHODS = ("cusum", "ewma")
+ALERT_DIRECTIONS = ("converging", "diverging")
+DEFAULT_VOLUME_THRESHOLDS = (2.0, 3.0, 4.0, 5.0, 6.0, 8.0)
+_ADVISORY_LOCK = 0x7265676C616C  # serialises update_alert_series runs against one database
+
+Pair = Tuple[str, str]
+Bucket = Tuple[int, int]  # inclusive (start, end) day numbers
+
+
+@dataclass
+class TrendState:
+    """EWMA and two-sided CUSUM state of one pair's series after some bucket."""
+    observations: int = 0
+    ewma: float = 0.0
+    ewm_var: float = 0.0
+    cusum_up: float = 0.0
+    cusum_down: float = 0.0
+
+    def update(self, similarity: float) -> Optional[float]:
+        """Advance by one bucket. Returns the bucket's z-score, None while warming up."""
+        z = None
+        if self.observations == 0:
+            self.ewma, self.ewm_var = similarity, 0.0
+        else:
+            deviation = similarity - self.ewma
+            if self.observations >= ALERT_WARMUP:
+                z = deviation / max(math.sqrt(self.ewm_var), ALERT_MIN_STD)
+                self.cusum_up = max(0.0, self.cusum_up + z - ALERT_CUSUM_K)
+                self.cusum_down = max(0.0, self.cusum_down - z - ALERT_CUSUM_K)
+            self.ewma += ALERT_EWMA_ALPHA * deviation
+            self.ewm_var = (1 - ALERT_EWMA_ALPHA) * (self.ewm_var + ALERT_EWMA_ALPHA * deviation ** 2)
+        self.observations += 1
+        return z
+
+
+def check_granularity(granularity: str) -> str:
+    """The granularity, if alert series can use it. Raises ValueError for rolling windows, which overlap."""
+    if parse_granularity(granularity)[0] == "rolling":
+        raise ValueError("Alert series need non-overlapping buckets: day, week, 10d or month")
+    return granularity
+
+
+def buckets_of_days(days: Sequence[int], granularity: str) -> Dict[int, Bucket]:
+    """day number -> (start, end) of the bucket containing it."""
+    if not len(days):
+        return {}
+    starts, ends = bucket_windows(granularity, int(min(days)), int(max(days)))
+    index = np.searchsorted(ends, days)
+    return {int(day): (int(starts[i]), int(ends[i])) for day, i in zip(days, index)}
+
+
+def bucket_similarities(cur, buckets: Dict[Bucket, Set[str]], granularity: str) -> Tuple[list, list]:
+    """
+    Mean similarity of every pair involving a changed jurisdiction in each changed bucket.
+
+    Args:
+        cur: cursor
+        buckets: (start, end) -> jurisdictions with changed days in the bucket
+        granularity: granularity of the buckets
+
+    Returns:
+        (rows (a, b, start, end, similarity, pair_count) to upsert, keys (a, b, start) to delete
+        because one side no longer has ALERT_MIN_DOCS documents in the bucket)
+    """
+    days = [d for start, end in buckets for d in range(start, end + 1)]
+    cur.execute(
+        """SELECT jurisdiction, published_date, doc_count, embedding_sum FROM daily_aggregates
+           WHERE published_date = ANY(%s) AND doc_count > 0""",
+        ([day_to_date(d) for d in days],),
+    )
+    rows = cur.fetchall()
+    bucket_of = buckets_of_days(to_day_numbers([r[1] for r in rows]), granularity)
+    counts: Dict[Bucket, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    sums: Dict[Bucket, Dict[str, np.ndarray]] = defaultdict(dict)
+    for (jurisdiction, _, doc_count, blob), day in zip(rows, to_day_numbers([r[1] for r in rows]).tolist()):
+        bucket = bucket_of[day]
+        counts[bucket][jurisdiction] += doc_count
+        vector = _decode_sum(blob)
+        sums[bucket][jurisdiction] = sums[bucket][jurisdiction] + vector if jurisdiction in sums[bucket] else vector
+
+    upserts, deletes = {}, set()
+    for bucket, changed in buckets.items():
+        present = sorted(j for j, n in counts[bucket].items() if n >= ALERT_MIN_DOCS)
+        index = {j: i for i, j in enumerate(present)}
+        if present:
+            n = np.array([counts[bucket][j] for j in present], dtype=np.float64)
+            matrix = np.vstack([sums[bucket][j] for j in present])
+            similarity = (matrix @ matrix.T) / np.outer(n, n)
+        for a in changed:
+            for b in (set(present) | changed) - {a}:
+                pair = tuple(sorted((a, b)))
+                if pair[0] in index and pair[1] in index:
+                    i, j = index[pair[0]], index[pair[1]]
+                    upserts[(*pair, bucket[0])] = (*pair, *bucket, float(similarity[i, j]), int(n[i] * n[j]))
+                else:
+                    deletes.add((*pair, bucket[0]))
+    return list(upserts.values()), sorted(deletes)
+
+
+def replay_pair(cur, pair: Pair, since: datetime.date, granularity: str) -> list:
+    """
+    Recompute the detector state of a pair's buckets from since onwards, continuing from the state
+    stored on the bucket before it.
+
+    Returns:
+        (a, b, bucket_start, observations, ewma, ewm_var, z_score, cusum_up, cusum_down) per bucket
+    """
+    cur.execute(
+        """SELECT bucket_start, similarity, observations, ewma, ewm_var, cusum_up, cusum_down
+           FROM pair_similarity_series
+           WHERE jurisdiction_a = %(a)s AND jurisdiction_b = %(b)s AND granularity = %(granularity)s
+             AND bucket_start >= COALESCE(
+                 (SELECT max(bucket_start) FROM pair_similarity_series
+                  WHERE jurisdiction_a = %(a)s AND jurisdiction_b = %(b)s AND granularity = %(granularity)s
+                    AND bucket_start < %(since)s),
+                 %(since)s)
+           ORDER BY bucket_start""",
+        {"a": pair[0], "b": pair[1], "granularity": granularity, "since": since},
+    )
+    rows = cur.fetchall()
+    state = TrendState()
+    if rows and rows[0][0] < since:
+        state = TrendState(*rows[0][2:])
+        rows = rows[1:]
+
+    updates = []
+    for bucket_start, similarity, *_ in rows:
+        z = state.update(similarity)
+        updates.append((*pair, bucket_start, state.observations, state.ewma, state.ewm_var, z, state.cusum_up, state.cusum_down))
+    return updates
+
+
+def update_alert_series(conn=None, granularity: str = ALERT_GRANULARITY) -> dict:
+    """
+    Bring the pair series and detector state up to date with the days ingest marked as changed.
+    Runs in one transaction, so the marks are only cleared if the update commits.
+
+    Args:
+        conn: connection to run on, a pooled one by default
+        granularity: bucket granularity of the series
+
+    Returns:
+        counts of the work done: changed days, buckets, pairs, and series rows written, deleted and replayed
+    """
+    if conn is None:
+        with pooled_conn() as pooled:
+            return update_alert_series(pooled, granularity)
+
+    check_granularity(granularity)
+    start = time.perf_counter()
+    stats = {"dirty_days": 0, "buckets": 0, "pairs": 0, "rows_written": 0, "rows_deleted": 0, "rows_replayed": 0}
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (_ADVISORY_LOCK,))
+        cur.execute("DELETE FROM alert_dirty_days RETURNING jurisdiction, published_date")
+        dirty = cur.fetchall()
+        stats["dirty_days"] = len(dirty)
+        if not dirty:
+            return dict(stats, seconds=time.perf_counter() - start)
+
+        days = to_day_numbers([d for _, d in dirty])
+        bucket_of = buckets_of_days(days, granularity)
+        buckets: Dict[Bucket, Set[str]] = defaultdict(set)
+        for (jurisdiction, _), day in zip(dirty, days.tolist()):
+            buckets[bucket_of[day]].add(jurisdiction)
+        upserts, deletes = bucket_similarities(cur, buckets, granularity)
+
+        if deletes:
+            psycopg2.extras.execute_values(
+                cur,
+                """DELETE FROM pair_similarity_series s USING (VALUES %s) AS d (a, b, granularity, bucket_start)
+                   WHERE s.jurisdiction_a = d.a AND s.jurisdiction_b = d.b
+                     AND s.granularity = d.granularity AND s.bucket_start = d.bucket_start""",
+                [(a, b, granularity, day_to_date(s)) for a, b, s in deletes],
+                template="(%s, %s, %s, %s::date)",
+            )
+        if upserts:
+            # the detector columns are placeholders until the replay below fills them in
+            psycopg2.extras.execute_values(
+                cur,
+                """INSERT INTO pair_similarity_series
+                   (jurisdiction_a, jurisdiction_b, granularity, bucket_start, bucket_end, similarity, pair_count,
+                    observations, ewma, ewm_var, cusum_up, cusum_down)
+                   VALUES %s
+                   ON CONFLICT (jurisdiction_a, jurisdiction_b, granularity, bucket_start) DO UPDATE SET
+                       bucket_end = EXCLUDED.bucket_end,
+                       similarity = EXCLUDED.similarity,
+                       pair_count = EXCLUDED.pair_count,
+                       updated_at = now()""",
+                [(a, b, granularity, day_to_date(s), day_to_date(e), sim, n, 0, sim, 0.0, 0.0, 0.0)
+                 for a, b, s, e, sim, n in upserts],
+            )
+
+        # each affected pair replays from its earliest changed bucket
+        since: Dict[Pair, int] = {}
+        for a, b, s, *_ in upserts + deletes:
+            since[(a, b)] = min(s, since.get((a, b), s))
+        replayed = []
+        for pair, first in sorted(since.items()):
+            replayed.extend(replay_pair(cur, pair, day_to_date(first), granularity))
+        if replayed:
+            psycopg2.extras.execute_values(
+                cur,
+                """UPDATE pair_similarity_series s SET
+                       observations = v.observations, ewma = v.ewma, ewm_var = v.ewm_var, z_score = v.z_score,
+                       cusum_up = v.cusum_up, cusum_down = v.cusum_down, updated_at = now()
+                   FROM (VALUES %s) AS v (a, b, granularity, bucket_start, observations, ewma, ewm_var, z_score, cusum_up, cusum_down)
+                   WHERE s.jurisdiction_a = v.a AND s.jurisdiction_b = v.b
+                     AND s.granularity = v.granularity AND s.bucket_start = v.bucket_start""",
+                [(a, b, granularity, *rest) for a, b, *rest in replayed],
+                template="(%s, %s, %s, %s::date, %s::integer, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8)",
+            )
+
+        stats.update(buckets=len(buckets), pairs=len(since), rows_written=len(upserts),
+                     rows_deleted=len(deletes), rows_replayed=len(replayed))
+
+    stats["seconds"] = time.perf_counter() - start
+    logging.info(
+        f"Alert series updated: {stats['dirty_days']} changed days in {stats['buckets']} {granularity} buckets, "
+        f"{stats['pairs']} pairs, {stats['rows_written']} buckets recomputed and {stats['rows_replayed']} replayed "
+        f"in {stats['seconds']:.2f}s"
+    )
+    return stats
+
+
+def rebuild_alert_series(conn, granularity: str = ALERT_GRANULARITY) -> dict:
+    """
+    Recompute a granularity's series from all daily aggregates, e.g. after changing
+    ALERT_GRANULARITY or the detector settings, or after rebuilding the aggregates.
+    """
+    check_granularity(granularity)
+    with conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM pair_similarity_series WHERE granularity = %s", (granularity,))
+        cur.execute(
+            """INSERT INTO alert_dirty_days (jurisdiction, published_date)
+               SELECT jurisdiction, published_date FROM daily_aggregates WHERE doc_count > 0
+               ON CONFLICT DO NOTHING"""
+        )
+    return update_alert_series(conn, granularity)
+
+
+def _crossings(method: str, threshold: str) -> Tuple[str, str]:
+    """SQL conditions for a converging and a diverging alert on a row of the series CTE."""
+    if method == "ewma":
+        return f"s.z_score >= {threshold}", f"s.z_score <= -{threshold}"
+    return (f"s.cusum_up > {threshold} AND s.previous_up <= {threshold}",
+            f"s.cusum_down > {threshold} AND s.previous_down <= {threshold}")
+
+
+# every bucket of the selected pairs with the CUSUMs of the bucket before, which a crossing needs
+SERIES_CTE = """
+    WITH s AS (
+        SELECT jurisdiction_a, jurisdiction_b, bucket_start, bucket_end, similarity, pair_count, z_score,
+               cusum_up, cusum_down,
+               LAG(ewma) OVER w AS baseline,
+               LAG(cusum_up, 1, 0.0::float8) OVER w AS previous_up,
+               LAG(cusum_down, 1, 0.0::float8) OVER w AS previous_down
+        FROM pair_similarity_series
+        WHERE granularity = %(granularity)s {pairs}
+        WINDOW w AS (PARTITION BY jurisdiction_a, jurisdiction_b ORDER BY bucket_start)
+    )
+"""
+
+
+def _pair_filter(jurisdiction: Optional[str], other: Optional[str]) -> str:
+    if jurisdiction and other:
+        return ("AND jurisdiction_a = LEAST(%(jurisdiction)s, %(other)s)::text "
+                "AND jurisdiction_b = GREATEST(%(jurisdiction)s, %(other)s)::text")
+    if jurisdiction or other:
+        return "AND %(jurisdiction)s IN (jurisdiction_a, jurisdiction_b)"
+    return ""
+
+
+def _check_query(method: str, threshold: float, granularity: str) -> None:
+    if method not in ALERT_METHODS:
+        raise ValueError(f"method must be one of {ALERT_METHODS}")
+    if threshold <= 0:
+        raise ValueError("threshold must be positive")
+    check_granularity(granularity)
+
+
+def pending_days(cur) -> int:
+    """Changed days not yet folded into the series."""
+    cur.execute("SELECT count(*) FROM alert_dirty_days")
+    return cur.fetchone()[0]
+
+
+def get_alerts(threshold: float = ALERT_DEFAULT_THRESHOLD, method: str = "cusum", jurisdiction: Optional[str] = None,
+               other: Optional[str] = None, direction: Optional[str] = None, since: Optional[datetime.date] = None,
+               limit: int = 100, granularity: str = ALERT_GRANULARITY) -> Dict:
+    """
+    Convergence and divergence alerts at a threshold, most recent first.
+
+    Args:
+        threshold: CUSUM decision interval h, or |z| for method 'ewma', in standard deviations
+        method: 'cusum' alerts when a CUSUM rises past the threshold, 'ewma' on every bucket whose
+            z-score against the EWMA reaches it
+        jurisdiction: only pairs involving this jurisdiction, which is listed as jurisdiction_a
+        other: with jurisdiction, only the pair of the two, e.g. jurisdiction='UK', other='EU'
+        direction: only 'converging' or 'diverging' alerts
+        since: only alerts on buckets starting on or after this date
+        limit: at most this many alerts
+        granularity: series to read
+
+    Returns:
+        A dictionary with the settings, the alerts and the number of changed days not yet in the series.
+
+    Raises:
+        ValueError: invalid arguments
+    """
+    _check_query(method, threshold, granularity)
+    if direction is not None and direction not in ALERT_DIRECTIONS:
+        raise ValueError(f"direction must be one of {ALERT_DIRECTIONS}")
+    jurisdiction = jurisdiction or other
+    other = other if jurisdiction != other else None
+
+    converging, diverging = _crossings(method, "%(threshold)s")
+    conditions = {"converging": converging, "diverging": diverging}
+    wanted = [direction] if direction else list(ALERT_DIRECTIONS)
+    query = SERIES_CTE.format(pairs=_pair_filter(jurisdiction, other)) + f"""
+        SELECT jurisdiction_a, jurisdiction_b, bucket_start, bucket_end, similarity, pair_count, baseline, z_score,
+               cusum_up, cusum_down, {", ".join(f"({conditions[d]}) AS {d}" for d in wanted)}
+        FROM s
+        WHERE ({" OR ".join(f"({conditions[d]})" for d in wanted)}) {"AND bucket_start >= %(since)s" if since else ""}
+        ORDER BY bucket_start DESC, jurisdiction_a, jurisdiction_b
+        LIMIT %(limit)s
+    """
+    params = {"granularity": granularity, "jurisdiction": jurisdiction, "other": other, "threshold": threshold,
+              "since": since, "limit": limit}
+
+    alerts = []
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(query, params)
+        for row in cur.fetchall():
+            a, b, start, end, similarity, pair_count, baseline, z, up, down = row[:10]
+            if jurisdiction and b == jurisdiction:
+                a, b = b, a
+            for name, fired in zip(wanted, row[10:]):
+                if not fired:
+                    continue
+                alerts.append({
+                    "jurisdiction_a": a,
+                    "jurisdiction_b": b,
+                    "time_bucket": bucket_label(*to_day_numbers([start, end])),
+                    "direction": name,
+                    "similarity": similarity,
+                    "baseline": baseline,
+                    "z_score": z,
+                    "cusum": up if name == "converging" else down,
+                    "pair_count": pair_count,
+                })
+        pending = pending_days(cur)
+
+    return {
+        "method": method,
+        "threshold": threshold,
+        "granularity": granularity,
+        "alerts": alerts[:limit],
+        "pending_days": pending,
+    }
+
+
+def alert_volume(thresholds: Sequence[float] = DEFAULT_VOLUME_THRESHOLDS, method: str = "cusum",
+                 jurisdiction: Optional[str] = None, lookback_weeks: int = 26,
+                 granularity: str = ALERT_GRANULARITY) -> Dict:
+    """
+    How many alerts a week each threshold would have raised over the last lookback_weeks of the
+    series, to pick a threshold before subscribing to it.
+
+    Args:
+        thresholds: thresholds to evaluate
+        method: 'cusum' or 'ewma', as for get_alerts
+        jurisdiction: only pairs involving this jurisdiction
+        lookback_weeks: weeks up to the latest bucket to count over, fewer if the series is shorter
+        granularity: series to read
+
+    Returns:
+        A dictionary with the period counted and, per threshold, the alert counts and the expected
+        number of alerts per week.
+
+    Raises:
+        ValueError: invalid arguments
+    """
+    thresholds = sorted(set(float(t) for t in thresholds))
+    if not thresholds:
+        raise ValueError("Need at least one threshold")
+    for threshold in thresholds:
+        _check_query(method, threshold, granularity)
+    if lookback_weeks < 1:
+        raise ValueError("lookback_weeks must be at least 1")
+
+    params = {"granularity": granularity, "jurisdiction": jurisdiction, "other": None}
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"""SELECT min(bucket_start), max(bucket_end), count(DISTINCT (jurisdiction_a, jurisdiction_b))
+                FROM pair_similarity_series WHERE granularity = %(granularity)s {_pair_filter(jurisdiction, None)}""",
+            params,
+        )
+        first, last, pairs = cur.fetchone()
+        if last is None:
+            return {"method": method, "granularity": granularity, "weeks": 0.0, "pairs": 0, "start_date": None,
+                    "end_date": None, "thresholds": [], "pending_days": pending_days(cur)}
+
+        window_start = max(first, last - datetime.timedelta(weeks=lookback_weeks) + datetime.timedelta(days=1))
+        converging, diverging = _crossings(method, "t.threshold")
+        cur.execute(
+            SERIES_CTE.format(pairs=_pair_filter(jurisdiction, None)) + f"""
+            SELECT t.threshold, count(*) FILTER (WHERE {converging}), count(*) FILTER (WHERE {diverging})
+            FROM unnest(%(thresholds)s::float8[]) AS t (threshold)
+            LEFT JOIN s ON s.bucket_start >= %(window_start)s
+            GROUP BY t.threshold
+            ORDER BY t.threshold""",
+            dict(params, thresholds=thresholds, window_start=window_start),
+        )
+        counts = cur.fetchall()
+        pending = pending_days(cur)
+
+    weeks = ((last - window_start).days + 1) / 7
+    return {
+        "method": method,
+        "granularity": granularity,
+        "start_date": window_start.isoformat(),
+        "end_date": last.isoformat(),
+        "weeks": weeks,
+        "pairs": pairs,
+        "thresholds": [
+            {
+                "threshold": threshold,
+                "alerts": up + down,
+                "converging": up,
+                "diverging": down,
+                "expected_weekly_alerts": (up + down) / weeks,
+            }
+            for threshold, up, down in counts
+        ],
+        "pending_days": pending,
+    }
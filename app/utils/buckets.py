@@ -0,0 +1,128 @@
+"""
+Query-time time buckets.
+
+Documents are bucketed by published_date when a query runs rather than by a label stored at
+ingest, so the same data can be viewed per day, week, ten days, month or as a rolling N-day
+window. Days are handled as integer day numbers (days since 1970-01-01) so that bucket bounds
+are plain np.searchsorted lookups on date-sorted data.
+"""
+
+from __future__ import annotations
+import datetime
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+GRANULARITIES = ("day", "week", "10d", "month", "rolling:<N>")
+DEFAULT_GRANULARITY = "10d"
+
+
+def parse_granularity(granularity: str) -> Tuple[str, int]:
+    """
+    Validate a granularity string.
+
+    Returns:
+        (kind, window length in days for rolling windows else 0)
+    """
+    if granularity in ("day", "week", "10d", "month"):
+        return granularity, 0
+    if granularity.startswith("rolling:"):
+        try:
+            days = int(granularity.split(":", 1)[1])
+        except ValueError:
+            days = 0
+        if days >= 1:
+            return "rolling", days
+    raise ValueError(f"Unknown granularity {granularity!r}, expected one of {GRANULARITIES}")
+
+
+def to_day_numbers(dates) -> np.ndarray:
+    """datetime.date values (or anything numpy reads as dates) to int64 day numbers."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def bucket_windows(granularity: str, first_day: int, last_day: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Inclusive [start, end] day-number windows covering first_day..last_day.
+
+    'week' windows start on Monday; '10d' windows are the 1st-10th, 11th-20th and 21st-end of
+    each month; 'rolling:N' gives one trailing N-day window ending on every day in the range.
+    Windows only overlap for rolling granularities.
+    """
+    kind, length = parse_granularity(granularity)
+    days = np.arange(first_day, last_day + 1, dtype=np.int64)
+    if len(days) == 0:
+        return days, days
+
+    if kind == "day":
+        return days, days
+
+    if kind == "rolling":
+        return days - (length - 1), days
+
+    dates = days.astype("datetime64[D]")
+    if kind == "week":
+        # 1970-01-01 was a Thursday, so (day + 3) % 7 is 0 on Mondays
+        starts = np.unique(days - (days + 3) % 7)
+        return starts, starts + 6
+
+    month_starts = dates.astype("datetime64[M]")
+    if kind == "month":
+        starts = np.unique(month_starts)
+        return starts.astype("datetime64[D]").astype(np.int64), ((starts + 1).astype("datetime64[D]") - 1).astype(np.int64)
+
+    # 10d
+    day_of_month = (dates - month_starts.astype("datetime64[D]")).astype(np.int64)  # 0-based
+    third = np.minimum(day_of_month // 10, 2)
+    starts = np.unique(month_starts.astype("datetime64[D]").astype(np.int64) + third * 10)
+    start_dates = starts.astype("datetime64[D]")
+    start_day_of_month = (start_dates - start_dates.astype("datetime64[M]").astype("datetime64[D]")).astype(np.int64)
+    month_ends = ((start_dates.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1).astype(np.int64)
+    ends = np.where(start_day_of_month < 20, starts + 9, month_ends)
+    return starts, ends
+
+
+def day_to_date(day: int) -> datetime.date:
+    return np.datetime64(int(day), "D").astype(datetime.date)
+
+
+def bucket_label(start: int, end: int) -> str:
+    """'YYYY-MM-DD to YYYY-MM-DD', the same format ingest's ten_day_bucket writes."""
+    return f"{np.datetime64(int(start), 'D')} to {np.datetime64(int(end), 'D')}"
+
+
+def recent_windows(granularity: str, last_day: int, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The n most recent [start, end] windows up to and including last_day."""
+    _, length = parse_granularity(granularity)
+    # n buckets never span more than n months, plus the length of a rolling window
+    starts, ends = bucket_windows(granularity, last_day - n * 31 - length, last_day)
+    return starts[-n:], ends[-n:]
+
+
+def time_windows(day_arrays: Sequence[np.ndarray], granularity: str,
+                 last_n: Optional[int] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Labels and [start, end] windows spanning the first to the last day of any of the sorted
+    day-number arrays, or only the last_n windows up to the last day.
+
+    Returns:
+        (labels, starts, ends)
+    """
+    parse_granularity(granularity)  # reject bad input even when there is no data
+    nonempty = [days for days in day_arrays if len(days)]
+    if not nonempty:
+        empty = np.empty(0, dtype=np.int64)
+        return [], empty, empty
+    last_day = max(int(days[-1]) for days in nonempty)
+    if last_n:
+        starts, ends = recent_windows(granularity, last_day, last_n)
+    else:
+        starts, ends = bucket_windows(granularity, min(int(days[0]) for days in nonempty), last_day)
+    return [bucket_label(s, e) for s, e in zip(starts, ends)], starts, ends
+
+
+def window_slice(days: np.ndarray, start: int, end: int) -> slice:
+    """Rows of a date-sorted array whose day number falls in [start, end]."""
+    return slice(
+        int(np.searchsorted(days, start, side="left")),
+        int(np.searchsorted(days, end, side="right")),
+    )
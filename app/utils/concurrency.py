@@ -0,0 +1,87 @@
+"""
+Asyncio helpers for the API: per-endpoint concurrency limits and request coalescing.
+"""
+
+from __future__ import annotations
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class TooBusy(Exception):
+    """Raised when an endpoint's queue is full or a request waited too long for a slot."""
+
+
+class EndpointLimiter:
+    """
+    At most max_concurrent requests run at once; up to max_queue more wait (for at most
+    queue_timeout seconds) and anything beyond that is rejected straight away with TooBusy.
+
+    Usage:
+        async with limiter:
+            ...
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._running = 0
+        self._waiting = 0
+        self.rejected = 0
+
+    async def __aenter__(self) -> "EndpointLimiter":
+        if not self._semaphore.locked():
+            # a free slot: acquire() returns without suspending, so no other request can slip in first
+            await self._semaphore.acquire()
+        elif self._waiting >= self.max_queue:
+            self.rejected += 1
+            raise TooBusy(f"{self.name}: {self.max_concurrent} running and {self._waiting} queued")
+        else:
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise TooBusy(f"{self.name}: no free slot after {self.queue_timeout:.0f}s")
+            finally:
+                self._waiting -= 1
+        self._running += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._running -= 1
+        self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._running,
+            "queued": self._waiting,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+        }
+
+
+class RequestCoalescer:
+    """
+    Runs one computation per key at a time: concurrent callers with the same key await the
+    result of the call already in flight instead of starting their own.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.coalesced = 0
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            # shield so one follower disconnecting doesn't cancel the shared computation
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(compute())
+        self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(future)
@@ -1,15 +1,315 @@
 #file created by chatgpt
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
 import psycopg2, psycopg2.extras
+import psycopg2.extensions
 from dotenv import load_dotenv
+from pathlib import Path
+from typing import List
 import os
 
 load_dotenv("/workspaces/archie_goodman_regbrain_challenge/.env")
 DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PW = os.getenv("DB_PASS")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+
+# connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))  # ping connections idle longer than this before reuse
+
+DB_DIR = Path(__file__).resolve().parent.parent / "db"
+INIT_SQL = DB_DIR / "init.sql"
+MIGRATIONS_DIR = DB_DIR / "migrations"
 
 def db_conn():
     return psycopg2.connect(
-        host="localhost", port=5432,
+        host=DB_HOST, port=DB_PORT,
         dbname=DB_NAME, user=DB_USER, password=DB_PW
-    )
\ No newline at end of file
+    )
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    Unlike psycopg2.pool, checkout blocks (up to a timeout) when all connections are in use
+    instead of raising, idle connections are kept up to maxconn rather than minconn, and
+    connections that have been idle a while are pinged before being handed out.
+
+    Creating the pool doesn't connect: connections are opened on checkout, or up front by
+    prefill() from a thread that may block (the API's warm-up, never the event loop).
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float, check_after: float, connect=db_conn):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self._connect = connect
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, time it was returned)
+        self._size = 0  # open connections, idle + in use
+        self._in_use = 0
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "timeouts": 0,
+            "failed_health_checks": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def prefill(self) -> None:
+        """Open connections until minconn are open."""
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1  # reserve the slot before connecting outside the lock
+            try:
+                conn = self._new_connection()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats["created"] += 1
+        return conn
+
+    def _close(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._stats["closed"] += 1
+
+    def _healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check a connection out, waiting up to the pool timeout for one to become free."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while not self._idle and self._size >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"no database connection free after {self.timeout:.1f}s ({self.maxconn} in use)")
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+                self._size += 1  # reserve the slot before connecting outside the lock
+            self._in_use += 1
+
+            waited = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+        try:
+            if conn is not None and not self._healthy(conn, idle_since):
+                with self._cond:
+                    self._stats["failed_health_checks"] += 1
+                    self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._new_connection()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Return a connection; broken or discarded connections are closed and their slot freed."""
+        with self._cond:
+            self._in_use -= 1
+            status = None if conn.closed else conn.info.transaction_status
+            if status not in (None, psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN) and not discard:
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except psycopg2.Error:
+                        discard = True
+                if not discard:
+                    self._idle.append((conn, time.monotonic()))
+                    self._cond.notify()
+                    return
+            self._close(conn)
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for a transaction: commit on success, roll back on error, always return it."""
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                size=self._size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+                min_size=self.minconn,
+                max_size=self.maxconn,
+                wait_seconds_avg=stats["wait_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0,
+            )
+            return stats
+
+    def closeall(self) -> None:
+        with self._cond:
+            while self._idle:
+                self._close(self._idle.pop()[0])
+                self._size -= 1
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """The process-wide pool, created on first use (and re-created in forked children). Doesn't connect."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def pool_exists() -> bool:
+    """Whether this process has created its pool, i.e. has needed the database."""
+    with _pool_lock:
+        return _pool is not None and _pool_pid == os.getpid()
+
+
+def close_pool() -> None:
+    """Close the idle connections of this process's pool, if it has one."""
+    with _pool_lock:
+        pool = _pool if _pool_pid == os.getpid() else None
+    if pool is not None:
+        pool.closeall()
+
+
+@contextmanager
+def pooled_conn():
+    """
+    Context-managed checkout from the process-wide pool.
+
+    Usage:
+        with pooled_conn() as conn, conn.cursor() as cur:
+            cur.execute(...)
+    """
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def get_dataset_generation() -> int:
+    """Current dataset generation; changes whenever ingest commits new or updated documents."""
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT generation FROM dataset_generation")
+        row = cur.fetchone()
+        return row[0] if row else 0
+
+
+def bump_dataset_generation(cur) -> None:
+    """Advance the dataset generation inside the caller's (ingest) transaction."""
+    cur.execute("UPDATE dataset_generation SET generation = generation + 1, updated_at = now()")
+
+
+def pool_stats() -> dict:
+    """
+    In-use/idle counts, connections created, and checkout wait times for the process-wide pool.
+    Zeroes when this process has no pool yet; reporting never creates one.
+    """
+    if not pool_exists():
+        return ConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_AFTER).stats()
+    return get_pool().stats()
+
+def apply_migrations() -> List[str]:
+    """
+    Bring the schema up to date: run init.sql, then every file in db/migrations that has not
+    been applied yet, in filename order. Each migration runs in its own transaction.
+
+    Returns:
+        names of the migrations applied by this call
+    """
+    applied = []
+    conn = db_conn()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute(INIT_SQL.read_text())
+            cur.execute(
+                """CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version     TEXT PRIMARY KEY,
+                    applied_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+                )"""
+            )
+            cur.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cur.fetchall()}
+
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            if path.name in done:
+                continue
+            with conn, conn.cursor() as cur:
+                cur.execute(path.read_text())
+                cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (path.name,))
+            logging.info(f"Applied migration {path.name}")
+            applied.append(path.name)
+    finally:
+        conn.close()
+
+    return applied
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    apply_migrations()
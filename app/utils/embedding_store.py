@@ -0,0 +1,304 @@
+"""
+Memory-mapped snapshot of the stored embeddings, for read-heavy and offline similarity queries.
+
+Between ingests the analytics workload only reads, yet every query fetches and decodes its rows
+from reginsights_clean again. The exporter writes all embedded documents, L2-normalised and
+sorted by (jurisdiction, published_date, doc_id), to one contiguous float32 .npy matrix with a
+columnar metadata sidecar:
+
+    embeddings.npy       float32 (n, dim), normalised
+    days.npy             int32 (n,) published_date as a day number
+    doc_ids.npy          uint8 (n, 16) uuid bytes
+    concepts.npy         int32 codes into manifest['concepts'], concept_offsets.npy int64 (n + 1,)
+                         giving each document's range of them (CSR layout)
+    ontology_ids.npy     likewise, with ontology_offsets.npy
+    manifest.json        counts, vocabularies, the dataset generation exported and the offset index:
+                         jurisdiction -> [first row, last row + 1]
+
+A jurisdiction is one contiguous row range and its days are sorted, so a jurisdiction + date
+range is a zero-copy slice of the memory map; API workers opening the same snapshot share it
+through the page cache. Only concept / ontology filters copy the rows they keep.
+
+Each export goes to a new snapshot directory under EMBEDDING_STORE_DIR and is switched to by
+atomically replacing the CURRENT file, so readers never see a half-written snapshot and keep
+using the one they mapped until they notice the switch. When EMBEDDING_STORE_DIR is set,
+app/similarity.py reads from the store instead of the database and can run without one.
+
+Usage:
+    python -m app.utils.embedding_store --export [--dir /data/embedding-store]
+"""
+
+from __future__ import annotations
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from .aggregates import normalize_rows
+from .buckets import to_day_numbers
+from .vectors import EMBEDDING_DIM, decode_embeddings
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "")  # read by get_store() at call time; empty disables the store
+EMBEDDING_STORE_KEEP = int(os.getenv("EMBEDDING_STORE_KEEP", "2"))  # snapshots kept, the current one included
+EXPORT_BATCH_SIZE = 5000
+STORE_FORMAT = 1
+CURRENT_FILE = "CURRENT"
+
+
+def _write_array(path: Path, array: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _encode_lists(lists: List[Sequence[str]], vocabulary: Dict[str, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-document string lists as (int32 codes, int64 offsets), each document's values deduplicated."""
+    codes, offsets = [], [0]
+    for values in lists:
+        unique = {vocabulary.setdefault(v, len(vocabulary)) for v in (values or [])}
+        codes.extend(sorted(unique))
+        offsets.append(len(codes))
+    return np.array(codes, dtype=np.int32), np.array(offsets, dtype=np.int64)
+
+
+def export_embedding_store(conn, store_dir: Path, batch_size: int = EXPORT_BATCH_SIZE) -> Path:
+    """
+    Snapshot every embedded document into a new snapshot directory and make it the current one.
+
+    Reads in one REPEATABLE READ transaction, so the rows, their count and the dataset generation
+    recorded in the manifest all come from the same moment even while ingest is writing.
+
+    Args:
+        conn: connection to export over, not in a transaction
+        store_dir: the store directory, created if needed
+        batch_size: rows decoded and written at a time
+
+    Returns:
+        the snapshot directory written
+    """
+    start = time.perf_counter()
+    store_dir = Path(store_dir)
+    store_dir.mkdir(parents=True, exist_ok=True)
+
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT generation FROM dataset_generation")
+            row = cur.fetchone()
+            generation = row[0] if row else 0
+            cur.execute("SELECT count(*) FROM reginsights_clean WHERE embedding_bin IS NOT NULL")
+            count = cur.fetchone()[0]
+
+            # names sort by export time
+            snapshot = store_dir / f"snapshot-{datetime.datetime.now(datetime.timezone.utc):%Y%m%dT%H%M%S%f}-g{generation}"
+            partial = snapshot.with_name(snapshot.name + ".partial")
+            partial.mkdir()
+            try:
+                embeddings = np.lib.format.open_memmap(partial / "embeddings.npy", mode="w+", dtype=np.float32,
+                                                       shape=(count, EMBEDDING_DIM))
+                days = np.empty(count, dtype=np.int32)
+                doc_ids = np.empty((count, 16), dtype=np.uint8)
+                jurisdictions: Dict[str, List[int]] = {}
+                concept_lists, ontology_lists = [], []
+
+                with conn.cursor(name="export_embedding_store") as reader:
+                    reader.itersize = batch_size
+                    reader.execute(
+                        """SELECT jurisdiction, published_date, doc_id::text, concepts, ontology_ids, embedding_bin
+                           FROM reginsights_clean
+                           WHERE embedding_bin IS NOT NULL
+                           ORDER BY jurisdiction, published_date, doc_id"""
+                    )
+                    offset = 0
+                    while True:
+                        rows = reader.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        stop = offset + len(rows)
+                        embeddings[offset:stop] = normalize_rows(decode_embeddings(r[5] for r in rows))
+                        days[offset:stop] = to_day_numbers([r[1] for r in rows])
+                        doc_ids[offset:stop] = np.frombuffer(b"".join(uuid.UUID(r[2]).bytes for r in rows), dtype=np.uint8).reshape(-1, 16)
+                        for i, r in enumerate(rows, offset):
+                            jurisdictions.setdefault(r[0], [i, i])[1] = i + 1
+                        concept_lists.extend(r[3] for r in rows)
+                        ontology_lists.extend(r[4] for r in rows)
+                        offset = stop
+
+                embeddings.flush()
+                del embeddings
+                concept_vocabulary: Dict[str, int] = {}
+                ontology_vocabulary: Dict[str, int] = {}
+                concepts, concept_offsets = _encode_lists(concept_lists, concept_vocabulary)
+                ontology_ids, ontology_offsets = _encode_lists(ontology_lists, ontology_vocabulary)
+                for name, array in (("days", days), ("doc_ids", doc_ids), ("concepts", concepts),
+                                    ("concept_offsets", concept_offsets), ("ontology_ids", ontology_ids),
+                                    ("ontology_offsets", ontology_offsets)):
+                    _write_array(partial / f"{name}.npy", array)
+
+                manifest = {
+                    "format": STORE_FORMAT,
+                    "created_at": datetime.datetime.now().astimezone().isoformat(),
+                    "dataset_generation": generation,
+                    "count": count,
+                    "dim": EMBEDDING_DIM,
+                    "normalized": True,
+                    "sort": ["jurisdiction", "published_date", "doc_id"],
+                    "jurisdictions": jurisdictions,
+                    "concepts": list(concept_vocabulary),
+                    "ontology_ids": list(ontology_vocabulary),
+                }
+                (partial / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+                os.rename(partial, snapshot)
+            except BaseException:
+                shutil.rmtree(partial, ignore_errors=True)
+                raise
+    finally:
+        conn.set_session(isolation_level="DEFAULT", readonly=False)
+
+    # switch readers over, then drop the oldest snapshots; processes that still map one keep
+    # their pages until they reopen
+    current = store_dir / (CURRENT_FILE + ".tmp")
+    current.write_text(snapshot.name, encoding="utf-8")
+    os.replace(current, store_dir / CURRENT_FILE)
+    snapshots = sorted(p for p in store_dir.glob("snapshot-*") if p.is_dir() and not p.name.endswith(".partial"))
+    for old in snapshots[:-max(EMBEDDING_STORE_KEEP, 1)]:
+        if old != snapshot:
+            shutil.rmtree(old, ignore_errors=True)
+
+    size = sum(p.stat().st_size for p in snapshot.iterdir())
+    logging.info(f"Exported {count} embeddings (generation {generation}, {size / 2**20:.1f} MiB) to {snapshot} "
+                 f"in {time.perf_counter() - start:.1f}s")
+    return snapshot
+
+
+class EmbeddingStore:
+    """Read-only view of one snapshot; the embedding matrix is memory-mapped, the small columns loaded."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+        if self.manifest["format"] != STORE_FORMAT:
+            raise ValueError(f"{self.path} has store format {self.manifest['format']}, expected {STORE_FORMAT}")
+        self.generation = self.manifest["dataset_generation"]
+        self.embeddings = np.load(self.path / "embeddings.npy", mmap_mode="r")
+        self.days = np.load(self.path / "days.npy").astype(np.int64)
+        self.ranges = {j: tuple(r) for j, r in self.manifest["jurisdictions"].items()}
+        self._columns = {
+            "concepts": (np.load(self.path / "concepts.npy"), np.load(self.path / "concept_offsets.npy"),
+                         {c: i for i, c in enumerate(self.manifest["concepts"])}),
+            "ontology_ids": (np.load(self.path / "ontology_ids.npy"), np.load(self.path / "ontology_offsets.npy"),
+                             {c: i for i, c in enumerate(self.manifest["ontology_ids"])}),
+        }
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def jurisdictions(self) -> List[str]:
+        return sorted(self.ranges)
+
+    def concept_counts(self) -> List[Dict]:
+        """Documents per concept name, like get_available_concepts."""
+        codes, _, vocabulary = self._columns["concepts"]
+        counts = np.bincount(codes, minlength=len(vocabulary))
+        return [{"concept": c, "doc_count": int(counts[i])} for c, i in sorted(vocabulary.items()) if counts[i]]
+
+    def _rows(self, jurisdiction: str, start_date: Optional[datetime.date], end_date: Optional[datetime.date]) -> slice:
+        first, stop = self.ranges.get(jurisdiction, (0, 0))
+        days = self.days[first:stop]
+        lo = np.searchsorted(days, to_day_numbers([start_date])[0], side="left") if start_date else 0
+        hi = np.searchsorted(days, to_day_numbers([end_date])[0], side="right") if end_date else len(days)
+        return slice(first + int(lo), first + int(hi))
+
+    def _matches(self, column: str, rows: slice, values: Sequence[str], match_all: bool) -> np.ndarray:
+        """Boolean mask over rows of the documents tagged with any / all of values."""
+        codes, offsets, vocabulary = self._columns[column]
+        wanted = {vocabulary[v] for v in values if v in vocabulary}
+        n = rows.stop - rows.start
+        if match_all and len(wanted) < len(set(values)):
+            return np.zeros(n, dtype=bool)
+        span = offsets[rows.start:rows.stop + 1]
+        owner = np.repeat(np.arange(n), np.diff(span))
+        hits = np.bincount(owner[np.isin(codes[span[0]:span[-1]], list(wanted))], minlength=n)
+        return hits == len(wanted) if match_all else hits > 0
+
+    def select(self, jurisdiction: str, ontology_id: Optional[str] = None, concepts: Optional[List[str]] = None,
+               concept_match: str = "any", start_date: Optional[datetime.date] = None,
+               end_date: Optional[datetime.date] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        A jurisdiction's normalised embeddings and day numbers in date order, with the same filters
+        as embeddings_query. Without concept / ontology filters both are views of the snapshot.
+        """
+        rows = self._rows(jurisdiction, start_date, end_date)
+        mask = None
+        if ontology_id:
+            parts = [p.strip() for p in ontology_id.split("|") if p.strip()]
+            mask = self._matches("ontology_ids", rows, parts, match_all=True)
+        if concepts:
+            found = self._matches("concepts", rows, concepts, match_all=concept_match == "all")
+            mask = found if mask is None else mask & found
+        if mask is None:
+            return self.embeddings[rows], self.days[rows]
+        return self.embeddings[rows][mask], self.days[rows][mask]
+
+    def latest_day(self, jurisdictions: Sequence[str], ontology_id: Optional[str] = None, concepts: Optional[List[str]] = None,
+                   concept_match: str = "any", end_date: Optional[datetime.date] = None) -> Optional[int]:
+        """Most recent day number of any of the jurisdictions' matching documents, None if there are none."""
+        latest = [days[-1] for days in (self.select(j, ontology_id, concepts, concept_match, None, end_date)[1]
+                                        for j in jurisdictions) if len(days)]
+        return int(max(latest)) if latest else None
+
+
+_store: Optional[EmbeddingStore] = None
+_store_key = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[EmbeddingStore]:
+    """
+    The current snapshot under EMBEDDING_STORE_DIR, opened on first use and reopened after an
+    export switches CURRENT. None when EMBEDDING_STORE_DIR is unset.
+
+    Raises:
+        FileNotFoundError: EMBEDDING_STORE_DIR is set but nothing has been exported there
+    """
+    global _store, _store_key
+    if not EMBEDDING_STORE_DIR:
+        return None
+    current = Path(EMBEDDING_STORE_DIR) / CURRENT_FILE
+    stat = current.stat()
+    key = (str(current), stat.st_ino, stat.st_mtime_ns)
+    with _store_lock:
+        if _store is None or _store_key != key:
+            _store = EmbeddingStore(current.parent / current.read_text(encoding="utf-8").strip())
+            _store_key = key
+            logging.info(f"Opened embedding store {_store.path} ({len(_store)} documents, generation {_store.generation})")
+        return _store
+
+
+if __name__ == "__main__":
+    from .db_utils import db_conn
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Manage the memory-mapped embedding store.")
+    parser.add_argument("--export", action="store_true", help="snapshot the embeddings from the database into the store")
+    parser.add_argument("--dir", type=Path, default=Path(EMBEDDING_STORE_DIR) if EMBEDDING_STORE_DIR else None,
+                        help="store directory, EMBEDDING_STORE_DIR by default")
+    args = parser.parse_args()
+    if args.dir is None:
+        parser.error("no store directory, pass --dir or set EMBEDDING_STORE_DIR")
+
+    if args.export:
+        conn = db_conn()
+        try:
+            export_embedding_store(conn, args.dir)
+        finally:
+            conn.close()
@@ -0,0 +1,229 @@
+"""
+Sentence embedding backends.
+
+Every backend produces the same embeddings as the reference sentence-transformers model, up to
+numerical noise, behind one small interface (token_lengths + encode):
+
+    torch      the sentence-transformers model as-is (reference)
+    int8       the same model with its Linear layers dynamically quantized to int8
+    onnx       the transformer + mean pooling + normalisation exported to ONNX, run with ONNX Runtime
+    onnx-int8  the ONNX export with int8 dynamically quantized weights
+
+The backend is chosen with EMBEDDING_BACKEND. Anything other than 'torch' gets its own model id
+(e.g. 'all-MiniLM-L6-v2+onnx'), which is what ingest stores in embedding_model and keys the
+embedding cache and content hashes on, so vectors from different backends are never mixed
+silently. The ONNX export is written on first use (or with
+python -m app.utils.encoders --export-onnx) and after that only needs onnxruntime and the
+tokenizer, not torch. onnx and onnxruntime are installed with requirements-onnx.txt.
+"""
+
+from __future__ import annotations
+import abc
+import argparse
+import json
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", str(Path.home() / ".cache" / "regbrain" / "onnx"))
+ONNX_OPSET = 17
+
+
+def encoder_model_id(model_name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> str:
+    """Id stored with embeddings; the reference backend keeps the bare model name."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {tuple(BACKENDS)}")
+    return model_name if backend == "torch" else f"{model_name}+{backend}"
+
+
+class Encoder(abc.ABC):
+    """Turns texts into embeddings. Subclasses load their model in __init__."""
+
+    backend = ""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.model_id = encoder_model_id(model_name, self.backend)
+        self.max_seq_length = 0
+
+    def token_lengths(self, texts: List[str]) -> List[int]:
+        """Number of tokens the model will actually see for each text (i.e. after truncation)."""
+        encoded = self.tokenizer(texts, add_special_tokens=True, truncation=True, max_length=self.max_seq_length)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    @abc.abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings."""
+
+
+class TorchEncoder(Encoder):
+    backend = "torch"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class QuantizedTorchEncoder(TorchEncoder):
+    backend = "int8"
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name)
+        import torch
+        # weights of every Linear layer stored as int8, activations quantized on the fly
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxEncoder(Encoder):
+    backend = "onnx"
+    model_file = "model.onnx"
+
+    def __init__(self, model_name: str, onnx_dir: str = EMBEDDING_ONNX_DIR):
+        super().__init__(model_name)
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        export_dir = onnx_export_dir(model_name, onnx_dir)
+        if not (export_dir / "model.onnx").exists():
+            export_onnx(model_name, export_dir)
+        if not (export_dir / self.model_file).exists():
+            quantize_onnx(export_dir)
+
+        with open(export_dir / "encoder.json", "r", encoding="utf-8") as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(export_dir))
+        self.session = onnxruntime.InferenceSession(str(export_dir / self.model_file), providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            inputs = self.tokenizer(
+                texts[start:start + batch_size], padding=True, truncation=True,
+                max_length=self.max_seq_length, return_tensors="np",
+            )
+            # tokenizers without segment ids get zeros, as in the export
+            feed = {name: np.asarray(inputs.get(name, np.zeros_like(inputs["input_ids"])), dtype=np.int64) for name in self.input_names}
+            batches.append(self.session.run(None, feed)[0])
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(batches).astype(np.float32, copy=False)
+
+
+class QuantizedOnnxEncoder(OnnxEncoder):
+    backend = "onnx-int8"
+    model_file = "model.int8.onnx"
+
+
+BACKENDS = {
+    "torch": TorchEncoder,
+    "int8": QuantizedTorchEncoder,
+    "onnx": OnnxEncoder,
+    "onnx-int8": QuantizedOnnxEncoder,
+}
+
+
+def onnx_export_dir(model_name: str, onnx_dir: str = EMBEDDING_ONNX_DIR) -> Path:
+    return Path(onnx_dir) / model_name.strip("/").replace("/", "__")
+
+
+def _is_mean_pooling(config: dict) -> bool:
+    if "pooling_mode" in config:  # sentence-transformers >= 6
+        return config["pooling_mode"] == "mean"
+    modes = {k for k, v in config.items() if k.startswith("pooling_mode_") and v is True}
+    return modes == {"pooling_mode_mean_tokens"}
+
+
+def export_onnx(model_name: str, export_dir: Path) -> None:
+    """
+    Export the sentence-transformers model to export_dir/model.onnx together with its tokenizer.
+
+    The graph covers the transformer, mean pooling over the attention mask and (if the model has
+    it) L2 normalisation, so its output is the sentence embedding itself.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    logging.info(f"Exporting {model_name} to ONNX in {export_dir}")
+    model = SentenceTransformer(model_name, device="cpu").eval()
+    pooling = [m for m in model if isinstance(m, Pooling)]
+    if len(pooling) != 1 or not _is_mean_pooling(pooling[0].get_config_dict()):
+        raise ValueError(f"ONNX export supports mean-pooling models only, {model_name} uses {[type(m).__name__ for m in model]}")
+    normalize = any(isinstance(m, Normalize) for m in model)
+
+    class SentenceEmbedding(torch.nn.Module):
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            tokens = self.transformer(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids).last_hidden_state
+            mask = attention_mask.unsqueeze(-1).to(tokens.dtype)
+            pooled = (tokens * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            return torch.nn.functional.normalize(pooled, p=2, dim=1) if normalize else pooled
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    sample = model.tokenizer(["an example sentence", "another one"], padding=True, return_tensors="pt")
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    args = tuple(sample.get(name, torch.zeros_like(sample["input_ids"])) for name in names)
+    tmp = export_dir / "model.onnx.tmp"
+    torch.onnx.export(
+        SentenceEmbedding(model[0].auto_model).eval(),
+        args,
+        str(tmp),
+        input_names=names,
+        output_names=["sentence_embedding"],
+        dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in names}, "sentence_embedding": {0: "batch"}},
+        opset_version=ONNX_OPSET,
+        dynamo=False,
+    )
+    model.tokenizer.save_pretrained(str(export_dir))
+    with open(export_dir / "encoder.json", "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "max_seq_length": model.max_seq_length, "normalize": normalize}, f)
+    os.replace(tmp, export_dir / "model.onnx")  # last, so a half-written export is never picked up
+
+
+def quantize_onnx(export_dir: Path) -> None:
+    """Write export_dir/model.int8.onnx, the ONNX export with int8 dynamically quantized weights."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp = export_dir / "model.int8.onnx.tmp"
+    quantize_dynamic(str(export_dir / "model.onnx"), str(tmp), weight_type=QuantType.QInt8)
+    os.replace(tmp, export_dir / "model.int8.onnx")
+
+
+EMBEDDING_MODEL_ID = encoder_model_id()
+
+
+@lru_cache(maxsize=None)
+def get_encoder(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL_NAME) -> Encoder:
+    """The encoder for a backend, loaded on first use and shared afterwards."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {tuple(BACKENDS)}")
+    logging.info(f"Loading embedding model {model_name} ({backend} backend)")
+    return BACKENDS[backend](model_name)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    parser = argparse.ArgumentParser(description="Prepare embedding backends.")
+    parser.add_argument("--export-onnx", action="store_true", help="export the model to ONNX (and its int8 version) ahead of time")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    args = parser.parse_args()
+
+    if args.export_onnx:
+        export_dir = onnx_export_dir(args.model)
+        export_onnx(args.model, export_dir)
+        quantize_onnx(export_dir)
@@ -0,0 +1,86 @@
+"""
+HTML to plain text for ingest.
+
+html_to_text returns exactly what ingest has always stored, i.e.
+" ".join(BeautifulSoup(html, "lxml").get_text(" ", strip=True).split()), but in one streaming pass:
+lxml's HTML parser (the same one BeautifulSoup drives) calls back into a small target object that
+keeps the text, instead of building a BeautifulSoup tree and walking it afterwards.
+
+BeautifulSoup's get_text() puts a separator between any two strings of the tree, and a string
+ends at every tag, comment, doctype or processing instruction. Text inside script, style,
+template, rt and rp is kept out of get_text(), as are comments. After the whitespace is collapsed
+that means: concatenate the text outside those tags, with a space at every markup boundary.
+
+html_to_text_reference is the BeautifulSoup version, kept for benchmarks/html_cleaner_diff.py.
+"""
+
+from __future__ import annotations
+import logging
+from lxml import etree
+
+from .metrics import REGISTRY
+
+# BeautifulSoup's string containers for HTML; the text inside them isn't part of get_text()
+SKIPPED_TAGS = frozenset({"script", "style", "template", "rt", "rp"})
+
+
+class _TextTarget:
+    """lxml parser target that collects the document text."""
+
+    def __init__(self):
+        self.parts = []
+        self.skip_depth = 0  # number of open SKIPPED_TAGS
+
+    def start(self, tag, attrib):
+        self.parts.append(" ")
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag):
+        self.parts.append(" ")
+        if tag in SKIPPED_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, data):
+        # lxml may deliver one string in several calls; they are joined without a separator
+        if not self.skip_depth:
+            self.parts.append(data)
+
+    def comment(self, text):
+        self.parts.append(" ")
+
+    def pi(self, target, data=None):
+        self.parts.append(" ")
+
+    def doctype(self, name, pubid, system):
+        self.parts.append(" ")
+
+    def close(self) -> str:
+        return " ".join("".join(self.parts).split())
+
+
+def html_to_text(html: str | None) -> str:
+    """
+    Text of an HTML document with all whitespace collapsed to single spaces.
+
+    Falls back to the BeautifulSoup reference if lxml rejects the markup, as BeautifulSoup then
+    retries with other strategies.
+    """
+    if not html:
+        return ""
+    if html[0] == "\N{BYTE ORDER MARK}":  # BeautifulSoup drops it too (lxml bug 1948551)
+        html = html[1:]
+    parser = etree.HTMLParser(target=_TextTarget(), recover=True)
+    try:
+        parser.feed(html)
+        return parser.close()
+    except (etree.ParserError, etree.XMLSyntaxError, UnicodeError, LookupError) as e:
+        logging.debug(f"lxml rejected markup ({e}), using BeautifulSoup")
+        REGISTRY.inc("html_fallbacks_total")
+        return html_to_text_reference(html)
+
+
+def html_to_text_reference(html: str | None) -> str:
+    """The original BeautifulSoup-based cleaner html_to_text reproduces."""
+    from bs4 import BeautifulSoup  # deferred: only the reference needs it
+    return " ".join(BeautifulSoup(html or "", "lxml").get_text(" ", strip=True).split())
@@ -0,0 +1,323 @@
+"""
+Lightweight in-process metrics: per-stage timers and counters for the ingest and similarity hot
+paths, rendered in the Prometheus text format, plus an opt-in sampling profiler for slow requests.
+
+Metrics are per process, like the pool and cache stats. Recording one is a dict lookup and a few
+additions under a lock, cheap enough to call per document.
+
+Usage:
+    with timed("similarity.pairwise") as t:
+        ...
+        t.items = pairs  # optional, counted in regbrain_stage_items_total
+    REGISTRY.inc("ingest_bytes_sent_total", len(payload), writer="copy")
+    REGISTRY.render()  # Prometheus text exposition
+"""
+
+from __future__ import annotations
+import bisect
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+METRICS_PREFIX = "regbrain_"
+# upper bounds in seconds, from sub-millisecond per-document steps to whole-batch writes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # profile requests, keeping those slower than this; 0 disables
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))  # stack sampling interval
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(Path(tempfile.gettempdir()) / "regbrain-profiles")))
+
+# HELP text per metric name; metrics without an entry are exported without one
+METRIC_HELP = {
+    "stage_seconds": "Time spent per processing stage",
+    "stage_items_total": "Items (documents, rows, pairs) processed per stage",
+    "http_request_seconds": "API request latency including serialization, by route and status",
+    "ingest_bytes_sent_total": "Bytes of SQL or COPY data sent by the ingest writers",
+    "html_fallbacks_total": "Documents the streaming HTML cleaner handed to the BeautifulSoup fallback",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count", "max")
+
+    def __init__(self, n_buckets: int):
+        self.buckets = [0] * n_buckets
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms keyed by name and labels.
+
+    A forked child (ingest's parse workers) starts from an empty registry instead of the copy of
+    its parent's, so take() in a worker returns only what that worker recorded.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = buckets
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], _Histogram] = {}
+
+    def _check_pid(self) -> None:
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_pid()
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self._check_pid()
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.bounds))
+            if index < len(self.bounds):
+                histogram.buckets[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            histogram.max = max(histogram.max, seconds)
+
+    def take(self) -> dict:
+        """Everything recorded so far, as a picklable dict, and start again from zero."""
+        with self._lock:
+            self._check_pid()
+            state = {
+                "counters": dict(self._counters),
+                "histograms": {k: (list(h.buckets), h.sum, h.count, h.max) for k, h in self._histograms.items()},
+            }
+            self._reset()
+        return state
+
+    def merge(self, state: dict) -> None:
+        """Add the output of take() from another process."""
+        with self._lock:
+            self._check_pid()
+            for key, value in state["counters"].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, total, count, largest) in state["histograms"].items():
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = _Histogram(len(self.bounds))
+                histogram.buckets = [a + b for a, b in zip(histogram.buckets, buckets)]
+                histogram.sum += total
+                histogram.count += count
+                histogram.max = max(histogram.max, largest)
+
+    def stage_summary(self) -> Dict[str, dict]:
+        """Per stage: calls, total seconds, mean and max milliseconds and items, for logs and summary files."""
+        with self._lock:
+            self._check_pid()
+            stages = {
+                dict(labels)["stage"]: {
+                    "calls": h.count,
+                    "seconds": h.sum,
+                    "mean_ms": h.sum / h.count * 1000 if h.count else 0.0,
+                    "max_ms": h.max * 1000,
+                }
+                for (name, labels), h in self._histograms.items() if name == "stage_seconds"
+            }
+            for (name, labels), value in self._counters.items():
+                if name == "stage_items_total":
+                    stages.setdefault(dict(labels)["stage"], {})["items"] = value
+        return dict(sorted(stages.items()))
+
+    def counters(self, name: str) -> Dict[Labels, float]:
+        with self._lock:
+            self._check_pid()
+            return {labels: value for (n, labels), value in self._counters.items() if n == name}
+
+    def render(self, gauges: Optional[Dict[str, Dict[Labels, float]]] = None) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4).
+
+        Args:
+            gauges: extra point-in-time values, name -> {labels: value}, e.g. pool and cache stats
+        """
+        with self._lock:
+            self._check_pid()
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(h.buckets), h.sum, h.count)) for k, h in self._histograms.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name: str, kind: str) -> None:
+            if name in declared:
+                return
+            declared.add(name)
+            help_text = METRIC_HELP.get(name)
+            if help_text:
+                lines.append(f"# HELP {METRICS_PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{METRICS_PREFIX}{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), (buckets, total, count) in histograms:
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(self.bounds, buckets):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{METRICS_PREFIX}{name}_bucket{_labels(labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{METRICS_PREFIX}{name}_bucket{_labels(labels, le)} {count}")
+            lines.append(f"{METRICS_PREFIX}{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{METRICS_PREFIX}{name}_count{_labels(labels)} {count}")
+        for name, values in sorted((gauges or {}).items()):
+            declare(name, "gauge")
+            for labels, value in sorted(values.items()):
+                lines.append(f"{METRICS_PREFIX}{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class timed:
+    """
+    Context manager adding the time spent in its block to regbrain_stage_seconds{stage=...}.
+    Set .items inside the block to also count what was processed.
+    """
+
+    __slots__ = ("stage", "items", "_start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.items = 0
+
+    def __enter__(self) -> "timed":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        REGISTRY.observe("stage_seconds", time.perf_counter() - self._start, stage=self.stage)
+        if self.items:
+            REGISTRY.inc("stage_items_total", self.items, stage=self.stage)
+
+
+def add_gauges(gauges: Dict[str, Dict[Labels, float]], prefix: str, stats: dict, **labels) -> Dict[str, Dict[Labels, float]]:
+    """Add the numeric values of a stats dict such as pool_stats() to gauges, named prefix + key."""
+    key = tuple(sorted(labels.items()))
+    for name, value in stats.items():
+        if isinstance(value, (int, float)):  # bools too, as 0/1
+            gauges.setdefault(prefix + name, {})[key] = float(value)
+    return gauges
+
+
+class SamplingProfiler:
+    """
+    Opt-in stack-sampling profiler for single requests.
+
+    Threads inside profile() are sampled every interval from one background thread. When the block
+    took longer than slow_seconds, the samples are written as folded stacks (one 'a;b;c count' line
+    per distinct stack, the input of flamegraph.pl and speedscope) to out_dir and the path logged.
+    Disabled (profile() does nothing) when slow_seconds is 0.
+    """
+
+    def __init__(self, slow_seconds: float, interval: float, out_dir: Path):
+        self.slow_seconds = slow_seconds
+        self.interval = interval
+        self.out_dir = Path(out_dir)
+        self._samples: Dict[int, Counter] = {}  # thread ident -> stack counts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.dumped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.slow_seconds > 0
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    self._wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for ident, stacks in self._samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[_folded_stack(frame)] += 1
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._samples[ident] = Counter()
+            self._wake.set()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stacks = self._samples.pop(ident)
+            if elapsed >= self.slow_seconds and stacks:
+                self._dump(name, elapsed, stacks)
+
+    def _dump(self, name: str, elapsed: float, stacks: Counter) -> None:
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        path = self.out_dir / f"{name}-{stamp}-{elapsed * 1000:.0f}ms.folded"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()), encoding="utf-8")
+        self.dumped += 1
+        logging.warning(f"Slow {name} ({elapsed * 1000:.0f}ms, {sum(stacks.values())} samples), profile written to {path}")
+
+
+def _folded_stack(frame) -> str:
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{Path(code.co_filename).stem}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+PROFILER = SamplingProfiler(PROFILE_SLOW_MS / 1000, PROFILE_INTERVAL_MS / 1000, PROFILE_DIR)
@@ -0,0 +1,96 @@
+"""
+Rows to COPY ... FROM STDIN payloads.
+
+encode_binary produces PostgreSQL's binary COPY format, so the server reads uuids, dates, arrays
+and vectors without parsing text; encode_text produces the default text format, for servers or
+column types that can't take binary input. Both take the rows as tuples plus the type of each
+column, one of COLUMN_TYPES. None is written as NULL.
+"""
+
+from __future__ import annotations
+import datetime
+import struct
+import uuid
+from typing import Iterable, Sequence
+import numpy as np
+
+from .vectors import EMBEDDING_DTYPE, vector_literal
+
+COLUMN_TYPES = ("uuid", "text", "date", "text[]", "vector", "bytea")
+
+_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+_HEADER = _SIGNATURE + struct.pack(">ii", 0, 0)  # no flags, no header extension
+_TRAILER = struct.pack(">h", -1)
+_NULL = struct.pack(">i", -1)
+_TEXT_OID = 25
+_POSTGRES_EPOCH = datetime.date(2000, 1, 1)
+
+
+def _binary_text_array(values: Sequence[str]) -> bytes:
+    if not values:
+        return struct.pack(">iii", 0, 0, _TEXT_OID)
+    parts = [struct.pack(">iiiii", 1, 0, _TEXT_OID, len(values), 1)]
+    for value in values:
+        data = value.encode("utf-8")
+        parts.append(struct.pack(">i", len(data)) + data)
+    return b"".join(parts)
+
+
+def _binary_vector(values) -> bytes:
+    data = np.asarray(values, dtype=EMBEDDING_DTYPE)
+    return struct.pack(">hh", len(data), 0) + data.tobytes()  # vector_recv: dim, unused, float4s
+
+
+_BINARY = {
+    "uuid": lambda v: uuid.UUID(str(v)).bytes,
+    "text": lambda v: str(v).encode("utf-8"),
+    "date": lambda v: struct.pack(">i", (v - _POSTGRES_EPOCH).days),
+    "text[]": _binary_text_array,
+    "vector": _binary_vector,
+    "bytea": bytes,
+}
+
+
+def encode_binary(rows: Iterable[tuple], types: Sequence[str]) -> bytes:
+    """Binary COPY payload (header, one tuple per row, trailer)."""
+    encoders = [_BINARY[t] for t in types]
+    field_count = struct.pack(">h", len(types))
+    parts = [_HEADER]
+    for row in rows:
+        parts.append(field_count)
+        for encode, value in zip(encoders, row):
+            if value is None:
+                parts.append(_NULL)
+            else:
+                data = encode(value)
+                parts.append(struct.pack(">i", len(data)))
+                parts.append(data)
+    parts.append(_TRAILER)
+    return b"".join(parts)
+
+
+def _text_array(values: Sequence[str]) -> str:
+    quoted = ('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+    return "{" + ",".join(quoted) + "}"
+
+
+_TEXT = {
+    "uuid": str,
+    "text": str,
+    "date": lambda v: v.isoformat(),
+    "text[]": _text_array,
+    "vector": vector_literal,
+    "bytea": lambda v: "\\x" + bytes(v).hex(),
+}
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def encode_text(rows: Iterable[tuple], types: Sequence[str]) -> bytes:
+    """Text-format COPY payload: tab separated, \\N for NULL, backslash escapes, utf-8."""
+    encoders = [_TEXT[t] for t in types]
+    lines = []
+    for row in rows:
+        fields = ("\\N" if value is None else encode(value).translate(_TEXT_ESCAPES) for encode, value in zip(encoders, row))
+        lines.append("\t".join(fields))
+    return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
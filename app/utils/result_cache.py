@@ -0,0 +1,154 @@
+"""
+Two-tier cache for JSON-compatible analysis results.
+
+Entries are versioned by the dataset generation that ingest bumps on every commit, so a new
+ingest makes all older entries unreachable without any explicit invalidation. The first tier is
+an in-process LRU with size and TTL limits; the optional second tier is a directory of JSON
+files that every uvicorn worker on the host can share.
+"""
+
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Hashable, Optional
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))  # seconds
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR")  # unset disables the on-disk tier
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_DISK_MAX_ENTRIES", "4096"))
+
+
+class ResultCache:
+    """LRU + TTL in-process cache with an optional shared on-disk tier."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, ttl: float = RESULT_CACHE_TTL,
+                 disk_dir: Optional[str] = RESULT_CACHE_DIR, disk_max_entries: int = RESULT_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # versioned key -> (stored at, value)
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "disk_writes": 0,
+            "disk_evictions": 0,
+        }
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        versioned = (generation, key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(versioned)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(versioned)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[versioned]
+                self._stats["expirations"] += 1
+
+        value = self._disk_get(versioned, now)
+        with self._lock:
+            if value is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._store(versioned, value, now)
+        return value
+
+    def put(self, key: Hashable, generation: int, value: Any) -> None:
+        versioned = (generation, key)
+        now = time.time()
+        with self._lock:
+            self._store(versioned, value, now)
+        self._disk_put(versioned, value)
+
+    def _store(self, versioned: Hashable, value: Any, now: float) -> None:
+        self._entries[versioned] = (now, value)
+        self._entries.move_to_end(versioned)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, versioned: Hashable) -> Path:
+        digest = hashlib.sha256(repr(versioned).encode("utf-8")).hexdigest()
+        return self.disk_dir / f"{digest}.json"
+
+    def _disk_get(self, versioned: Hashable, now: float) -> Optional[Any]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(versioned)
+        try:
+            if now - path.stat().st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _disk_put(self, versioned: Hashable, value: Any) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(versioned)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp, path)  # atomic, so other workers never read half a file
+        except (OSError, TypeError, ValueError) as e:
+            logging.warning(f"Could not write result cache entry to disk: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+        with self._lock:
+            self._stats["disk_writes"] += 1
+            sweep = self._stats["disk_writes"] % 64 == 0
+        if sweep:
+            self._sweep_disk()
+
+    def _sweep_disk(self) -> None:
+        #drop expired files, then the oldest ones beyond the size limit
+        now = time.time()
+        files = []
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                mtime = path.stat().st_mtime
+            except OSError:
+                continue
+            if now - mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((mtime, path))
+        files.sort()
+        excess = files[:max(0, len(files) - self.disk_max_entries)]
+        for _, path in excess:
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._stats["disk_evictions"] += len(excess)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                entries=len(self._entries),
+                max_entries=self.max_entries,
+                ttl_seconds=self.ttl,
+                disk_enabled=self.disk_dir is not None,
+            )
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
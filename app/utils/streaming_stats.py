@@ -0,0 +1,141 @@
+"""
+Bounded-memory statistics over all-pairs cosine similarity matrices.
+
+The similarity between two sets of normalised embeddings is computed tile by tile, so a bucket
+with n_a x n_b pairs never needs more than a fixed amount of memory. Mean, std, min and max are
+exact running aggregates (merged with Chan's parallel variance formula). Quantiles come from a
+fixed-bin histogram over [-1, 1]: cosine similarity is bounded, so a histogram is a mergeable
+sketch with a known worst-case error of one bin width. Small buckets skip the sketch and get
+exact quantiles.
+"""
+
+from __future__ import annotations
+import os
+from typing import Dict, Sequence
+import numpy as np
+
+SKETCH_BINS = int(os.getenv("SIMILARITY_SKETCH_BINS", "8192"))  # quantile error <= 2 / bins
+TILE_BYTES = int(os.getenv("SIMILARITY_TILE_BYTES", str(32 * 1024 * 1024)))  # memory ceiling per similarity tile
+EXACT_MAX_PAIRS = int(os.getenv("SIMILARITY_EXACT_MAX_PAIRS", str(1_000_000)))  # buckets up to this size get exact quantiles
+QUANTILES = {"p25": 0.25, "median": 0.5, "p75": 0.75}
+
+
+class SimilarityStats:
+    """Running count/mean/std/min/max plus a histogram quantile sketch of values in [-1, 1]."""
+
+    def __init__(self, bins: int = SKETCH_BINS):
+        self.bins = bins
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.histogram = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> None:
+        """Add a block of similarity values (any shape)."""
+        n = values.size
+        if n == 0:
+            return
+        block_mean = float(values.mean(dtype=np.float64))
+        block_m2 = float(values.var(dtype=np.float64)) * n
+        self._merge_moments(n, block_mean, block_m2)
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positions = ((values.ravel() + 1.0) * (self.bins / 2.0)).astype(np.int64)
+        np.clip(positions, 0, self.bins - 1, out=positions)
+        self.histogram += np.bincount(positions, minlength=self.bins)
+
+    def merge(self, other: "SimilarityStats") -> None:
+        """Fold in the stats of another (e.g. a different tile or bucket). Both must use the same bins."""
+        if other.count == 0:
+            return
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.histogram += other.histogram
+
+    def _merge_moments(self, n: int, mean: float, m2: float) -> None:
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile, linearly interpolated inside the histogram bin it falls in."""
+        if self.count == 0:
+            return float("nan")
+        target = q * self.count
+        cumulative = np.cumsum(self.histogram)
+        b = int(np.searchsorted(cumulative, target, side="left"))
+        b = min(b, self.bins - 1)
+        before = cumulative[b - 1] if b else 0
+        in_bin = self.histogram[b]
+        fraction = (target - before) / in_bin if in_bin else 0.5
+        value = -1.0 + (b + fraction) * (2.0 / self.bins)
+        return float(min(max(value, self.min), self.max))
+
+    def summary(self) -> Dict[str, float]:
+        stats = {name: self.quantile(q) for name, q in QUANTILES.items()}
+        stats.update(
+            mean=self.mean,
+            max=self.max,
+            min=self.min,
+            std=float(np.sqrt(self.m2 / self.count)) if self.count else float("nan"),
+            count=self.count,
+        )
+        return stats
+
+
+def _exact_summary(matrix: np.ndarray) -> Dict[str, float]:
+    quantiles = np.quantile(matrix, list(QUANTILES.values()))
+    stats = {name: float(value) for name, value in zip(QUANTILES, quantiles)}
+    stats.update(
+        mean=float(matrix.mean(dtype=np.float64)),
+        max=float(matrix.max()),
+        min=float(matrix.min()),
+        std=float(matrix.std(dtype=np.float64)),
+        count=int(matrix.size),
+    )
+    return stats
+
+
+def tile_shape(n_a: int, n_b: int, tile_bytes: int = TILE_BYTES, itemsize: int = 4) -> Sequence[int]:
+    """Rows of A and columns of B per tile so that one float32 tile fits in tile_bytes."""
+    max_items = max(1, tile_bytes // itemsize)
+    cols = max(1, min(n_b, max_items))
+    rows = max(1, min(n_a, max_items // cols))
+    return rows, cols
+
+
+def pairwise_similarity_stats(a: np.ndarray, b: np.ndarray, tile_bytes: int = TILE_BYTES,
+                              exact_max_pairs: int = EXACT_MAX_PAIRS) -> Dict[str, float]:
+    """
+    Summary statistics of the cosine similarity between every row of a and every row of b.
+
+    Args:
+        a: (n_a, dim) L2-normalised embeddings
+        b: (n_b, dim) L2-normalised embeddings
+        tile_bytes: memory ceiling for one block of the similarity matrix
+        exact_max_pairs: compute exact quantiles in one block when n_a * n_b is at most this
+
+    Returns:
+        dict with p25/median/p75, mean, max, min, std and count
+    """
+    n_a, n_b = len(a), len(b)
+    if n_a * n_b <= exact_max_pairs:
+        return _exact_summary(a @ b.T)
+
+    stats = SimilarityStats()
+    rows, cols = tile_shape(n_a, n_b, tile_bytes)
+    out = np.empty((rows, cols), dtype=np.result_type(a, b))
+    for i in range(0, n_a, rows):
+        a_tile = a[i:i + rows]
+        for j in range(0, n_b, cols):
+            b_tile = b[j:j + cols]
+            tile = out[:len(a_tile), :len(b_tile)]
+            np.matmul(a_tile, b_tile.T, out=tile)
+            stats.update(tile)
+    return stats.summary()
@@ -0,0 +1,39 @@
+"""
+Binary encoding of embeddings.
+
+Embeddings are stored in reginsights_clean.embedding_bin as raw float32 in network byte order,
+i.e. the same layout pgvector's vector_send() produces after its 4-byte header. That lets
+readers turn a whole result set into one contiguous matrix with np.frombuffer instead of
+parsing a text literal per row.
+"""
+
+from __future__ import annotations
+from typing import Iterable, Sequence
+import numpy as np
+
+EMBEDDING_DIM: int = 384
+EMBEDDING_DTYPE = np.dtype(">f4")
+
+
+def encode_embedding(embedding: Sequence[float]) -> bytes:
+    """Pack one embedding as float32 big-endian bytes."""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+
+def decode_embeddings(blobs: Iterable[bytes], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Decode many packed embeddings into a single (n, dim) float32 matrix.
+
+    The blobs are concatenated once and viewed with np.frombuffer, so no per-row arrays are
+    created; the only other pass is the byte-order conversion to native float32.
+    """
+    buffer = b"".join(blobs)
+    if len(buffer) % (dim * EMBEDDING_DTYPE.itemsize):
+        raise ValueError(f"embedding buffer of {len(buffer)} bytes is not a whole number of {dim}-d float32 vectors")
+    matrix = np.frombuffer(buffer, dtype=EMBEDDING_DTYPE).reshape(-1, dim)
+    return matrix.astype(np.float32, copy=False)
+
+
+def vector_literal(embedding: Sequence[float]) -> str:
+    """pgvector text form, e.g. '[0.1,0.2]'. float32 -> float keeps every digit, so it parses back to the same float4s."""
+    return "[" + ",".join(map(repr, np.asarray(embedding, dtype=np.float32).astype(float).tolist())) + "]"
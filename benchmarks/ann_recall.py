@@ -0,0 +1,137 @@
+"""
+Recall and latency of the approximate nearest-neighbour search against exact search.
+
+Picks a random sample of stored documents as queries and runs the top-k neighbour search for each
+through the approximate index and exactly, unfiltered and with the jurisdiction, date range and
+concept filters the /neighbours/ endpoint takes. Reports recall@k (the share of the exact top-k
+the index found) and the p50/p95 latency of both, for each hnsw.ef_search value given.
+
+Usage (from the repository root, against a migrated database with embedded documents):
+    python -m benchmarks.ann_recall [--queries 200] [--k 10] [--ef-search 40 100 200] [--json results.json]
+
+Exits with status 1 if the mean recall of any filter falls below --min-recall at the default ef_search.
+"""
+
+import argparse
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+
+from app import neighbours
+from app.neighbours import recall_at_k, search_neighbours
+from app.utils.db_utils import pooled_conn
+from app.utils.vectors import decode_embeddings
+
+
+def sample_queries(cur, n: int, seed: int) -> list:
+    """(doc_id, jurisdiction, published_date, concepts, embedding) for a random sample of documents."""
+    cur.execute("SELECT setseed(%s)", (random.Random(seed).random() * 2 - 1,))
+    cur.execute(
+        """
+        SELECT doc_id::text, jurisdiction, published_date, concepts, embedding_bin
+        FROM reginsights_clean WHERE embedding IS NOT NULL ORDER BY random() LIMIT %s
+        """,
+        (n,),
+    )
+    rows = cur.fetchall()
+    vectors = decode_embeddings([r[4] for r in rows])
+    return [(*r[:4], v) for r, v in zip(rows, vectors)]
+
+
+def filter_variants(query) -> dict:
+    """Filters to run a query document with, each scoped to where the document itself lives."""
+    doc_id, jurisdiction, published_date, concepts, _ = query
+    variants = {
+        "none": {},
+        "jurisdiction": {"jurisdictions": [jurisdiction]},
+        "date range": {"start_date": published_date - datetime.timedelta(days=90), "end_date": published_date},
+    }
+    if concepts:
+        variants["concept"] = {"concepts": [concepts[0]]}
+    return {name: dict(filters, exclude_doc_id=doc_id) for name, filters in variants.items()}
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def timed_search(cur, vector, k, exact, filters):
+    start = time.perf_counter()
+    found = search_neighbours(cur, vector, k, exact=exact, **filters)
+    return found, (time.perf_counter() - start) * 1000
+
+
+def run(queries: list, k: int, ef_search: int) -> dict:
+    """Per filter variant: mean recall@k and latency percentiles of both searches."""
+    neighbours.NEIGHBOURS_EF_SEARCH = ef_search
+    measured = {}
+    with pooled_conn() as conn, conn.cursor() as cur:
+        for query in queries:
+            vector = query[4]
+            for name, filters in filter_variants(query).items():
+                approximate, approximate_ms = timed_search(cur, vector, k, False, filters)
+                exact, exact_ms = timed_search(cur, vector, k, True, filters)
+                m = measured.setdefault(name, {"recall": [], "approximate_ms": [], "exact_ms": [], "short": 0})
+                m["recall"].append(recall_at_k(approximate, exact))
+                m["approximate_ms"].append(approximate_ms)
+                m["exact_ms"].append(exact_ms)
+                m["short"] += len(approximate) < len(exact)  # the endpoint would fall back to exact for these
+        conn.rollback()  # drop the SET LOCAL planner settings
+
+    summary = {}
+    for name, m in measured.items():
+        summary[name] = {
+            "queries": len(m["recall"]),
+            "recall": statistics.mean(m["recall"]),
+            "min_recall": min(m["recall"]),
+            "short_results": m["short"],
+            **{f"{search}_{p}_ms": percentile(m[f"{search}_ms"], q)
+               for search in ("approximate", "exact") for p, q in (("p50", 0.5), ("p95", 0.95))},
+        }
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure recall@k and latency of the approximate neighbour search.")
+    parser.add_argument("--queries", type=int, default=200, help="documents to use as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[neighbours.NEIGHBOURS_EF_SEARCH],
+                        help="hnsw.ef_search values to sweep, the first is checked against --min-recall")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="lowest acceptable mean recall@k per filter")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    with pooled_conn() as conn, conn.cursor() as cur:
+        method = neighbours.ann_index_method(cur)
+        queries = sample_queries(cur, args.queries, args.seed)
+    if not queries:
+        print("no embedded documents to query")
+        return 1
+    print(f"{len(queries)} queries, k={args.k}, index: {method or 'none (exact only)'}")
+
+    results = {}
+    for ef_search in args.ef_search:
+        summary = results[ef_search] = run(queries, args.k, ef_search)
+        print(f"ef_search={ef_search}")
+        for name, s in summary.items():
+            print(f"  {name:<13} recall@{args.k} {s['recall']:.3f} (min {s['min_recall']:.2f}, {s['short_results']} short)"
+                  f"  approximate p50 {s['approximate_p50_ms']:7.2f}ms p95 {s['approximate_p95_ms']:7.2f}ms"
+                  f"  exact p50 {s['exact_p50_ms']:7.2f}ms p95 {s['exact_p95_ms']:7.2f}ms")
+
+    failing = [name for name, s in results[args.ef_search[0]].items() if s["recall"] < args.min_recall]
+    if failing:
+        print(f"recall below {args.min_recall} for: {', '.join(failing)}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"index": method, "k": args.k, "queries": len(queries),
+                       "ef_search": {str(ef): summary for ef, summary in results.items()}}, f, indent=2)
+    return 1 if failing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+EXPLAIN-based regression check for the similarity queries.
+
+Builds the same SQL the similarity code runs (unfiltered, date range, last-N-buckets probe,
+concept filter) plus the nearest-neighbour searches, and fails if any plan contains a sequential
+scan, of reginsights_clean, daily_aggregates or any table the queries join. Sequential scans are
+discouraged for the check (enable_seqscan = off) so the result doesn't depend on how much data the
+database happens to hold: a Seq Scan in the plan then means no index can serve the query at all.
+
+The repository has no test suite; run this by hand or from CI after schema or query changes.
+
+Usage (from the repository root, against a migrated database):
+    python -m benchmarks.check_query_plans [--jurisdictions EU USA] [--planner-defaults]
+
+Exits with status 1 if any query regressed to a sequential scan.
+"""
+
+import argparse
+import datetime
+import sys
+import numpy as np
+
+from app.neighbours import neighbours_query
+from app.similarity import embeddings_query, latest_published_date_query, topic_filter_sql
+from app.utils.db_utils import apply_migrations, pooled_conn
+from app.utils.vectors import EMBEDDING_DIM
+
+def plan_queries(jurisdictions, concepts):
+    """(name, query, params) for every query shape the similarity endpoint issues."""
+    today = datetime.date.today()
+    queries = [
+        ("embeddings", *embeddings_query(jurisdictions)),
+        ("embeddings, date range", *embeddings_query(jurisdictions, start_date=today - datetime.timedelta(days=90), end_date=today)),
+        ("latest date, documents", *latest_published_date_query(jurisdictions, "reginsights_clean", " AND t.embedding_bin IS NOT NULL")),
+        ("latest date, daily aggregates", *latest_published_date_query(jurisdictions, "daily_aggregates", " AND t.doc_count > 0")),
+    ]
+    if concepts:
+        queries.append(("embeddings, any concept", *embeddings_query(jurisdictions, concepts=concepts)))
+        queries.append(("embeddings, all concepts", *embeddings_query(jurisdictions, concepts=concepts, concept_match="all")))
+        topic_sql, params = topic_filter_sql(concepts=concepts, alias="t")
+        queries.append(("latest date, concepts",
+                        *latest_published_date_query(jurisdictions, "reginsights_clean", " AND t.embedding_bin IS NOT NULL" + topic_sql, params)))
+
+    vector = np.full(EMBEDDING_DIM, 1.0 / np.sqrt(EMBEDDING_DIM))
+    queries.append(("neighbours", *neighbours_query(vector, 10)))
+    queries.append(("neighbours, jurisdiction", *neighbours_query(vector, 10, jurisdictions=jurisdictions[:1])))
+    if concepts:
+        queries.append(("neighbours, concept", *neighbours_query(vector, 10, concepts=concepts)))
+    return queries
+
+
+def sequential_scans(plan_lines):
+    #"Seq Scan" and "Parallel Seq Scan" nodes, whichever table they read
+    return [line.strip() for line in plan_lines if "Seq Scan on " in line]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail if similarity queries fall back to sequential scans.")
+    parser.add_argument("--jurisdictions", nargs=2, default=None, help="jurisdictions to plan with (default: two from the database)")
+    parser.add_argument("--concepts", nargs="*", default=None, help="concepts to plan with (default: one from the database)")
+    parser.add_argument("--planner-defaults", action="store_true", help="don't discourage sequential scans, plan as production would")
+    args = parser.parse_args()
+
+    apply_migrations()
+    failures = 0
+    with pooled_conn() as conn, conn.cursor() as cur:
+        jurisdictions = args.jurisdictions
+        if jurisdictions is None:
+            cur.execute("SELECT DISTINCT jurisdiction FROM reginsights_clean ORDER BY jurisdiction LIMIT 2")
+            jurisdictions = [r[0] for r in cur.fetchall()] or ["EU", "USA"]
+        concepts = args.concepts
+        if concepts is None:
+            cur.execute("SELECT concepts[1] FROM reginsights_clean WHERE cardinality(concepts) > 0 LIMIT 1")
+            row = cur.fetchone()
+            concepts = [row[0]] if row else ["AI"]
+
+        if not args.planner_defaults:
+            cur.execute("SET LOCAL enable_seqscan = off")
+
+        for name, query, params in plan_queries(jurisdictions, concepts):
+            cur.execute("EXPLAIN " + query, params)
+            plan = [r[0] for r in cur.fetchall()]
+            scans = sequential_scans(plan)
+            print(f"{'FAIL' if scans else 'ok  '} {name}")
+            if scans:
+                failures += 1
+                print("\n".join("       " + line for line in plan))
+
+    print(f"{failures} of the similarity queries use a sequential scan" if failures else "all similarity queries use indexes")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Check that the API can serve from an embedding store without a database.
+
+Points the database settings at an address nothing listens on, sets EMBEDDING_STORE_DIR, and
+calls the endpoints a store-backed deployment answers on its own (/similarity/ for the first two
+jurisdictions of the store, /jurisdictions/, /concepts/, /pool/ and /metrics) in process. Any of
+them failing, or the connection pool having been created along the way, means a code path still
+reaches for the database.
+
+Usage (from the repository root, with a store exported by `python -m app.utils.embedding_store --export`):
+    python -m benchmarks.check_store_offline --dir /path/to/store [--granularity 10d]
+
+Exits with status 1 if any endpoint fails or the database pool was created.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from app import api
+from app.utils import db_utils, embedding_store
+
+UNREACHABLE_HOST = "127.0.0.1"
+UNREACHABLE_PORT = 1  # tcpmux, not served anywhere this would run
+
+
+def run_checks(granularity: str) -> list:
+    """(endpoint, error or None) for every endpoint called."""
+    store = embedding_store.get_store()
+    jurisdictions = store.jurisdictions()
+    if len(jurisdictions) < 2:
+        return [("store", f"need at least two jurisdictions, the store has {jurisdictions}")]
+    country_a, country_b = jurisdictions[:2]
+
+    calls = [
+        (f"/similarity/ {country_a} vs {country_b}",
+         lambda: api.get_similarity(country_a, country_b, statistic="median", granularity=granularity, concepts=[],
+                                    concept_match="any", start_date=None, end_date=None, last_n_buckets=None)),
+        ("/jurisdictions/", api.get_jurisdictions),
+        ("/concepts/", api.get_concepts),
+        ("/pool/", api.get_pool_stats),
+        ("/metrics", api.get_metrics),
+    ]
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        for name, call in calls:
+            try:
+                loop.run_until_complete(call())
+                results.append((name, None))
+            except Exception as e:
+                results.append((name, getattr(e, "detail", None) or repr(e)))
+    finally:
+        loop.close()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", required=True, help="embedding store directory to serve from")
+    parser.add_argument("--granularity", default="10d", help="time buckets for the /similarity/ call")
+    args = parser.parse_args()
+
+    embedding_store.EMBEDDING_STORE_DIR = args.dir
+    db_utils.DB_HOST = UNREACHABLE_HOST
+    db_utils.DB_PORT = UNREACHABLE_PORT
+    db_utils.DB_POOL_TIMEOUT = 1
+
+    failed = False
+    for name, error in run_checks(args.granularity):
+        print(f"{name:40s} {'ok' if error is None else 'FAILED: ' + str(error)}")
+        failed = failed or error is not None
+    if db_utils.pool_exists():
+        print("the database pool was created")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
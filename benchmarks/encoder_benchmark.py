@@ -0,0 +1,129 @@
+"""
+Throughput and agreement of the embedding backends (see app/utils/encoders.py).
+
+Every backend embeds the same sample of documents. The 'torch' backend is the reference.
+For each backend we report:
+    docs/sec and speed-up over the reference
+    cosine between each document's embedding and its reference embedding (mean and worst case)
+    how far the document-to-document similarity scores move (mean and worst absolute change).
+        This is the number that matters for the similarity analysis.
+
+The sample is drawn from reginsights_clean, or from the raw CSV with --csv. It is a random
+sample, so it is held out from anything the backends were built from.
+
+Usage (from the repository root):
+    python -m benchmarks.encoder_benchmark [--backends torch int8 onnx onnx-int8] [--sample 256]
+        [--csv data.csv] [--min-cosine 0.99] [--max-shift 0.02] [--json results.json]
+
+Exits with status 1 if a backend falls outside either tolerance.
+"""
+
+import argparse
+import csv
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))  # ingest uses bare imports
+
+from app.utils.encoders import BACKENDS, get_encoder  # noqa: E402
+
+
+def sample_from_db(n: int, seed: int) -> list:
+    from app.utils.db_utils import pooled_conn
+    with pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT setseed(%s)", (seed / 2**31,))
+        cur.execute("SELECT clean_text FROM reginsights_clean ORDER BY random() LIMIT %s", (n,))
+        return [r[0] for r in cur.fetchall()]
+
+
+def sample_from_csv(path: str, n: int, seed: int) -> list:
+    from ingest import MIN_CHARS, detect_encoding, strip_html
+    with open(path, "r", encoding=detect_encoding(Path(path)), errors="replace") as f:
+        texts = [strip_html(row.get("RegInsightTextNative")) for row in csv.DictReader(f)]
+    texts = [t for t in texts if len(t) >= MIN_CHARS]
+    return random.Random(seed).sample(texts, min(n, len(texts)))
+
+
+def normalized(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def time_encode(encoder, texts: list, batch_size: int, repeat: int) -> tuple:
+    """(embeddings, best seconds over repeat runs), after one warm-up batch."""
+    encoder.encode(texts[:batch_size], batch_size=batch_size)
+    best, vectors = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = encoder.encode(texts, batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+    return np.asarray(vectors, dtype=np.float32), best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare embedding backends for speed and agreement with the reference.")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--sample", type=int, default=256, help="documents to embed")
+    parser.add_argument("--csv", help="sample from this raw CSV instead of the database")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per backend, the fastest counts")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="worst allowed cosine to the reference embedding")
+    parser.add_argument("--max-shift", type=float, default=0.02, help="largest allowed change of a document-pair similarity")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    texts = sample_from_csv(args.csv, args.sample, args.seed) if args.csv else sample_from_db(args.sample, args.seed)
+    if len(texts) < 2:
+        print("need at least two documents to compare")
+        return 1
+    print(f"{len(texts)} documents, batch size {args.batch_size}")
+
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results, reference, failures = {}, None, 0
+    upper = np.triu_indices(len(texts), k=1)
+    for backend in backends:
+        start = time.perf_counter()
+        encoder = get_encoder(backend)
+        load_seconds = time.perf_counter() - start
+        vectors, seconds = time_encode(encoder, texts, args.batch_size, args.repeat)
+        vectors = normalized(vectors)
+
+        result = {"model_id": encoder.model_id, "load_seconds": load_seconds, "docs_per_second": len(texts) / seconds}
+        if reference is None:
+            reference = {"vectors": vectors, "similarities": (vectors @ vectors.T)[upper], "docs_per_second": result["docs_per_second"]}
+        else:
+            cosine = (vectors * reference["vectors"]).sum(axis=1)
+            shift = np.abs((vectors @ vectors.T)[upper] - reference["similarities"])
+            result.update(
+                speedup=result["docs_per_second"] / reference["docs_per_second"],
+                cosine_mean=float(cosine.mean()),
+                cosine_min=float(cosine.min()),
+                similarity_shift_mean=float(shift.mean()),
+                similarity_shift_max=float(shift.max()),
+            )
+            result["ok"] = result["cosine_min"] >= args.min_cosine and result["similarity_shift_max"] <= args.max_shift
+            failures += not result["ok"]
+        results[backend] = result
+
+        line = f"{backend:<10} {result['docs_per_second']:8.1f} docs/s  load {load_seconds:5.1f}s"
+        if "speedup" in result:
+            line += (f"  x{result['speedup']:.2f}  cosine mean {result['cosine_mean']:.5f} min {result['cosine_min']:.5f}"
+                     f"  similarity shift mean {result['similarity_shift_mean']:.5f} max {result['similarity_shift_max']:.5f}"
+                     f"  {'ok' if result['ok'] else 'OUT OF TOLERANCE'}")
+        print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"documents": len(texts), "tolerance": {"min_cosine": args.min_cosine, "max_shift": args.max_shift},
+                       "backends": results}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
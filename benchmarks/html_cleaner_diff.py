@@ -0,0 +1,111 @@
+"""
+Differential check of the streaming HTML cleaner against the BeautifulSoup one it replaces.
+
+Both cleaners (app/utils/html_text.py) run over a random sample of RegInsightTextNative from the
+raw CSV. Every document whose text differs is reported with the first point of difference, and
+each document is timed with both cleaners (best of --repeat) to compare per-document latency.
+
+Usage (from the repository root):
+    python -m benchmarks.html_cleaner_diff [--csv data.csv] [--sample 2000] [--repeat 3] [--json results.json]
+
+Exits with status 1 if any document comes out differently.
+"""
+
+import argparse
+import csv
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))  # ingest uses bare imports
+
+from ingest import RAW_CSV, detect_encoding  # noqa: E402
+from app.utils.html_text import html_to_text, html_to_text_reference  # noqa: E402
+
+
+def sample_documents(path: Path, n: int, seed: int) -> list:
+    """Reservoir sample of (csv line, html) over the whole file."""
+    rng = random.Random(seed)
+    sample = []
+    csv.field_size_limit(sys.maxsize)
+    with open(path, "r", encoding=detect_encoding(path), errors="replace", newline="") as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            item = (i + 2, row.get("RegInsightTextNative") or "")
+            if len(sample) < n:
+                sample.append(item)
+            else:
+                slot = rng.randrange(i + 1)
+                if slot < n:
+                    sample[slot] = item
+    return sample
+
+
+def best_time(fn, html: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def first_difference(a: str, b: str, context: int = 40) -> str:
+    i = next((k for k, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+    return f"at char {i}: reference {a[max(0, i - context):i + context]!r} vs new {b[max(0, i - context):i + context]!r}"
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the streaming HTML cleaner with the BeautifulSoup reference.")
+    parser.add_argument("--csv", type=Path, default=RAW_CSV, help="raw RegInsight export to sample from")
+    parser.add_argument("--sample", type=int, default=2000, help="documents to compare")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per document and cleaner, the fastest counts")
+    parser.add_argument("--show", type=int, default=10, help="mismatches to print")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    documents = sample_documents(args.csv, args.sample, args.seed)
+    mismatches, reference_times, new_times = [], [], []
+    for line, html in documents:
+        reference, new = html_to_text_reference(html), html_to_text(html)
+        if reference != new:
+            mismatches.append({"line": line, "difference": first_difference(reference, new)})
+        reference_times.append(best_time(html_to_text_reference, html, args.repeat))
+        new_times.append(best_time(html_to_text, html, args.repeat))
+
+    print(f"{len(documents)} documents, {len(mismatches)} mismatches")
+    for mismatch in mismatches[:args.show]:
+        print(f"  csv line {mismatch['line']}: {mismatch['difference']}")
+
+    speedups = [r / n for r, n in zip(reference_times, new_times) if n > 0]
+    summary = {}
+    for name, times in (("reference", reference_times), ("new", new_times)):
+        summary[name] = {
+            "total_seconds": sum(times),
+            "median_ms": statistics.median(times) * 1000 if times else 0.0,
+            "p95_ms": percentile(times, 0.95) * 1000 if times else 0.0,
+            "max_ms": max(times, default=0.0) * 1000,
+        }
+        print(f"{name:<10} total {summary[name]['total_seconds']:7.2f}s  per document median {summary[name]['median_ms']:7.3f}ms"
+              f"  p95 {summary[name]['p95_ms']:7.3f}ms  max {summary[name]['max_ms']:8.3f}ms")
+    if speedups:
+        summary["speedup"] = {"median": statistics.median(speedups), "min": min(speedups), "max": max(speedups)}
+        print(f"speed-up per document: median x{summary['speedup']['median']:.1f}, "
+              f"min x{summary['speedup']['min']:.1f}, max x{summary['speedup']['max']:.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"documents": len(documents), "mismatches": mismatches, "timings": summary}, f, indent=2)
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Import-time budget for the entry points.
+
+Each entry module is imported in a fresh interpreter (best of --repeat runs) and fails the check
+if it takes longer than its budget or pulls in a heavy dependency that should only be loaded on
+first use (the embedding model, matplotlib, pandas, ...). The slowest imports of the best run are
+printed from python -X importtime to show where a regression comes from.
+
+Usage (from the repository root):
+    python -m benchmarks.import_time [--repeat 5] [--budget api=1.0] [--scale 2]
+
+Exits with status 1 if any entry point is over budget or imports a deferred dependency.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# name -> (module, directory it is imported from, budget in seconds, modules it must not import)
+ENTRY_POINTS = {
+    "api": ("app.api", ROOT, 1.5, ("pandas", "matplotlib", "sentence_transformers", "torch", "bs4", "sklearn")),
+    "ingest": ("ingest", ROOT / "app", 1.0, ("sentence_transformers", "torch", "bs4", "pandas", "matplotlib")),
+    "plotting": ("plotting", ROOT / "app", 1.0, ("matplotlib",)),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str, cwd: Path, forbidden) -> tuple:
+    """One cold import in a new interpreter. Returns (result dict, -X importtime report)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{completed.stderr[-2000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1]), completed.stderr
+
+
+def slowest_imports(report: str, top: int = 5) -> list:
+    """(cumulative microseconds, module) of the slowest imports in a -X importtime report."""
+    rows = []
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail if entry point import time regresses past its budget.")
+    parser.add_argument("--repeat", type=int, default=3, help="imports per entry point, the fastest counts")
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=SECONDS", help="override a budget")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, e.g. on slow CI machines")
+    parser.add_argument("--only", nargs="*", choices=sorted(ENTRY_POINTS), help="entry points to check")
+    args = parser.parse_args()
+
+    overrides = {name: float(seconds) for name, seconds in (b.split("=", 1) for b in args.budget)}
+    failures = 0
+    for name in args.only or ENTRY_POINTS:
+        module, cwd, budget, forbidden = ENTRY_POINTS[name]
+        budget = overrides.get(name, budget) * args.scale
+        runs = [measure(module, cwd, forbidden) for _ in range(args.repeat)]
+        best, report = min(runs, key=lambda run: run[0]["seconds"])
+
+        problems = []
+        if best["seconds"] > budget:
+            problems.append(f"over budget ({budget:.2f}s)")
+        if best["loaded"]:
+            problems.append(f"imports {', '.join(best['loaded'])} eagerly")
+        failures += bool(problems)
+
+        print(f"{'FAIL' if problems else 'ok  '} {name:<9} {best['seconds']:.3f}s  {'; '.join(problems)}")
+        for cumulative, imported in slowest_imports(report):
+            print(f"       {cumulative / 1e6:7.3f}s  {imported}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Synthetic corpus of document embeddings with a known similarity sequence, the generator from the
+Testing notes in READMEs/TASK_NOTES_README.txt.
+
+For every time bucket the reference jurisdiction gets a random unit direction u. Every other
+jurisdiction gets u mixed with a random direction orthogonal to it, target * u + sqrt(1 - target^2) * v,
+which has exactly the target cosine similarity with u. Documents are those directions plus
+independent noise. Noise makes up a share of each document and is near-orthogonal to everything
+in 384 dimensions, so a pair's similarity is (1 - noise) times that of the directions; the
+directions are mixed at target / (1 - noise) so the median and mean similarity of a bucket's
+document pairs come out at the target.
+
+Usage:
+    corpus = generate_corpus(n_docs=10_000, jurisdictions=("EU", "USA", "UK"), seed=0)
+    for batch in corpus.batches(1000):
+        insert_batch(batch)
+    corpus.targets  # {'USA': {'2024-01-01 to 2024-01-10': 0.42, ...}, ...} similarity to 'EU'
+"""
+
+import datetime
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Sequence
+
+import numpy as np
+
+from app.utils.buckets import bucket_label, bucket_windows, to_day_numbers
+from app.utils.vectors import EMBEDDING_DIM
+
+SYNTHETIC_CONCEPT = "Synthetic"
+
+
+def target_sequences(jurisdictions: Sequence[str], n_buckets: int, rng: np.random.Generator,
+                     low: float = 0.1, high: float = 0.75, waypoints: int = 4) -> Dict[str, np.ndarray]:
+    """
+    Per jurisdiction, a target similarity for every bucket: straight lines between random
+    waypoints in [low, high], so each sequence converges and diverges a few times.
+    """
+    targets = {}
+    for jurisdiction in jurisdictions:
+        anchors = rng.uniform(low, high, size=max(2, waypoints))
+        targets[jurisdiction] = np.interp(np.linspace(0, len(anchors) - 1, n_buckets), np.arange(len(anchors)), anchors)
+    return targets
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def pair_direction(u: np.ndarray, similarity: float, rng: np.random.Generator) -> np.ndarray:
+    """A unit vector whose cosine similarity with the unit vector u is exactly similarity."""
+    v = rng.standard_normal(u.shape)
+    v = _unit(v - np.dot(v, u) * u)  # orthogonal to u
+    return similarity * u + np.sqrt(1.0 - similarity ** 2) * v
+
+
+@dataclass
+class SyntheticCorpus:
+    """
+    Generated documents and the similarities they were generated with.
+
+    Attributes:
+        reference: the jurisdiction every target is relative to
+        granularity: bucket granularity the targets are defined for
+        targets: jurisdiction -> {bucket label: target similarity with the reference}
+        jurisdictions: jurisdiction of each document
+        days: published date of each document, as a day number
+        embeddings: (n, dim) float32 unit vectors
+        doc_ids: uuid of each document
+    """
+    reference: str
+    granularity: str
+    targets: Dict[str, Dict[str, float]]
+    jurisdictions: np.ndarray
+    days: np.ndarray
+    embeddings: np.ndarray
+    doc_ids: List[str]
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def row(self, i: int) -> dict:
+        """Document i as a cleaned ingest row, ready for insert_batch or CopyWriter."""
+        day = int(self.days[i])
+        starts, ends = bucket_windows("10d", day, day)
+        published = np.datetime64(day, "D").astype(datetime.date)
+        return {
+            "doc_id": self.doc_ids[i],
+            "jurisdiction": str(self.jurisdictions[i]),
+            "ontology_id": "",
+            "concept_names": SYNTHETIC_CONCEPT,
+            "ontology_ids": [],
+            "concepts": [SYNTHETIC_CONCEPT],
+            "time_bucket": bucket_label(starts[0], ends[0]),
+            "published_date": published,
+            "title": f"Synthetic {self.jurisdictions[i]} document {i}",
+            "clean_text": f"Synthetic {self.jurisdictions[i]} document {i}",
+            "embedding": self.embeddings[i].tolist(),
+            "content_hash": self.doc_ids[i].replace("-", ""),
+            "row_number": i,
+        }
+
+    def batches(self, batch_size: int) -> Iterator[List[dict]]:
+        """Rows in batches, built on demand so the python lists of a large corpus never all exist at once."""
+        for start in range(0, len(self), batch_size):
+            yield [self.row(i) for i in range(start, min(start + batch_size, len(self)))]
+
+
+def generate_corpus(n_docs: int, jurisdictions: Sequence[str] = ("EU", "USA", "UK"), n_buckets: int = 12,
+                    granularity: str = "10d", first_date: datetime.date = datetime.date(2024, 1, 1),
+                    noise: float = 0.2, low: float = 0.1, high: float = 0.75, seed: int = 0,
+                    dim: int = EMBEDDING_DIM) -> SyntheticCorpus:
+    """
+    About n_docs documents spread evenly over the jurisdictions and n_buckets buckets.
+
+    Args:
+        n_docs: corpus size, at least one document per jurisdiction and bucket
+        jurisdictions: the first is the reference the others' targets are relative to
+        n_buckets: number of consecutive buckets, starting with the one containing first_date
+        granularity: bucket granularity (not rolling, its windows overlap)
+        first_date: first day of the corpus
+        noise: share of each document's variance that is noise, 0 for identical documents per bucket
+        low: lowest target similarity
+        high: highest target similarity, at most 1 - noise
+        seed: random seed, the same arguments and seed give the same corpus
+        dim: embedding dimension
+
+    Raises:
+        ValueError: invalid arguments
+    """
+    if len(jurisdictions) < 2:
+        raise ValueError("Need a reference jurisdiction and at least one other")
+    if granularity.startswith("rolling"):
+        raise ValueError("Rolling windows overlap, use day, week, 10d or month")
+    if not 0.0 <= noise < 1.0 or not -1.0 <= low <= high <= 1.0 - noise:
+        raise ValueError("Need 0 <= noise < 1 and -1 <= low <= high <= 1 - noise")
+
+    rng = np.random.default_rng(seed)
+    first_day = int(to_day_numbers([first_date])[0])
+    starts, ends = bucket_windows(granularity, first_day, first_day + n_buckets * 31)
+    starts, ends = starts[:n_buckets], ends[:n_buckets]
+    per_bucket = max(1, n_docs // (len(jurisdictions) * n_buckets))
+    reference, others = jurisdictions[0], list(jurisdictions[1:])
+    sequences = target_sequences(others, n_buckets, rng, low, high)
+
+    all_jurisdictions, all_days, all_embeddings = [], [], []
+    for b, (start, end) in enumerate(zip(starts, ends)):
+        u = _unit(rng.standard_normal(dim))
+        directions = {reference: u, **{j: pair_direction(u, sequences[j][b] / (1.0 - noise), rng) for j in others}}
+        for jurisdiction, direction in directions.items():
+            noise_vectors = _unit(rng.standard_normal((per_bucket, dim)))
+            docs = np.sqrt(1.0 - noise) * direction + np.sqrt(noise) * noise_vectors
+            all_embeddings.append(_unit(docs).astype(np.float32))
+            all_jurisdictions.extend([jurisdiction] * per_bucket)
+            all_days.append(rng.integers(start, end + 1, size=per_bucket))
+
+    embeddings = np.vstack(all_embeddings)
+    targets = {j: {bucket_label(s, e): float(t) for s, e, t in zip(starts, ends, sequences[j])} for j in others}
+    doc_ids = [str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(len(embeddings))]
+    return SyntheticCorpus(reference, granularity, targets, np.array(all_jurisdictions), np.concatenate(all_days),
+                           embeddings, doc_ids)
+
+
+def mse(recovered: Dict[str, float], targets: Dict[str, float]) -> float:
+    """Mean squared error over the target buckets; a bucket missing from recovered counts as similarity 0."""
+    errors = [(recovered.get(bucket, 0.0) - target) ** 2 for bucket, target in targets.items()]
+    return float(np.mean(errors)) if errors else 0.0
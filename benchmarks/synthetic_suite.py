@@ -0,0 +1,255 @@
+"""
+Ingest and query benchmark over synthetic corpora of known similarity.
+
+For each corpus size a corpus is generated with benchmarks/synthetic_corpus.py, written to a
+throwaway database (created next to the configured one, dropped afterwards) with insert_batch
+and/or CopyWriter, and queried for every jurisdiction against the reference one through
+extract_embeddings, compute_similarity_over_time (median and mean) and the /similarity/ endpoint
+(called in process, cold and then from the result cache), then once more through
+compute_similarity_over_time reading a memory-mapped embedding store exported from the same
+data. Every timing is the best of --repeat runs except the writes, the export and the cold
+request, which only happen once.
+
+Next to the timings, the MSE between the recovered and the target similarity of every bucket is
+recorded, so a faster run that no longer gets the right answer shows up as a failure.
+
+Usage (from the repository root, with a database user allowed to create databases):
+    python -m benchmarks.synthetic_suite [--sizes 1000 10000 50000] [--writers insert copy] [--json results.json]
+
+Exits with status 1 if any MSE is above --max-mse.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))  # ingest uses bare imports
+
+from benchmarks.synthetic_corpus import generate_corpus, mse  # noqa: E402
+from app.utils import db_utils, embedding_store  # noqa: E402
+
+WRITERS = ("insert", "copy")
+
+
+def create_database(name: str) -> None:
+    """Create the throwaway database and point every later connection at it."""
+    conn = db_utils.db_conn()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+            cur.execute(f'CREATE DATABASE "{name}"')
+    finally:
+        conn.close()
+    # app.utils.db_utils reads DB_NAME when connecting; ingest's own copy of the module (imported
+    # as utils.db_utils) isn't imported yet and reads it from the environment
+    os.environ["DB_NAME"] = name
+    db_utils.DB_NAME = name
+
+
+def drop_database(name: str, original: str) -> None:
+    db_utils.DB_NAME = original
+    conn = db_utils.db_conn()
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+    finally:
+        conn.close()
+
+
+def best_of(repeat: int, fn, *args):
+    """(fastest seconds, result of the last run)."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def write_corpus(corpus, writer: str, batch_size: int) -> dict:
+    """Empty the tables and write the whole corpus with one writer."""
+    from ingest import CopyWriter, insert_batch
+
+    with db_utils.pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("TRUNCATE reginsights_clean, daily_aggregates")
+        db_utils.bump_dataset_generation(cur)
+
+    start = time.perf_counter()
+    if writer == "copy":
+        with CopyWriter() as copy_writer:
+            for batch in corpus.batches(batch_size):
+                copy_writer.write(batch)
+    else:
+        for batch in corpus.batches(batch_size):
+            insert_batch(batch)
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "rows_per_sec": len(corpus) / seconds}
+
+
+def query_jurisdiction(corpus, jurisdiction: str, repeat: int, loop) -> dict:
+    """Timings and MSE of every query path for one jurisdiction against the reference."""
+    from app import api
+    from app.similarity import compute_similarity_over_time, extract_embeddings
+
+    reference, targets, granularity = corpus.reference, corpus.targets[jurisdiction], corpus.granularity
+    result = {}
+
+    seconds, _ = best_of(repeat, extract_embeddings, reference, jurisdiction)
+    result["extract_embeddings_ms"] = seconds * 1000
+
+    for statistic in ("median", "mean"):
+        seconds, frame = best_of(repeat, compute_similarity_over_time, reference, jurisdiction, None, statistic, granularity)
+        recovered = dict(zip(frame["time_bucket"], frame["similarity"]))
+        result[f"similarity_{statistic}"] = {"ms": seconds * 1000, "mse": mse(recovered, targets)}
+
+    def request():
+        # the endpoint coroutine itself: limiter, coalescer, executor and result cache, without HTTP
+        return loop.run_until_complete(api.get_similarity(
+            country_a=reference, country_b=jurisdiction, statistic="median", granularity=granularity,
+            concepts=[], concept_match="any", start_date=None, end_date=None, last_n_buckets=None,
+        ))
+
+    cold, response = best_of(1, request)
+    warm, _ = best_of(repeat, request)
+    recovered = {r["time_bucket"]: r["similarity"] for r in response["similarity_sequence"]}
+    result["endpoint"] = {"cold_ms": cold * 1000, "warm_ms": warm * 1000, "mse": mse(recovered, targets)}
+    return result
+
+
+def query_store(corpus, jurisdiction: str, repeat: int, store_dir: str) -> dict:
+    """compute_similarity_over_time timings and MSE with similarity reading the embedding store."""
+    from app.similarity import compute_similarity_over_time
+
+    result = {}
+    embedding_store.EMBEDDING_STORE_DIR = store_dir
+    try:
+        for statistic in ("median", "mean"):
+            seconds, frame = best_of(repeat, compute_similarity_over_time, corpus.reference, jurisdiction, None, statistic,
+                                     corpus.granularity)
+            recovered = dict(zip(frame["time_bucket"], frame["similarity"]))
+            result[f"store_{statistic}"] = {"ms": seconds * 1000, "mse": mse(recovered, corpus.targets[jurisdiction])}
+    finally:
+        embedding_store.EMBEDDING_STORE_DIR = ""
+    return result
+
+
+def export_store(store_dir: str) -> dict:
+    conn = db_utils.db_conn()
+    try:
+        start = time.perf_counter()
+        snapshot = embedding_store.export_embedding_store(conn, store_dir)
+        seconds = time.perf_counter() - start
+    finally:
+        conn.close()
+    return {"seconds": seconds, "bytes": sum(p.stat().st_size for p in snapshot.iterdir())}
+
+
+def run_size(n_docs: int, args, loop) -> dict:
+    start = time.perf_counter()
+    corpus = generate_corpus(n_docs, args.jurisdictions, args.buckets, args.granularity, noise=args.noise, seed=args.seed)
+    result = {"docs": len(corpus), "generate_seconds": time.perf_counter() - start, "write": {}}
+
+    for writer in args.writers:
+        result["write"][writer] = write_corpus(corpus, writer, args.batch_size)
+    with db_utils.pooled_conn() as conn, conn.cursor() as cur:
+        cur.execute("ANALYZE reginsights_clean")
+
+    per_jurisdiction = {j: query_jurisdiction(corpus, j, args.repeat, loop) for j in corpus.targets}
+    store_dir = tempfile.mkdtemp(prefix="regbrain-bench-store-")
+    try:
+        result["store_export"] = export_store(store_dir)
+        for j in corpus.targets:
+            per_jurisdiction[j].update(query_store(corpus, j, args.repeat, store_dir))
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    result["jurisdictions"] = per_jurisdiction
+
+    # mean over the jurisdictions for the summary
+    def average(path):
+        values = []
+        for r in per_jurisdiction.values():
+            for key in path:
+                r = r[key]
+            values.append(r)
+        return statistics.mean(values)
+
+    result["summary"] = {
+        "extract_embeddings_ms": average(["extract_embeddings_ms"]),
+        **{f"similarity_{s}_{m}": average([f"similarity_{s}", m]) for s in ("median", "mean") for m in ("ms", "mse")},
+        **{f"store_{s}_{m}": average([f"store_{s}", m]) for s in ("median", "mean") for m in ("ms", "mse")},
+        **{f"endpoint_{m}": average(["endpoint", m]) for m in ("cold_ms", "warm_ms", "mse")},
+    }
+    return result
+
+
+def print_size(result: dict) -> None:
+    s = result["summary"]
+    writes = "  ".join(f"{w} {r['rows_per_sec']:8.0f} rows/s" for w, r in result["write"].items())
+    print(f"{result['docs']:>8} docs  generate {result['generate_seconds']:6.2f}s  {writes}")
+    print(f"          extract_embeddings {s['extract_embeddings_ms']:8.1f}ms"
+          f"  similarity median {s['similarity_median_ms']:8.1f}ms (mse {s['similarity_median_mse']:.2e})"
+          f"  mean {s['similarity_mean_ms']:8.1f}ms (mse {s['similarity_mean_mse']:.2e})")
+    print(f"          /similarity/ cold {s['endpoint_cold_ms']:8.1f}ms  warm {s['endpoint_warm_ms']:6.2f}ms"
+          f"  (mse {s['endpoint_mse']:.2e})")
+    print(f"          store export {result['store_export']['seconds']:6.2f}s"
+          f"  similarity median {s['store_median_ms']:8.1f}ms (mse {s['store_median_mse']:.2e})"
+          f"  mean {s['store_mean_ms']:8.1f}ms (mse {s['store_mean_mse']:.2e})")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingest and similarity queries on synthetic corpora of known similarity.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="corpus sizes in documents")
+    parser.add_argument("--jurisdictions", nargs="+", default=["EU", "USA", "UK"], help="the first is the reference")
+    parser.add_argument("--buckets", type=int, default=12, help="time buckets per corpus")
+    parser.add_argument("--granularity", default="10d")
+    parser.add_argument("--noise", type=float, default=0.2, help="share of each document embedding that is noise")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--writers", nargs="+", choices=WRITERS, default=list(WRITERS), help="writers to time, the last one's data is queried")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per write")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per query, the fastest counts")
+    parser.add_argument("--max-mse", type=float, default=1e-3, help="highest acceptable MSE against the targets")
+    parser.add_argument("--database", default=f"regbrain_bench_{os.getpid()}", help="name of the throwaway database")
+    parser.add_argument("--keep-database", action="store_true", help="don't drop the database afterwards")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # the disk tier of the result cache is keyed by dataset generation, which restarts with every
+    # throwaway database, so it could serve results from another run
+    os.environ["RESULT_CACHE_DIR"] = ""
+    original = db_utils.DB_NAME
+    create_database(args.database)
+    loop = asyncio.new_event_loop()
+    results = []
+    try:
+        db_utils.apply_migrations()
+        for n_docs in args.sizes:
+            results.append(run_size(n_docs, args, loop))
+            print_size(results[-1])
+    finally:
+        loop.close()
+        for module in {db_utils, sys.modules.get("utils.db_utils")} - {None}:
+            module.close_pool()
+        if not args.keep_database:
+            drop_database(args.database, original)
+
+    failures = [(r["docs"], name, value) for r in results for name, value in r["summary"].items()
+                if name.endswith("mse") and value > args.max_mse]
+    for docs, name, value in failures:
+        print(f"{docs} docs: {name} {value:.2e} is above {args.max_mse:.0e}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"}, "sizes": results}, f, indent=2)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())